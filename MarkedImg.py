@@ -16,10 +16,13 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import threading
+from itertools import count
+
 import numpy as np
 import gc
 
-from PySide2.QtCore import Qt, QDataStream, QFile, QIODevice, QSize, QPoint
+from PySide2.QtCore import Qt, QDataStream, QFile, QIODevice, QSize, QPoint, QByteArray
 
 import cv2
 from copy import copy
@@ -33,15 +36,21 @@ import exiftool
 from bLUeGui.memory import weakProxy
 
 from colorManagement import icc, cmsConvertQImage
-from bLUeGui.bLUeImage import QImageBuffer, ndarrayToQImage, bImage
+from bLUeGui.bLUeImage import QImageBuffer, QImageConstBuffer, ndarrayToQImage, bImage
 from bLUeGui.dialog import dlgWarn
 from time import time
 
-from lutUtils import LUT3DIdentity
+from bLUeCore.bLUeLUT3D import LUT3D, HaldArray
+from bLUeCore.cancellation import evaluationCancelled
+from lutUtils import LUT3DFusionIdentity
 from bLUeGui.baseSignal import baseSignal_bool, baseSignal_Int2, baseSignal_No
-from utils import qColorToRGB, historyList
+from utils import qColorToRGB, maskHistory
 
-from versatileImg import vImage
+from memoryManager import layerMemory, fault
+from outputCache import layerOutputCache, fingerprint
+from renderScheduler import renderScheduler, isGuiThread, lowerLayer, isDragging
+from settings import FUSE_LAYERS, ASYNC_RENDER, PREVIEW_LADDER, PREVIEW_DRAG_SIZE
+from versatileImg import vImage, compactMask
 
 
 class ColorSpace:
@@ -86,6 +95,10 @@ class mImage(vImage):
         self.layersStack = []
         # link to QLayerView instance
         self.layerView = None
+        # storage of the flag useHald, set by vImage.__init__()
+        self.haldMode = threading.local()
+        # set in the thread evaluating the full size stack in the background
+        self.backgroundMode = threading.local()
         super().__init__(*args, **kwargs)  # must be done before prLayer init.
         # background layer
         bgLayer = QLayer.fromImage(self, parentImage=self)
@@ -105,6 +118,199 @@ class mImage(vImage):
         self.isModified = False
         # link to rawpy instance
         self.rawImage = None
+        # asynchronous stack evaluation (cf. QLayer.applyToStackAsync())
+        self.scheduler = None
+        # size of the current thumbnails, or None for the full size
+        # image, and level of the preview mode (cf. setPreviewLevel())
+        self.previewLevel, self.previewBase = None, None
+        # widget displaying the image (cf. getPreviewLadder())
+        self.displayWidget = None
+        # fingerprint of the stack evaluated at full size (cf. getStackKey())
+        self.fullRenderKey = None
+
+    @property
+    def useHald(self):
+        """
+        Flag of the evaluation of the stack on the hald (cf. executeFusedRun()).
+        The flag is thread-local : while the render worker evaluates
+        a run of layers on the hald, the GUI thread still gets the images.
+        @return:
+        @rtype: boolean
+        """
+        return getattr(self.haldMode, 'value', False)
+
+    @useHald.setter
+    def useHald(self, value):
+        self.haldMode.value = value
+
+    @property
+    def useThumb(self):
+        """
+        Flag of the evaluation of the stack at a preview level (cf. setPreviewLevel()).
+        The flag is always False in the thread evaluating the full size stack
+        in the background (cf. isBackgroundThread()).
+        @return:
+        @rtype: boolean
+        """
+        return self.__useThumb and not self.isBackgroundThread()
+
+    @useThumb.setter
+    def useThumb(self, value):
+        self.__useThumb = value
+
+    def isBackgroundThread(self):
+        """
+        Returns True if the current thread evaluates the full size stack
+        in the background (cf. renderScheduler.startBackground()). The
+        thread gets the full size images and caches of layers (cf. levelAttribute).
+        @return:
+        @rtype: boolean
+        """
+        return getattr(self.backgroundMode, 'value', False)
+
+    def getScheduler(self):
+        """
+        Return the scheduler of asynchronous stack
+        evaluations, creating it if needed.
+        @return:
+        @rtype: renderScheduler
+        """
+        if self.scheduler is None:
+            self.scheduler = renderScheduler(self)
+        return self.scheduler
+
+    def flushRender(self):
+        """
+        Synchronously complete the asynchronous evaluation
+        of the stack, if any, and update the presentation layer.
+        """
+        if self.scheduler is None:
+            return
+        first = self.scheduler.takeOver()
+        if self.previewLevel != self.previewBase:
+            # complete the preview ladder at once
+            self.setPreviewLevel(self.previewBase)
+            first = self.layersStack[0]
+        if first is not None:
+            first.evaluateStack()
+        self.prLayer.execute(l=None, pool=None)
+
+    def getPreviewLadder(self):
+        """
+        Returns the preview levels, in increasing order : while a slider
+        is dragged, the stack is evaluated at the first level. When the slider is
+        released, it is evaluated at each level in turn (cf. renderScheduler.climb()),
+        up to the level of the preview mode (last item).
+        The first level is half the size of the displayed image, and at least PREVIEW_DRAG_SIZE.
+        @return: sizes of thumbnails, the last item is None for the full size image
+        @rtype: list
+        """
+        full = max(self.width(), self.height())
+        top = full if self.previewBase is None else self.previewBase
+        displayed = full if self.displayWidget is None else int(full * self.resize_coeff(self.displayWidget))
+        drag = min(max(PREVIEW_DRAG_SIZE, displayed // 2), vImage.thumbSize)
+        levels = sorted({size for size in (drag, vImage.thumbSize) if size < top})
+        return levels + [self.previewBase]
+
+    def setPreviewLevel(self, level, base=False):
+        """
+        Sets the resolution of the current images of the stack (cf. getCurrentImage()).
+        The images of each level are kept (cf. QLayer.swapPreviewLevel()) :
+        going back to a level does not re-evaluate unchanged layers.
+        The in-flight asynchronous evaluation, if any, is cancelled :
+        the caller must evaluate the whole stack.
+        If base is True, level becomes the level of the preview mode.
+        @param level: size of thumbnails, or None for the full size images
+        @type level: int
+        @param base:
+        @type base: boolean
+        """
+        if self.scheduler is not None:
+            self.scheduler.takeOver()
+        if base:
+            self.previewBase = level
+        if level == self.previewLevel and self.useThumb == (level is not None):
+            return
+        self.swapPreviewLevel(level)
+
+    def swapPreviewLevel(self, level):
+        """
+        Sets the resolution of the current images of the stack, without
+        cancelling the asynchronous evaluation (cf. setPreviewLevel()).
+        @param level: size of thumbnails, or None for the full size images
+        @type level: int
+        """
+        for layer in self.layersStack + [self.prLayer]:
+            layer.swapPreviewLevel(self.previewLevel, level)
+        if level is not None and level != self.thumbSize:
+            self.thumbSize = level
+            self.thumb = None
+        self.previewLevel = level
+        self.useThumb = level is not None
+
+    def enforceMemoryBudget(self):
+        """
+        Compresses the masks of inactive layers (cf. QLayer.compressMask()),
+        releases or spills layer buffers if the memory held by the image exceeds
+        MEMORY_BUDGET (cf. memoryManager.py), and updates the memory readout of
+        the layer view. Must be called by the GUI thread while no
+        evaluation is in progress.
+        """
+        active = self.getActiveLayer()
+        for layer in self.layersStack:
+            # the output of cloning and segmentation layers depends on their masks
+            if layer is not active and layer.isCachable():
+                layer.compressMask()
+        total = layerMemory.enforce(self)
+        if self.layerView is not None:
+            self.layerView.updateMemory(total)
+
+    def getStackKey(self):
+        """
+        Returns the fingerprint of the parameters of the visible layers, independent
+        of the preview level, or None if some layer output cannot be identified
+        (cf. QLayer.updateParamKey()). Layers without graphics form are identified
+        by the cache key of their full size image.
+        @return:
+        @rtype: bytes
+        """
+        items = []
+        for layer in self.layersStack:
+            if not layer.visible:
+                continue
+            if layer.getGraphicsForm() is None:
+                key = fingerprint('image', str(layer.cacheKey()))
+            else:
+                key = layer.paramKey
+            if key is None:
+                return None
+            items += [key, layer.getBlendRepr()]
+        return fingerprint(*items)
+
+    def requestPreviewLevel(self, level):
+        """
+        Switches to a preview level (cf. setPreviewLevel()) and requests
+        the asynchronous evaluation of the whole stack. The layers below the highest
+        layer which is not worker safe (cf. QLayer.isWorkerSafe()) are evaluated
+        at once : they are usually unchanged.
+        @param level: size of thumbnails, or None for the full size images
+        @type level: int
+        """
+        self.setPreviewLevel(level)
+        stack = self.layersStack
+        ind = 0
+        for i, layer in enumerate(stack):
+            if not layer.isWorkerSafe():
+                ind = i + 1
+        if ind > 0:
+            stop = stack[ind] if ind < len(stack) else None
+            stack[0].evaluateStack(cancelled=lambda layer: layer is stop)
+        if ind < len(stack):
+            self.getScheduler().request(stack[ind])
+        else:
+            self.prLayer.execute(l=None, pool=None)
+            self.onImageChanged()
+            self.getScheduler().climb()
 
     def bTransformed(self, transformation):
         """
@@ -118,7 +324,9 @@ class mImage(vImage):
         img = mImage(QImg=self.transformed(transformation))
         img.meta = self.meta
         img.onImageChanged = self.onImageChanged
-        img.useThumb = self.useThumb
+        # the transformed stack is evaluated at the level of the preview mode
+        img.previewLevel = img.previewBase = self.previewBase
+        img.useThumb = self.previewBase is not None
         img.useHald = self.useHald
         stack = []
         for layer in self.layersStack:
@@ -222,6 +430,61 @@ class mImage(vImage):
         for layer in self.layersStack:
             layer.cacheInvalidate()  # As Qlayer doesn't inherit from mImage, we call vImage.cacheInvalidate(layer)
 
+    def executeFusedRun(self, run, dirty=None):
+        """
+        Fuses a run of pointwise layers (cf. QLayer.getFusableRun()) into a
+        single 3D LUT : the run is evaluated on the identity hald and the resulting
+        LUT is applied once to the input image of the run, giving the output
+        image of the top layer of the run. The output images of the other layers
+        are not computed : they are flagged by isFusedStale and rebuilt
+        on demand (cf. QLayer.realizeFused()).
+        If dirty is not None, only this region of the input and output
+        images is updated (cf. QLayer.evaluateStack()).
+        Returns False if the run cannot be evaluated on the hald, or if its input
+        image is not opaque : the output of the top layer keeps the alpha channel of the input,
+        so the lower layers of the run would show through. In these cases
+        the caller must execute the layers of the run one by one.
+        @param run:
+        @type run: list of QLayer objects
+        @param dirty: region of the current image
+        @type dirty: QRect
+        @return:
+        @rtype: boolean
+        """
+        first, top = run[0], run[-1]
+        lower = self.layersStack[first.getLowerVisibleStackIndex()]
+        first.inputDirtyRect = dirty
+        try:
+            inputImage = first.inputImg()
+        finally:
+            first.inputDirtyRect = None
+        if QImageConstBuffer(inputImage)[:, :, 3].min() < 255:
+            return False
+        try:
+            self.useHald = True
+            # reset the input hald of the run
+            lower.initHald()
+            for layer in run:
+                layer.execute(l=layer)
+            # convert the output hald to a LUT3D object (BGR order)
+            hArray = HaldArray(QImageBuffer(top.getHald()), LUT3DFusionIdentity.size)
+            LUT = LUT3D.HaldBuffer2LUT3D(hArray)
+        except ValueError as e:
+            print('Layer fusion failed : %s' % str(e))
+            return False
+        finally:
+            self.useHald = False
+        top.dirtyRect = dirty
+        try:
+            top.apply3DLUT(LUT.getPrepared(), LUT.step, options={'use selection': False, 'keep alpha': True},
+                           inputImage=inputImage)
+        finally:
+            top.dirtyRect = None
+        for layer in run:
+            layer.cacheInvalidate()
+            layer.isFusedStale = layer is not top
+        return True
+
     def setThumbMode(self, value):
         if value == self.useThumb:
             return
@@ -374,7 +637,12 @@ class mImage(vImage):
         layer0 = self.layersStack[index]
         if layer0.isAdjustLayer():
             return
+        # the copies share the buffers of layer0 until one of them is modified
         layer1 = QLayer.fromImage(layer0, parentImage=self)
+        if layer0.thumb is not None:
+            layer1.thumb = QImage(layer0.thumb)
+            layer1.thumb.parentImage = layer1.parentImage
+            layer1.thumbSize = layer0.thumbSize
         self.addLayer(layer1, name=layer0.name, index=index+1)
 
     def mergeVisibleLayers(self):
@@ -400,6 +668,7 @@ class mImage(vImage):
         Overrides QImage.save().
         Writes the presentation layer to a file and returns a
         thumbnail with standard size (160x120 or 120x160).
+        In preview mode, the full size stack is evaluated.
         Raises IOError if the saving fails.
         @param filename:
         @type filename: str
@@ -413,47 +682,60 @@ class mImage(vImage):
         def transparencyCheck(buf):
             if np.any(buf[:, :, 3] < 255):
                 dlgWarn('Transparency will be lost. Use PNG format instead')
-        # don't save thumbnails
-        if self.useThumb:
-            return None
-        # get the final image from the presentation layer.
-        # This image is NOT color managed (prLayer.qPixmap
-        # only is color managed)
-        img = self.prLayer.getCurrentImage()
-        # imagewriter and QImage.save are unusable for tif files,
-        # due to bugs in libtiff, hence we use opencv imwrite.
-        fileFormat = filename[-3:].upper()
-        buf = QImageBuffer(img)
-        if fileFormat == 'JPG':
-            transparencyCheck(buf)
-            buf = buf[:, :, :3]
-            params = [cv2.IMWRITE_JPEG_QUALITY, quality]  # quality range 0..100
-        elif fileFormat == 'PNG':
-            params = [cv2.IMWRITE_PNG_COMPRESSION, compression]  # compression range 0..9
-        elif fileFormat == 'TIF':
-            transparencyCheck(buf)
-            buf = buf[:, :, :3]
-            params = []
-        else:
-            raise IOError("Invalid File Format\nValid formats are jpg, png, tif ")
-        if self.isCropped:
-            # make slices
-            w, h = self.width(), self.height()
-            w1, w2 = int(self.cropLeft), w - int(self.cropRight)
-            h1, h2 = int(self.cropTop), h - int(self.cropBottom)
-            buf = buf[h1:h2, w1:w2,:]
-        # build thumbnail from (evenyually) cropped image
-        # choose thumb size
-        wf, hf = buf.shape[1], buf.shape[0]
-        if wf > hf:
-            wt, ht = 160, 120
-        else:
-            wt, ht = 120, 160
-        thumb = ndarrayToQImage(np.ascontiguousarray(buf[:, :, :3][:, :, ::-1]),
-                                format=QImage.Format_RGB888).scaled(wt,ht, Qt.KeepAspectRatio)
-        written = cv2.imwrite(filename, buf, params)  # BGR order
-        if not written:
-            raise IOError("Cannot write file %s " % filename)
+        self.flushRender()
+        preview = self.previewBase
+        if preview is not None:
+            # Evaluate the full size stack. Layers already evaluated
+            # in the background (cf. renderScheduler.startBackground()) are skipped.
+            self.setPreviewLevel(None)
+        try:
+            if preview is not None:
+                self.layersStack[0].evaluateStack()
+                self.fullRenderKey = self.getStackKey()
+                # the presentation layer output is equal to its input
+                img = self.prLayer.inputImg()
+            else:
+                # get the final image from the presentation layer.
+                # This image is NOT color managed (prLayer.qPixmap
+                # only is color managed)
+                img = self.prLayer.getCurrentImage()
+            # imagewriter and QImage.save are unusable for tif files,
+            # due to bugs in libtiff, hence we use opencv imwrite.
+            fileFormat = filename[-3:].upper()
+            buf = QImageBuffer(img)
+            if fileFormat == 'JPG':
+                transparencyCheck(buf)
+                buf = buf[:, :, :3]
+                params = [cv2.IMWRITE_JPEG_QUALITY, quality]  # quality range 0..100
+            elif fileFormat == 'PNG':
+                params = [cv2.IMWRITE_PNG_COMPRESSION, compression]  # compression range 0..9
+            elif fileFormat == 'TIF':
+                transparencyCheck(buf)
+                buf = buf[:, :, :3]
+                params = []
+            else:
+                raise IOError("Invalid File Format\nValid formats are jpg, png, tif ")
+            if self.isCropped:
+                # make slices
+                w, h = self.width(), self.height()
+                w1, w2 = int(self.cropLeft), w - int(self.cropRight)
+                h1, h2 = int(self.cropTop), h - int(self.cropBottom)
+                buf = buf[h1:h2, w1:w2,:]
+            # build thumbnail from (evenyually) cropped image
+            # choose thumb size
+            wf, hf = buf.shape[1], buf.shape[0]
+            if wf > hf:
+                wt, ht = 160, 120
+            else:
+                wt, ht = 120, 160
+            thumb = ndarrayToQImage(np.ascontiguousarray(buf[:, :, :3][:, :, ::-1]),
+                                    format=QImage.Format_RGB888).scaled(wt,ht, Qt.KeepAspectRatio)
+            written = cv2.imwrite(filename, buf, params)  # BGR order
+            if not written:
+                raise IOError("Cannot write file %s " % filename)
+        finally:
+            if preview is not None:
+                self.setPreviewLevel(preview)
         # self.setModified(False) # cannot be reset if the image is modified again
         return thumb
 
@@ -521,7 +803,9 @@ class imImage(mImage):
         img = imImage(QImg=self.transformed(transformation))
         img.meta = self.meta
         img.onImageChanged = self.onImageChanged
-        img.useThumb = self.useThumb
+        # the transformed stack is evaluated at the level of the preview mode
+        img.previewLevel = img.previewBase = self.previewBase
+        img.useThumb = self.previewBase is not None
         img.useHald = self.useHald
         stack = []
         # apply transformation to the stack. Note that
@@ -598,10 +882,53 @@ class imImage(mImage):
         self.xOffset, self.yOffset = 0.0, 0.0
 
 
+class levelAttribute(object):
+    """
+    Layer attribute depending on the preview level (cf. QLayer.swapPreviewLevel()).
+    While the full size stack is evaluated in the background (cf.
+    renderScheduler.startBackground()), the thread evaluating it gets and sets
+    the values of the full size level, held by layer.fullState : the other
+    threads keep the values of the current preview level.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def getState(self, layer):
+        fullState = layer.__dict__.get('fullState', None)
+        if fullState is not None and layer.parentImage.isBackgroundThread():
+            return fullState
+        return layer.__dict__
+
+    def __get__(self, layer, owner=None):
+        if layer is None:
+            return self
+        try:
+            return self.getState(layer)[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, layer, value):
+        self.getState(layer)[self.name] = value
+
+
 class QLayer(vImage):
     """
     Base class for image layers
     """
+    # revisions of layer parameters, unique over all layers (cf. updateParamKey())
+    paramRevisions = count()
+
+    # caches of the evaluation of the layer, depending on the preview level
+    levelAttributes = ('outputKey', 'isFusedStale', 'rPixmapKey', 'pixmapKey', 'pixmapStale',
+                       'dirtyRect', 'inputDirtyRect')
+    outputKey = levelAttribute('outputKey')
+    isFusedStale = levelAttribute('isFusedStale')
+    rPixmapKey = levelAttribute('rPixmapKey')
+    pixmapKey = levelAttribute('pixmapKey')
+    pixmapStale = levelAttribute('pixmapStale')
+    dirtyRect = levelAttribute('dirtyRect')
+    inputDirtyRect = levelAttribute('inputDirtyRect')
+
     @classmethod
     def fromImage(cls, mImg, parentImage=None):
         """
@@ -663,7 +990,7 @@ class QLayer(vImage):
         # the graphics form associated with the layer
         self.view = None
         # undo/redo mask history
-        self.historyListMask = historyList(size=5)
+        self.historyListMask = maskHistory()
         # consecutive layers can be grouped.
         # A group is a list of QLayer objects
         self.group = []
@@ -673,6 +1000,38 @@ class QLayer(vImage):
         # clone dup layer shift and zoom  relative to current layer
         self.xAltOffset, self.yAltOffset = 0, 0
         self.AltZoom_coeff = 1.0
+        # True if the computation of the layer image
+        # was skipped by layer fusion (cf. applyToStack)
+        self.isFusedStale = False
+        # set if updatePixmap() was called by a worker thread (cf. renderScheduler)
+        self.pixmapStale = False
+        # fingerprints of the layer parameters and of
+        # the current output image (cf. getOutputKey()).
+        # paramRevision changes with the graphics form (cf. applyToStackAsync()).
+        self.paramRevision = next(self.paramRevisions)
+        self.paramKey = None
+        self.outputKey = None
+        # state of rPixmap (cf. restoreOutput())
+        self.pixmapKey = None
+        # region of the input image to recompose, or None
+        # for the whole image (cf. evaluateStack())
+        self.inputDirtyRect = None
+        # state of the layer image and mask drawn by rPixmap (cf. getDrawKey())
+        self.rPixmapKey = None
+        # opacity mask built from the current mask revision and the array
+        # holding its buffer (cf. getOpacityMask())
+        self.opacityMask, self.opacityMaskKey, self.opacityMaskBuffer = None, None, None
+        # colored mask built from the current mask revision (cf. getViewMask())
+        self.viewMask, self.viewMaskKey = None, None
+        # revision of a mask which can't be compressed (cf. compressMask())
+        self.__uncompressibleKey = None
+        # images and caches of the other preview levels (cf. swapPreviewLevel())
+        self.previewStates = {}
+        # caches of the full size level, while the stack is
+        # evaluated in the background (cf. levelAttribute)
+        self.fullState = None
+        # size (bytes) of the memory held by the layer (cf. memoryManager.getUsage())
+        self.memoryUsage = 0
         self.updatePixmap()
 
     def getGraphicsForm(self):
@@ -771,32 +1130,34 @@ class QLayer(vImage):
         super().initThumb()
         self.thumb.parentImage = self.parentImage
 
+    def identityHald(self):
+        """
+        Build a hald image from the identity 3D LUT used by layer
+        fusion (cf. lutUtils.LUT3DFusionIdentity). The hald is a bImage,
+        so its color space buffers can be used by the layer transformations.
+        @return:
+        @rtype: bImage
+        """
+        s = int(LUT3DFusionIdentity.size ** (3.0 / 2.0)) + 1
+        buf0 = LUT3DFusionIdentity.toHaldArray(s, s).haldBuffer
+        hald = bImage(QSize(s, s), QImage.Format_ARGB32)
+        buf1 = QImageBuffer(hald)
+        buf1[:, :, :3] = buf0
+        buf1[:, :, 3] = 255
+        hald.parentImage = self.parentImage
+        return hald
+
     def initHald(self):
         """
-        Build a hald image (as a QImage) from identity 3D LUT.
+        Build a hald image (as a bImage) from identity 3D LUT.
         """
         if not self.cachesEnabled:
             return
-        s = int(LUT3DIdentity.size ** (3.0 / 2.0)) + 1
-        buf0 = LUT3DIdentity.toHaldArray(s, s).haldBuffer
-        # self.hald = QLayer(QImg=QImage(QSize(190,190), QImage.Format_ARGB32))
-        self.hald = QImage(QSize(s, s), QImage.Format_ARGB32)
-        buf1 = QImageBuffer(self.hald)
-        buf1[:, :, :3] = buf0
-        buf1[:, :, 3] = 255
-        self.hald.parentImage = self.parentImage
+        self.hald = self.identityHald()
 
     def getHald(self):
         if not self.cachesEnabled:
-            s = int(LUT3DIdentity.size ** (3.0 / 2.0)) + 1
-            buf0 = LUT3DIdentity.toHaldArray(s, s).haldBuffer
-            # self.hald = QLayer(QImg=QImage(QSize(190,190), QImage.Format_ARGB32))
-            hald = QImage(QSize(s, s), QImage.Format_ARGB32)
-            buf1 = QImageBuffer(hald)
-            buf1[:, :, :3] = buf0
-            buf1[:, :, 3] = 255
-            hald.parentImage = self.parentImage
-            return hald
+            return self.identityHald()
         if self.hald is None:
             self.initHald()
         return self.hald
@@ -832,9 +1193,12 @@ class QLayer(vImage):
         @rtype: bImage
         """
         lower = self.parentImage.layersStack[self.getLowerVisibleStackIndex()]
+        if lower.isFusedStale and not self.parentImage.useHald:
+            lower.realizeFused()
+            redo = True
         container = lower.maskedThumbContainer if self.parentImage.useThumb else lower.maskedImageContainer
         if redo or container is None:
-            container = lower.getCurrentMaskedImage()
+            container = lower.getCurrentMaskedImage(region=self.inputDirtyRect)
             container.rPixmap = None  # invalidate and don't update
         else:
             if container.rPixmap is None:
@@ -858,14 +1222,39 @@ class QLayer(vImage):
             y = (y * currentImg.height()) / self.height()
         return int(x), int(y)
 
-    def getCurrentMaskedImage(self):
+    def full2CurrentRect(self, rect):
+        """
+        Maps a rectangle of the full image to a rectangle of the current
+        image containing it, clipped to the current image.
+        @param rect:
+        @type rect: QRect
+        @return:
+        @rtype: QRect
+        """
+        currentImg = self.getCurrentImage()
+        if self.parentImage.useThumb:
+            rx, ry = currentImg.width() / self.width(), currentImg.height() / self.height()
+            # 1 pixel margin for resampling
+            rect = QRect(QPoint(int(rect.left() * rx) - 1, int(rect.top() * ry) - 1),
+                         QPoint(int(rect.right() * rx) + 1, int(rect.bottom() * ry) + 1))
+        return rect.intersected(currentImg.rect())
+
+    def getCurrentMaskedImage(self, region=None):
         """
         Blend the layer stack up to self (included),
         taking into account the masks. The method uses the
         non color managed rPixmap to build the masked image.
         For convenience, mainly to be able to use its color space buffers,
         the built image is of type bImage. It is drawn on a container image,
-        instantiated only once.
+        instantiated only once. The container is tagged
+        with the fingerprint of the blended stack (cf. getCompositeKey())
+        and with the state of the blended layers (cf. getDrawKey()) : the
+        blending is incremental, starting from the container of the highest lower
+        layer which is up to date, and it is skipped if the container of self is up to date.
+        If region is not None, only this region of the container is redrawn :
+        the caller must ensure that the container is up to date outside of region.
+        @param region: region of the current image
+        @type region: QRect
         @return: masked image
         @rtype: bImage
         """
@@ -873,6 +1262,8 @@ class QLayer(vImage):
         # once and updated by drawing.
         if self.parentImage.useHald:
             return self.getHald()
+        if self.isFusedStale:
+            self.realizeFused()
         if self.maskedThumbContainer is None:
             self.maskedThumbContainer = bImage.fromImage(self.getThumb(), parentImage=self.parentImage)
         if self.maskedImageContainer is None:
@@ -881,42 +1272,261 @@ class QLayer(vImage):
             img = self.maskedThumbContainer
         else:
             img = self.maskedImageContainer
-        # draw lower stack
-        qp = QPainter(img)
         top = self.parentImage.getStackIndex(self)
         bottom = 0
-        for i, layer in enumerate(self.parentImage.layersStack[bottom:top+1]):
-            if layer.visible:
+        stack = self.parentImage.layersStack
+        # state of the layers to blend
+        drawKeys = [(i, layer.getDrawKey()) for i, layer in enumerate(stack[bottom:top+1])
+                    # layers skipped by fusion are hidden by the top layer of their run, which
+                    # is opaque, as the input of the run (cf. mImage.executeFusedRun())
+                    if layer.visible and not layer.isFusedStale]
+        if region is None and getattr(img, 'drawKey', None) == drawKeys:
+            # the container is up to date
+            img.compositeKey = self.getCompositeKey()
+            return img
+        # search for the highest lower container which is up to date
+        base = None
+        for n in range(len(drawKeys) - 1, -1, -1):
+            i = drawKeys[n][0]
+            if i == top:
+                continue
+            container = stack[i].maskedThumbContainer if self.parentImage.useThumb else stack[i].maskedImageContainer
+            if container is not None and getattr(container, 'drawKey', None) == drawKeys[:n+1]:
+                base, bottom = container, i + 1
+                break
+        # draw lower stack
+        qp = QPainter(img)
+        if region is not None:
+            qp.setClipRect(region)
+        if base is not None:
+            qp.setCompositionMode(QPainter.CompositionMode_Source)
+            qp.drawImage(QRect(0, 0, img.width(), img.height()), base)
+        for i, layer in enumerate(stack[bottom:top+1], start=bottom):
+            # layers skipped by fusion are hidden by the (opaque) top layer
+            # of their run (cf. mImage.executeFusedRun())
+            if layer.visible and not layer.isFusedStale:
                 if i == 0:
                     qp.setCompositionMode(QPainter.CompositionMode_Source)
                 else:
                     qp.setOpacity(layer.opacity)
                     qp.setCompositionMode(layer.compositionMode)
-                if layer.rPixmap is None:
-                    layer.rPixmap = QPixmap.fromImage(layer.getCurrentImage())  # TODO modified 9/12/18 validate
-                qp.drawPixmap(QRect(0,0,img.width(), img.height()), layer.rPixmap)
+                if not isGuiThread() or layer.pixmapStale:
+                    # rPixmap may be stale and pixmaps can't be built (cf. renderScheduler)
+                    qp.drawImage(QRect(0, 0, img.width(), img.height()), layer.getRenderedImage())
+                else:
+                    if layer.rPixmap is None:
+                        layer.rPixmap = QPixmap.fromImage(layer.getCurrentImage())  # TODO modified 9/12/18 validate
+                    qp.drawPixmap(QRect(0,0,img.width(), img.height()), layer.rPixmap)
                 # clipping
                 if layer.isClipping and layer.maskIsEnabled:
                     # draw mask as opacity mask
                     # mode DestinationIn (set dest opacity to source opacity)
                     qp.setCompositionMode(QPainter.CompositionMode_DestinationIn)
-                    omask = vImage.color2OpacityMask(layer.mask)
-                    qp.drawImage(QRect(0, 0, img.width(), img.height()), omask)
+                    qp.drawImage(QRect(0, 0, img.width(), img.height()), layer.getOpacityMask())
         qp.end()
+        img.drawKey = drawKeys
+        img.compositeKey = self.getCompositeKey()
         return img
 
-    def applyToStack(self):
+    def getFusableRun(self):
         """
-        Apply new layer parameters and propagate changes to upper layers.
+        Returns the list of consecutive visible layers, starting at self,
+        for which isFusable() is True. The run ends at the active layer, if any,
+        to keep its image, histograms and color picker up to date.
+        @return:
+        @rtype: list of QLayer objects
         """
-        # recursive function
-        def applyToStack_(layer, pool=None):
-            # apply transformation
-            if layer.visible:
-                start = time()
+        run = []
+        stack = self.parentImage.layersStack
+        active = self.parentImage.getActiveLayer()
+        ind = self.getStackIndex()
+        while ind >= 0 and stack[ind].isFusable():
+            run.append(stack[ind])
+            if stack[ind] is active:
+                break
+            ind = stack[ind].getUpperVisibleStackIndex()
+        return run
+
+    def isFusable(self):
+        """
+        Returns True if the layer can be fused with its neighbors
+        into a single 3D LUT (cf. applyToStack). The layer transformation must be
+        pointwise (cf. isPointwise()), must keep the alpha channel,
+        and the layer must be drawn as is : no mask, no selection rectangle,
+        no offset, opacity 1 and composition mode SourceOver.
+        @return:
+        @rtype: boolean
+        """
+        if not self.visible or not self.cachesEnabled or self.maskIsEnabled or self.rect is not None:
+            return False
+        if self.opacity < 1.0 or self.compositionMode != QPainter.CompositionMode_SourceOver:
+            return False
+        if self.xOffset != 0 or self.yOffset != 0:
+            return False
+        if not self.isPointwise():
+            return False
+        if self.actionName in ['action3D_LUT', 'action3D_LUT_HSB']:
+            return self.getGraphicsForm().scene().options['keep alpha']
+        return True
+
+    def isPointwise(self):
+        """
+        Returns True if the layer transformation is pointwise : the output
+        color of a pixel depends only on its input color.
+        Spatial (filters, noise reduction, cloning...) and image dependent (CLAHE,
+        automatic contrast curve, automatic film mask, chromatic adaptation)
+        transformations are not pointwise.
+        @return:
+        @rtype: boolean
+        """
+        form = self.getGraphicsForm()
+        if form is None:
+            return False
+        name = self.actionName
+        if name in ['actionCurves_RGB', 'actionCurves_HSpB', 'actionCurves_Lab', 'action2D_LUT_HV',
+                    'actionExposure_Correction', 'actionChannel_Mixer']:
+            return True
+        if name in ['action3D_LUT', 'action3D_LUT_HSB']:
+            return not form.scene().options['use selection']
+        if name == 'actionColor_Temperature':
+            # chromatic adaptation normalizes the result by the image max
+            return form.options['Photo Filter']
+        if name == 'actionContrast_Correction':
+            if form.contrastCorrection == 0:
+                return True
+            options = form.options
+            return not options['CLAHE'] and options['manualCurve'] and not getattr(self, 'autoSpline', True)
+        if name == 'actionInvert':
+            return not form.options['Auto']
+        return False
+
+    def getDirtyMargin(self):
+        """
+        Returns the margin (in pixels of the current image) added by the
+        layer transformation to a modified region of its input image : the
+        output pixels read input pixels at distance at most margin.
+        Pointwise transformations have margin 0. The margin is
+        None if the whole output image depends on each input pixel
+        (global transformations) or is not known.
+        @return:
+        @rtype: int
+        """
+        if self.rect is not None or self.Zoom_coeff != 1.0 or self.xOffset != 0 or self.yOffset != 0:
+            return None
+        form = self.getGraphicsForm()
+        if form is None:
+            return None
+        if self.isPointwise():
+            return 0
+        if self.actionName == 'actionFilter':
+            r = self.getCurrentImage().width() / self.width()
+            return int(form.radius * r) + 1
+        if self.actionName == 'actionNoise_Reduction':
+            return self.noiseMargin(form.options)
+        return None
+
+    def realizeFused(self):
+        """
+        Computes the image of a layer skipped by layer fusion,
+        executing the lower skipped layers of its run first.
+        """
+        stack = self.parentImage.layersStack
+        run = [self]
+        ind = self.getLowerVisibleStackIndex()
+        while ind >= 0 and stack[ind].isFusedStale:
+            run.insert(0, stack[ind])
+            ind = stack[ind].getLowerVisibleStackIndex()
+        for layer in run:
+            # reset the flag first : inputImg() checks the lower layer
+            layer.isFusedStale = False
+            try:
                 layer.execute(l=layer)
-                layer.cacheInvalidate()
-                print("%s %.2f" % (layer.name, time()-start))
+            except evaluationCancelled:
+                # the image is partially computed
+                layer.isFusedStale = True
+                raise
+            layer.cacheInvalidate()
+
+    def evaluateStack(self, cancelled=None, deferred=None, dirty=None):
+        """
+        Apply new layer parameters to self and to the upper visible
+        layers, in increasing stack order.
+        If FUSE_LAYERS is True (cf. config.json), runs of consecutive
+        fusable layers (cf. isFusable()) are evaluated as a single 3D LUT.
+        If dirty is not None, the input image of self is only modified
+        in this region. The region is propagated through the stack, expanded
+        by the margin of each layer (cf. getDirtyMargin()) : when possible
+        (cf. isPatchable()) layers recompute and recompose only this region.
+        Before each layer, cancelled(layer) is called, if not None : if
+        it returns True, the evaluation stops. Kernels may also stop the evaluation
+        of a layer (cf. bLUeCore.cancellation) : cancelled(layer) is then called again.
+        If deferred is not None, the updates of graphic forms are
+        appended to it instead of being done, as they must be run
+        by the GUI thread.
+        @param cancelled:
+        @type cancelled: function
+        @param deferred:
+        @type deferred: list
+        @param dirty: region of the current image
+        @type dirty: QRect
+        @return: None if the evaluation completed, otherwise the first layer not evaluated
+        @rtype: QLayer
+        """
+        layer = self
+        while layer is not None:
+            if cancelled is not None and cancelled(layer):
+                return layer
+            # apply transformation
+            run = []
+            try:
+                if layer.visible:
+                    start = time()
+                    key = layer.getOutputKey()
+                    unchanged = key is not None and key == layer.outputKey and not layer.isFusedStale
+                    # layer fusion is disabled while building a 3D LUT from the stack
+                    run = layer.getFusableRun() if FUSE_LAYERS and not layer.parentImage.isHald else []
+                    # the run is made of pointwise layers : the modified region is not expanded
+                    runDirty = dirty if dirty is not None and len(run) > 1 and layer.isPatchable(run) else None
+                    if layer.restoreOutput(key):
+                        # unchanged layer : the modified region
+                        # of the input image is passed through
+                        if not unchanged:
+                            dirty = None
+                        print("%s (cached) %.2f" % (layer.name, time()-start))
+                    elif len(run) > 1 and layer.parentImage.executeFusedRun(run, dirty=runDirty):
+                        dirty = runDirty
+                        for l in run:
+                            l.outputKey = l.getOutputKey()
+                        layer = run[-1]
+                        layer.storeOutput()
+                        print("%s %.2f" % (' + '.join(l.name for l in run), time()-start))
+                    else:
+                        margin = layer.getDirtyMargin()
+                        if dirty is not None and margin is not None and layer.isPatchable():
+                            layer.inputDirtyRect = dirty
+                            dirty = dirty.adjusted(-margin, -margin, margin, margin).intersected(
+                                                                                  layer.getCurrentImage().rect())
+                            layer.dirtyRect = dirty
+                        else:
+                            dirty = None
+                        try:
+                            layer.execute(l=layer)
+                        finally:
+                            layer.dirtyRect, layer.inputDirtyRect = None, None
+                        layer.cacheInvalidate()
+                        layer.isFusedStale = False
+                        layer.outputKey = key
+                        layer.storeOutput()
+                        print("%s %.2f" % (layer.name, time()-start))
+            except evaluationCancelled:
+                # cancelled by a kernel (cf. bLUeCore.cancellation) : the
+                # output images of the layer, or of its run, are partially computed
+                for l in [layer] + run:
+                    l.outputKey = None
+                if cancelled is not None:
+                    # put the layer back into the pending requests
+                    cancelled(layer)
+                return layer
             stack = layer.parentImage.layersStack
             lg = len(stack)
             ind = layer.getStackIndex() + 1
@@ -925,25 +1535,384 @@ class QLayer(vImage):
             if ind < lg:
                 grForm = stack[ind].getGraphicsForm()
                 if grForm is not None:
-                    grForm.updateHists()
+                    if deferred is None:
+                        grForm.updateHists()
+                    else:
+                        deferred.append(grForm.updateHists)
             # get next upper visible layer
             while ind < lg:
                 if stack[ind].visible:
                     break
                 ind += 1
-            if ind < lg:
-                layer1 = stack[ind]
-                applyToStack_(layer1, pool=pool)
+            layer = stack[ind] if ind < lg else None
+        return None
+
+    def isCachable(self):
+        """
+        Return True if the output image of the layer is determined by its
+        input and graphics form : the output of cloning and segmentation
+        layers depends on their masks and on user interaction.
+        @return:
+        @rtype: boolean
+        """
+        return not (self.isCloningLayer() or self.isSegmentLayer())
+
+    def updateParamKey(self):
+        """
+        Compute the fingerprint of the layer parameters from the data
+        serialized by the graphics form (cf. writeToStream()) and the
+        selection rectangle, so that restoring previous parameters restores
+        the cached output image. The forms which do not serialize their
+        whole state (cf. abstractForm.streamIsPartial) are identified by
+        paramRevision instead : each change made in the form is a new revision.
+        The fingerprint is None if the output image cannot be cached.
+        The method reads widgets : it must be called by the GUI thread.
+        """
+        form = self.getGraphicsForm()
+        if form is None or not hasattr(form, 'writeToStream') or not self.isCachable():
+            self.paramKey = None
+            return
+        if form.streamIsPartial:
+            self.paramKey = fingerprint('revision', repr((self.paramRevision, self.rect)))
+            return
+        data = QByteArray()
+        form.writeToStream(QDataStream(data, QIODevice.WriteOnly))
+        self.paramKey = fingerprint(data.data(), repr(self.rect))
+
+    def getOutputKey(self):
+        """
+        Return the fingerprint of the output image of the layer, computed from the
+        fingerprints of its input (i.e. the composition of the lower visible
+        layers, cf. getCurrentMaskedImage()) and of its parameters, or None if it is unknown.
+        Layers without graphics form are not evaluated : they are identified
+        by the cache key of their image, which changes with the image contents.
+        @return:
+        @rtype: bytes
+        """
+        img = self.parentImage
+        if img.useHald or img.isHald or not self.cachesEnabled:
+            return None
+        if self.getGraphicsForm() is None:
+            return fingerprint('image', str(self.getCurrentImage().cacheKey()))
+        ind = self.getLowerVisibleStackIndex()
+        inputKey = img.layersStack[ind].getCompositeKey() if ind >= 0 else b''
+        return self.makeOutputKey(inputKey)
+
+    def makeOutputKey(self, inputKey):
+        """
+        Return the fingerprint of the output image of the layer
+        for the current parameters and an input image, given its fingerprint.
+        @param inputKey: input fingerprint
+        @type inputKey: bytes
+        @return:
+        @rtype: bytes
+        """
+        if self.paramKey is None or inputKey is None:
+            return None
+        current = self.getCurrentImage()
+        return fingerprint(self.paramKey, '%d %d' % (current.width(), current.height()), inputKey)
+
+    def makeCompositeKey(self, inputKey, outputKey):
+        """
+        Return the fingerprint of the blending of an output image of the layer
+        with its input image (cf. getCurrentMaskedImage()), given their fingerprints.
+        @param inputKey: input fingerprint
+        @type inputKey: bytes
+        @param outputKey: output fingerprint
+        @type outputKey: bytes
+        @return:
+        @rtype: bytes
+        """
+        if inputKey is None or outputKey is None:
+            return None
+        return fingerprint(inputKey, outputKey, self.getBlendRepr())
+
+    def getBlendRepr(self):
+        """
+        Return a description of the parameters used to blend
+        the layer with its input (cf. getCurrentMaskedImage()).
+        @return:
+        @rtype: str
+        """
+        mask = str(self.getMaskKey()) if self.maskIsEnabled else ''
+        return repr((self.opacity, self.compositionMode, self.isClipping,
+                     self.maskIsEnabled, self.maskIsSelected, mask,
+                     self.xOffset, self.yOffset, self.Zoom_coeff))
+
+    def getCompositeKey(self):
+        """
+        Return the fingerprint of the blending of the visible layers
+        of the stack up to self (included), or None if it is unknown.
+        @return:
+        @rtype: bytes
+        """
+        key = b''
+        for layer in self.parentImage.layersStack[:self.getStackIndex() + 1]:
+            if layer.visible:
+                key = layer.makeCompositeKey(key, layer.outputKey)
+        return key
+
+    def isPatchable(self, run=None):
+        """
+        Returns True if the current output image of the layer (or of the top
+        layer of run, a list of consecutive visible layers starting at self) was
+        computed, with the current parameters, from the input image
+        currently held by the container of the lower layer (cf. inputImg()).
+        In this case, when the input changes in some region only, the output can
+        be updated by recomputing the region expanded by the margins of
+        the layers (cf. evaluateStack()).
+        @param run:
+        @type run: list of QLayer objects
+        @return:
+        @rtype: boolean
+        """
+        if run is None:
+            run = [self]
+        top = run[-1]
+        img = self.parentImage
+        ind = self.getLowerVisibleStackIndex()
+        if top.outputKey is None or top.isFusedStale or ind < 0:
+            return False
+        lower = img.layersStack[ind]
+        container = lower.maskedThumbContainer if img.useThumb else lower.maskedImageContainer
+        key = getattr(container, 'compositeKey', None)
+        for layer in run[:-1]:
+            key = layer.makeCompositeKey(key, layer.makeOutputKey(key))
+        return top.outputKey == top.makeOutputKey(key)
+
+    def restoreOutput(self, key):
+        """
+        Try to set the output image of the layer, given its fingerprint, without
+        evaluating the layer : the current image is kept if its fingerprint is key,
+        otherwise the image is searched for in the cache of layer outputs.
+        @param key: output fingerprint
+        @type key: bytes
+        @return: True if the output image is set
+        @rtype: boolean
+        """
+        if key is None or self.isFusedStale:
+            return False
+        if key != self.outputKey:
+            buf = layerOutputCache.get(key)
+            current = self.getCurrentImage()
+            if buf is None or buf.shape != (current.height(), current.width(), 4):
+                return False
+            QImageBuffer(current)[...] = buf
+            self.outputKey = key
+            self.cacheInvalidate()
+        # mask settings may have changed
+        pixmapKey = (key, self.getMaskKey(), self.maskIsEnabled, self.maskIsSelected,
+                     self.xOffset, self.yOffset, self.Zoom_coeff)
+        if self.rPixmap is None or pixmapKey != self.pixmapKey:
+            self.updatePixmap()
+            self.pixmapKey = pixmapKey
+        return True
+
+    def storeOutput(self):
+        """
+        Add the current output image of the layer to the cache. The image
+        is read without detaching it from the images sharing its buffer
+        (cf. vImage.forwardImage()).
+        """
+        if self.outputKey is not None and self.getGraphicsForm() is not None:
+            layerOutputCache.put(self.outputKey, QImageConstBuffer(self.getCurrentImage()))
+
+    def updateParamKeys(self):
+        """
+        Update the parameter fingerprints of self and of the upper layers.
+        """
+        stack = self.parentImage.layersStack
+        for layer in stack[self.getStackIndex():]:
+            layer.updateParamKey()
+
+    def getFirstToEvaluate(self):
+        """
+        Return the first layer to evaluate when the parameters
+        of self change : if the input of self was skipped by layer
+        fusion, this is the first layer of the fused run.
+        @return:
+        @rtype: QLayer
+        """
+        first = self
+        stack = self.parentImage.layersStack
+        ind = self.getLowerVisibleStackIndex()
+        while ind >= 0 and stack[ind].isFusedStale:
+            first = stack[ind]
+            ind = first.getLowerVisibleStackIndex()
+        return first
+
+    def swapPreviewLevel(self, old, new):
+        """
+        Saves the current images and caches of the layer as those of
+        the preview level old, and restores those of the preview
+        level new (cf. mImage.setPreviewLevel()).
+        @param old: size of thumbnails, or None for the full size image
+        @type old: int
+        @param new: size of thumbnails, or None for the full size image
+        @type new: int
+        """
+        self.previewStates[old] = (self.thumb, self.maskedThumbContainer, self.outputKey, self.isFusedStale,
+                                   self.rPixmap, self.rPixmapKey, self.pixmapKey, self.pixmapStale,
+                                   self.cacheKey())
+        state = self.getPreviewState(new)
+        self.previewStates.pop(new, None)
+        (self.thumb, self.maskedThumbContainer, self.outputKey, self.isFusedStale,
+         self.rPixmap, self.rPixmapKey, self.pixmapKey, self.pixmapStale, _) = state
+        if new is not None:
+            self.thumbSize = new
+        self.cacheInvalidate()
+
+    def getPreviewState(self, level):
+        """
+        Returns the images and caches saved for a preview level
+        which is not the current one (cf. swapPreviewLevel()).
+        @param level: size of thumbnails, or None for the full size image
+        @type level: int
+        @return:
+        @rtype: tuple
+        """
+        state = self.previewStates.get(level, None)
+        if state is not None and self.getGraphicsForm() is None and state[-1] != self.cacheKey():
+            # the thumbnail was scaled from a modified image
+            state = None
+        if state is None:
+            state = (None, None, None, False, None, None, None, False, None)
+        return state
+
+    def beginBackground(self):
+        """
+        Initializes the caches of the full size level used by the
+        evaluation of the stack in the background (cf. levelAttribute)
+        from the state saved for this level.
+        """
+        state = self.getPreviewState(None)
+        self.fullState = dict(zip(self.levelAttributes, (state[2], state[3], state[5], state[6], state[7], None, None)))
+
+    def endBackground(self):
+        """
+        Saves the caches of the full size level updated by the evaluation
+        of the stack in the background as the state of this level.
+        """
+        fullState, self.fullState = self.fullState, None
+        if fullState is None:
+            return
+        state = self.getPreviewState(None)
+        self.previewStates[None] = (state[0], state[1], fullState['outputKey'], fullState['isFusedStale'], state[4],
+                                    fullState['rPixmapKey'], fullState['pixmapKey'], fullState['pixmapStale'],
+                                    self.cacheKey())
+
+    def getSpillables(self):
+        """
+        Returns the large ndarray caches of the layer, which can be spilled to
+        disk by the memory manager (cf. memoryManager.py) : they must be
+        accessed through properties loading them back (cf. memoryManager.fault()).
+        @return: dict of attribute names and values
+        @rtype: dict
+        """
+        return {}
+
+    def canPreviewDrag(self):
+        """
+        Returns True if the stack can be evaluated while a slider of the layer
+        form is dragged : it is evaluated asynchronously, at a low resolution
+        (cf. mImage.getPreviewLadder()).
+        @return:
+        @rtype: boolean
+        """
+        img = self.parentImage
+        if not (PREVIEW_LADDER and ASYNC_RENDER) or img.isHald or len(img.getPreviewLadder()) < 2:
+            return False
+        return all(l.isWorkerSafe() for l in img.layersStack[self.getFirstToEvaluate().getStackIndex():])
+
+    def isWorkerSafe(self):
+        """
+        Return True if the layer can be evaluated by a worker thread :
+        cloning and segmentation layers paint pixmaps and process events,
+        raw layers update their forms.
+        @return:
+        @rtype: boolean
+        """
+        return not (self.isCloningLayer() or self.isSegmentLayer() or self.isRawLayer())
+
+    def applyToStack(self, dirty=None):
+        """
+        Apply new layer parameters and propagate changes to upper layers.
+        The evaluation is synchronous : an in-flight asynchronous
+        evaluation is cancelled and merged into it (cf. applyToStackAsync()).
+        If dirty is not None, the changes are limited to this region of
+        the blended stack (e.g. mask painting) : upper layers recompute and
+        recompose only the region, expanded by their margins (cf. evaluateStack()).
+        @param dirty: region of the full size image
+        @type dirty: QRect
+        """
+        first = self.getFirstToEvaluate()
+        scheduler = self.parentImage.scheduler
+        if scheduler is not None and isGuiThread():
+            pending = scheduler.takeOver()
+            if pending is not None:
+                dirty = None
+            first = lowerLayer(first, pending)
+        if isGuiThread():
+            first.updateParamKeys()
+        if first is not self or self.parentImage.useHald:
+            dirty = None
+        if dirty is not None:
+            dirty = self.full2CurrentRect(dirty)
+            if dirty.isEmpty():
+                dirty = None
         try:
             QApplication.setOverrideCursor(Qt.WaitCursor)
             QApplication.processEvents()
-            applyToStack_(self, pool=None)
+            first.evaluateStack(dirty=dirty)
             # update the presentation layer
             self.parentImage.prLayer.execute(l=None, pool=None)
+            if isGuiThread():
+                self.parentImage.enforceMemoryBudget()
+            # go on with the preview ladder, if needed
+            if scheduler is not None and isGuiThread():
+                scheduler.climb()
         finally:
             self.parentImage.setModified(True)
             QApplication.restoreOverrideCursor()
             QApplication.processEvents()
+
+    def applyToStackAsync(self):
+        """
+        Apply new layer parameters and propagate changes to upper layers
+        in a worker thread (cf. renderScheduler). The presentation layer
+        and the displayed image are updated when the evaluation completes.
+        Newer requests cancel the in-flight evaluation, so this method
+        should be used for interactive changes (layer forms).
+        While a slider is dragged, the stack is evaluated at a low
+        resolution (cf. mImage.getPreviewLadder()).
+        If ASYNC_RENDER is False (cf. config.json), or if some layer
+        to evaluate is not worker safe (cf. isWorkerSafe()), the evaluation
+        is synchronous.
+        """
+        img = self.parentImage
+        if img.scheduler is not None:
+            # the full size stack is evaluated again when the user is idle
+            img.scheduler.stopBackground()
+        # a change in the form
+        self.paramRevision = next(self.paramRevisions)
+        first = self.getFirstToEvaluate()
+        if not ASYNC_RENDER or img.isHald or \
+                not all(l.isWorkerSafe() for l in img.layersStack[first.getStackIndex():]):
+            self.applyToStack()
+            img.onImageChanged()
+            return
+        # widgets are read by the GUI thread only
+        first.updateParamKeys()
+        scheduler = img.getScheduler()
+        if isDragging() and self.canPreviewDrag():
+            level = img.getPreviewLadder()[0]
+            if level != img.previewLevel:
+                # start the preview ladder
+                scheduler.watchRelease()
+                img.requestPreviewLevel(level)
+                return
+        scheduler.request(first)
+
     """
     def applyToStackIter(self):
         #iterative version of applyToStack
@@ -994,15 +1963,147 @@ class QLayer(vImage):
         @param maskOnly: not used : for consistency with overriding method signature
         @type maskOnly: boolean
         """
+        if not isGuiThread():
+            # pixmaps can only be built by the GUI thread
+            self.pixmapStale = True
+            return
+        self.rPixmap = QPixmap.fromImage(self.getRenderedImage())
+        self.rPixmapKey = self.getRenderKey()
+        self.setModified(True)
+
+    def getRenderedImage(self):
+        """
+        Return the image drawn by rPixmap : the current
+        image, translated and masked (cf. updatePixmap()).
+        @return:
+        @rtype: QImage
+        """
         rImg = self.getCurrentImage()
         # apply layer transformation. Missing pixels are set to QColor(0,0,0,0)
         if self.xOffset != 0 or self.yOffset != 0:
             x,y = self.full2CurrentXY(self.xOffset, self.yOffset)
             rImg = rImg.copy(QRect(-x, -y, rImg.width()*self.Zoom_coeff, rImg.height()*self.Zoom_coeff))
         if self.maskIsEnabled:
-            rImg = vImage.visualizeMask(rImg, self.mask, color=self.maskIsSelected, clipping=True)  # self.isClipping)
-        self.rPixmap = QPixmap.fromImage(rImg)
-        self.setModified(True)
+            # the mask views are cached
+            if self.maskIsSelected:
+                rImg = vImage.visualizeMask(rImg, None, color=True, clipping=True, viewMask=self.getViewMask())
+            else:
+                rImg = vImage.visualizeMask(rImg, None, color=False, clipping=True, opacityMask=self.getOpacityMask())
+        return rImg
+
+    def getRenderKey(self):
+        """
+        Return the state of the layer image and mask
+        determining the image returned by getRenderedImage().
+        @return:
+        @rtype: tuple
+        """
+        return (self.getCurrentImage().cacheKey(), self.getMaskKey() if self.maskIsEnabled else None,
+                self.maskIsEnabled, self.maskIsSelected, self.xOffset, self.yOffset, self.Zoom_coeff)
+
+    def getDrawKey(self):
+        """
+        Return the state of the layer determining its contribution
+        to the blended stack (cf. getCurrentMaskedImage()).
+        @return:
+        @rtype: tuple
+        """
+        key = self.getRenderKey()
+        if isGuiThread() and not self.pixmapStale and self.rPixmapKey != key:
+            # rPixmap is drawn, but it was not built by updatePixmap()
+            # from the current state of the layer
+            key = ('pixmap', None if self.rPixmap is None else self.rPixmap.cacheKey())
+        return key + (self.opacity, self.compositionMode, self.isClipping,
+                      self.getMaskKey() if self.isClipping and self.maskIsEnabled else None)
+
+    def getOpacityMask(self):
+        """
+        Return the opacity mask built from the layer mask (cf. vImage.color2AlphaMask()),
+        a Format_Alpha8 image. The opacity mask is cached, and rebuilt only when the
+        mask is modified. The returned image must not be modified.
+        @return:
+        @rtype: QImage
+        """
+        key = self.getMaskKey()
+        if self.opacityMask is None or self.opacityMaskKey != key:
+            if self.__compactMask is not None:
+                self.opacityMask, self.opacityMaskBuffer = self.__compactMask.alphaMask()
+            else:
+                self.opacityMask, self.opacityMaskBuffer = vImage.color2AlphaMask(self.__mask)
+            self.opacityMaskKey = key
+        return self.opacityMask
+
+    def getViewMask(self):
+        """
+        Return the colored representation of the layer mask (cf. vImage.color2ViewMask()).
+        It is cached, and rebuilt only when the mask is modified.
+        The returned image must not be modified.
+        @return:
+        @rtype: QImage
+        """
+        key = self.getMaskKey()
+        if self.viewMask is None or self.viewMaskKey != key:
+            # a compressed mask is not rebuilt
+            mask = self.__compactMask.toQImage() if self.__compactMask is not None else self.__mask
+            self.viewMask = vImage.color2ViewMask(mask)
+            self.viewMaskKey = key
+        return self.viewMask
+
+    @property
+    def mask(self):
+        if self.__compactMask is not None:
+            # rebuild the mask (cf. compressMask()) : the
+            # mask revision is kept until it is modified.
+            self.__mask, self.__compactMask = self.__compactMask.toQImage(), None
+            self.__maskAlias = (self.__mask.cacheKey(), self.__compactKey)
+        return self.__mask
+
+    @mask.setter
+    def mask(self, mask):
+        self.__mask, self.__compactMask, self.__maskAlias = mask, None, None
+
+    def getMaskKey(self):
+        """
+        Return the revision of the layer mask. Unlike
+        self.mask.cacheKey(), it does not rebuild a compressed mask.
+        @return:
+        @rtype: int
+        """
+        if self.__compactMask is not None:
+            return self.__compactKey
+        if self.__mask is None:
+            return None
+        key = self.__mask.cacheKey()
+        if self.__maskAlias is not None and self.__maskAlias[0] == key:
+            return self.__maskAlias[1]
+        return key
+
+    def compressMask(self):
+        """
+        Replaces the layer mask by its compact representation (cf. versatileImg.compactMask),
+        if possible. The mask is rebuilt when the attribute mask is read. Masks shared by
+        a group of layers (cf. linkMask2Lower()) are not compressed.
+        """
+        if self.__compactMask is not None or self.__mask is None or self.group:
+            return
+        key = self.getMaskKey()
+        if key == self.__uncompressibleKey:
+            return
+        compact = compactMask.fromQImage(self.__mask)
+        if compact is None:
+            self.__uncompressibleKey = key
+            return
+        self.__mask, self.__compactMask, self.__compactKey = None, compact, key
+
+    def getMaskBuffers(self):
+        """
+        Return the buffers holding the layer mask.
+        @return:
+        @rtype: list
+        """
+        if self.__compactMask is not None:
+            return self.__compactMask.buffers()
+        return [self.__mask]
 
     def getStackIndex(self):
         """
@@ -1151,6 +2252,7 @@ class QLayer(vImage):
         """
         reset layer to inputImg
         """
+        self.outputKey = None
         self.setImage(self.inputImg())
 
     def setOpacity(self, value):
@@ -1292,9 +2394,16 @@ class QRawLayer(QLayer):
         super().__init__(*args, **kwargs)
         self.postProcessCache = None
         self.bufCache_HSV_CV32 = None
+        # demosaic output
+        self.bufpost16 = None
+        # (dng profile dict, dngProfileLookTable) pair
+        self.lookTableCache = None
 
+    # The caches may be spilled to disk by the memory manager :
+    # they are loaded back on access.
     @property
     def postProcessCache(self):
+        self.__postProcessCache = fault(self.__postProcessCache)
         return self.__postProcessCache
 
     @postProcessCache.setter
@@ -1303,11 +2412,26 @@ class QRawLayer(QLayer):
 
     @property
     def bufCache_HSV_CV32(self):
+        self.__bufCache_HSV_CV32 = fault(self.__bufCache_HSV_CV32)
         return self.__bufCache_HSV_CV32
 
     @bufCache_HSV_CV32.setter
     def bufCache_HSV_CV32(self, buffer):
         self.__bufCache_HSV_CV32 = buffer
 
+    @property
+    def bufpost16(self):
+        self.__bufpost16 = fault(self.__bufpost16)
+        return self.__bufpost16
+
+    @bufpost16.setter
+    def bufpost16(self, buffer):
+        self.__bufpost16 = buffer
+
+    def getSpillables(self):
+        return {'postProcessCache': self.__postProcessCache,
+                'bufCache_HSV_CV32': self.__bufCache_HSV_CV32,
+                'bufpost16': self.__bufpost16}
+
 
 
@@ -158,7 +158,7 @@ from colorManagement import icc
 from graphicsCoBrSat import CoBrSatForm
 from graphicsExp import ExpForm
 from graphicsPatch import patchForm
-from settings import USE_POOL, POOL_SIZE, THEME, MAX_ZOOM, TABBING
+from settings import USE_POOL, POOL_SIZE, THEME, MAX_ZOOM, TABBING, INTERP_BACKEND
 from utils import QbLUeColorDialog, colorInfoView
 from bLUeGui.tool import cropTool, rotatingTool
 from graphicsTemp import temperatureForm
@@ -170,6 +170,8 @@ from graphicsLabLUT import graphicsLabForm
 from splittedView import splittedWindow
 
 from bLUeCore.demosaicing import demosaic
+from bLUeCore.multi import calibrateParallel, setParallelParams
+from bLUeCore.registry import useNumba
 from bLUeGui.dialog import *
 from viewer import playDiaporama, viewer
 
@@ -348,7 +350,9 @@ def mouseEvent(widget, event):  # TODO split into 3 handlers
         # add current mask to history
         if window.btnValues['drawFG'] or window.btnValues['drawBG']:
             if layer.maskIsEnabled:
-                layer.historyListMask.addItem(layer.mask.copy())
+                layer.historyListMask.addItem(layer.mask)
+            # painted region (relative to full image)
+            State['dirty'] = QRect()
         return  # no update needed
     ##################
     # mouse move event
@@ -412,6 +416,10 @@ def mouseEvent(widget, event):  # TODO split into 3 handlers
                     d = abs(a_x) + abs(a_y)
                     x, y = State['x_imagePrecPos'], State['y_imagePrecPos']
                     radius = w_pen / 2
+                    # add the bounding rect of the brush tips, pen width included, to the painted region
+                    State['dirty'] = State.get('dirty', QRect()).united(
+                                                QRect(QPoint(int(min(x, tmp_x) - w_pen) - 1, int(min(y, tmp_y) - w_pen) - 1),
+                                                      QPoint(int(max(x, tmp_x) + w_pen) + 1, int(max(y, tmp_y) + w_pen) + 1)))
                     if d == 0:
                         qp.drawEllipse(QPointF(x, y), radius, radius)  # center, radius : QPointF mandatory, else bounding rect topleft and size
                     else:
@@ -478,7 +486,12 @@ def mouseEvent(widget, event):  # TODO split into 3 handlers
             if layer.maskIsEnabled \
                     and layer.getUpperVisibleStackIndex() != -1\
                     and (window.btnValues['drawFG'] or window.btnValues['drawBG']):
-                layer.applyToStack()
+                # recompute the painted region only
+                dirty = State.pop('dirty', None)
+                dirty = dirty if dirty is not None and not dirty.isNull() else None
+                # record the painted region into the mask history
+                layer.historyListMask.commit(layer.mask, rect=dirty)
+                layer.applyToStack(dirty=dirty)
             if img.isMouseSelectable:
                 # click event
                 if clicked:
@@ -992,6 +1005,8 @@ def setDocumentImage(img):
     # label_3.img : reference to working image
     ###################################
     window.label.img.onImageChanged = f
+    # the preview ladder is adapted to the size of the displayed image
+    window.label.img.displayWidget = window.label
     # before image : the stack is not copied
     window.label_2.img = imImage(QImg=img, meta=img.meta)
     # after image : ref to the opened document
@@ -1035,6 +1050,8 @@ def updateEnabledActions():
     window.actionColor_manage.setChecked(icc.COLOR_MANAGE)
     window.actionSave.setEnabled(window.label.img.isModified)
     window.actionSave_Hald_Cube.setEnabled(window.label.img.isHald)
+    # compiled kernels don't use parallel interpolation (cf. chosenInterp())
+    window.actionCalibrate_interpolation.setEnabled(not useNumba())
 
 
 def menuFile(name):
@@ -1052,14 +1069,12 @@ def menuFile(name):
             openFile(filename)
     # saving dialog
     elif name == 'actionSave':
-        if window.label.img.useThumb:
-            dlgWarn("Uncheck Preview mode before saving")
-        else:
-            try:
-                filename = saveDlg(window.label.img, window)
-                dlgInfo("%s written" % filename)
-            except (ValueError, IOError) as e:
-                dlgWarn(str(e))
+        # in preview mode, the full size image is evaluated (cf. mImage.save())
+        try:
+            filename = saveDlg(window.label.img, window)
+            dlgInfo("%s written" % filename)
+        except (ValueError, IOError) as e:
+            dlgWarn(str(e))
     # closing dialog : close opened document
     elif name == 'actionClose':
         closeFile()
@@ -1235,6 +1250,24 @@ def menuImage(name):
         finally:
             QApplication.restoreOverrideCursor()
             QApplication.processEvents()
+    # parallel interpolation calibration
+    elif name == 'actionCalibrate_interpolation':
+        try:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            QApplication.processEvents()
+            result = calibrateParallel(pool=getPool())
+        finally:
+            QApplication.restoreOverrideCursor()
+            QApplication.processEvents()
+        if result is None:
+            dlgInfo('Parallel interpolation is disabled')
+        else:
+            threshold, tiles = result
+            setParallelParams(threshold, tiles)
+            # persist the results
+            window.settings.setValue('interp/parallelThreshold', threshold)
+            window.settings.setValue('interp/tileCount', tiles)
+            dlgInfo('Parallel interpolation calibrated', info='Min image size : %d\nTile count : %d' % (threshold, tiles))
     # rating
     elif name in ['action0', 'action1', 'action2', 'action3', 'action4', 'action5']:
         img.meta.rating = int(name[-1:])
@@ -1248,8 +1281,9 @@ def getPool():
     try:
         QApplication.setOverrideCursor(Qt.WaitCursor)
         QApplication.processEvents()
-        # init pool only once
-        if USE_POOL and (pool is None):
+        # init pool only once. The threads and serial
+        # interpolation backends do not need a process pool
+        if USE_POOL and (INTERP_BACKEND == 'processes') and (pool is None):
             pool = multiprocessing.Pool(POOL_SIZE)
     finally:
         QApplication.restoreOverrideCursor()
@@ -1296,7 +1330,7 @@ def menuLayer(name):
         # init pool only once
         pool = getPool()
         sc = grWindow.scene()
-        layer.execute = lambda l=layer, pool=pool: l.tLayer.apply3DLUT(sc.lut.LUT3DArray, sc.lut.step,
+        layer.execute = lambda l=layer, pool=pool: l.tLayer.apply3DLUT(sc.lut.getPrepared(), sc.lut.step,
                                                                        options=sc.options, pool=pool)
     elif name == 'action2D_LUT_HV':
         layerName = '3D LUT HSV Shift'
@@ -1449,7 +1483,7 @@ def menuLayer(name):
             lname = path.basename(name)
             layer = window.label.img.addAdjustmentLayer(name=lname)
             pool = getPool()
-            layer.execute = lambda l=layer, pool=pool: l.tLayer.apply3DLUT(lut.LUT3DArray,
+            layer.execute = lambda l=layer, pool=pool: l.tLayer.apply3DLUT(lut.getPrepared(),
                                                                            lut.step,
                                                                            {'use selection': False},
                                                                            pool=pool)
@@ -1965,6 +1999,11 @@ For a segmentation layer only, all pixels outside the rectangle are set to backg
     # close event handler
     window.onCloseEvent = canClose
 
+    # parallel interpolation parameters, if calibrated (cf. menu Image > Calibrate Interpolation)
+    threshold, tiles = window.settings.value('interp/parallelThreshold', None), window.settings.value('interp/tileCount', None)
+    if threshold is not None and tiles is not None:
+        setParallelParams(int(threshold), int(tiles))
+
     # watch mouse hover events
     window.label.setMouseTracking(True)
 
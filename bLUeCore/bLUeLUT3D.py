@@ -16,6 +16,7 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 from .cartesian import cartesianProduct
+from .preparedLUT import versionedLUT, getPreparedLUT
 import numpy as np
 
 
@@ -35,7 +36,7 @@ class HaldArray(object):
         super().__init__()
 
 
-class LUT3D (object):
+class LUT3D (versionedLUT):
     """
     Standard RGB 3D LUT, following the Adobe cube LUT specification :
     cf. http://wwwimages.adobe.com/content/dam/Adobe/en/products/speedgrade/cc/pdfs/cube-lut-specification-1.0.pdf
@@ -50,6 +51,9 @@ class LUT3D (object):
 
     Another 3D LUT class, following the Adobe dng spec. and suitable for arbitrary color spaces,
     can be found in the module dng.py.
+
+    The LUT version is bumped when LUT3DArray is assigned. In place modifications
+    of LUT3DArray must be followed by a call to bumpVersion().
     """
     ####################################
     # MaxRange defines the maximum input value
@@ -201,6 +205,7 @@ class LUT3D (object):
         if ((size - 1) & (size - 2)) != 0:
             raise ValueError("LUT3D : size should be 2**n+1, found %d" % size)
 
+        self.initVersion()
         self.LUT3DArray = LUT3DArray
         self.size = size
 
@@ -226,10 +231,28 @@ class LUT3D (object):
                                               )), axis=-1)
         super().__init__()
 
+    @property
+    def LUT3DArray(self):
+        return self.__LUT3DArray
+
+    @LUT3DArray.setter
+    def LUT3DArray(self, a):
+        self.__LUT3DArray = a
+        self.bumpVersion()
+
+    def getPrepared(self):
+        """
+        Return the prepared state of the current LUT revision,
+        for use by interpolation functions.
+        @return:
+        @rtype: PreparedLUT
+        """
+        return getPreparedLUT(self.versionKey, self.LUT3DArray, self.step)
+
     def toHaldArray(self, w, h):
         """
         Convert a LUT3D object to a haldArray object with shape (w,h,3).
-        The 3D LUT is flattened, padded with 0, and reshaped
+        The 3D LUT is clipped to 0..255, flattened, padded with 0, and reshaped
         to a 2D array. The product w * h must be greater than (self.size)**3
         Hald channels, LUT channels and LUT axes must follow the same ordering (BGR or RGB).
         To simplify, we only handle halds and LUTs of type BGR.
@@ -244,8 +267,9 @@ class LUT3D (object):
         if (s ** 3) > w * h:
             raise ValueError("toHaldArray : incorrect sizes)")
         buf = np.zeros((w * h * 3), dtype=np.uint8)
-        count = (s ** 3) * 3  # TODO may be clip LUT array to 0,255 ?
-        buf[:count] = self.LUT3DArray.ravel()
+        count = (s ** 3) * 3
+        # clip to 0..255 : the last node of standard LUTs (256) would wrap to 0
+        buf[:count] = np.clip(self.LUT3DArray.ravel(), 0, 255)
         buf = buf.reshape(h, w, 3)
         return HaldArray(buf, s)
 
@@ -281,11 +305,12 @@ class LUT3D (object):
             self.writeToTextStream(textStream)
 
 
-class DeltaLUT3D(object):
+class DeltaLUT3D(versionedLUT):
     """
     Versatile displacement 3D LUT. First dim is meant for hue
     (additive shift and modulo arithmetic)
     and remaining dims can be used for any type of input (multiplicative shifts).
+    In place modifications of data must be followed by a call to bumpVersion().
     """
     def __init__(self, divs):
         """
@@ -295,6 +320,7 @@ class DeltaLUT3D(object):
         @type divs: 3-uple of int
 
         """
+        self.initVersion()
         self.__divs = divs
         self.__data = np.zeros((divs[0] + 2, divs[1] + 1, divs[2] + 1, 3), dtype=np.float) + (0, 1, 1)
 
@@ -318,4 +344,15 @@ class DeltaLUT3D(object):
         @return: 3D look up table
         @rtype: ndarray shape=(divs[0] + 2, divs[1] + 1, divs[2] + 1, 3), dtype=float
         """
-        return self.__data
\ No newline at end of file
+        return self.__data
+
+    def getPrepared(self, steps):
+        """
+        Return the prepared state of the current LUT revision,
+        for use by interpolation functions.
+        @param steps: interpolation steps
+        @type steps: 3-uple of numbers
+        @return:
+        @rtype: PreparedLUT
+        """
+        return getPreparedLUT(self.versionKey, self.data, steps)
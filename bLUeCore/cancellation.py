@@ -0,0 +1,69 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+###############################################
+# Cooperative cancellation of long computations.
+# A thread evaluating the layer stack installs
+# a cancel check (cf. renderScheduler.run()).
+# Long kernels call checkCancelled() between
+# chunks of work : it raises evaluationCancelled
+# when the evaluation is stale. Checks are thread-local :
+# in other threads, including the workers of the pools,
+# checkCancelled() does nothing.
+###############################################
+import threading
+
+# interval (seconds) between two checks while waiting for pool workers
+pollInterval = 0.05
+
+_local = threading.local()
+
+
+class evaluationCancelled(Exception):
+    """
+    Raised by checkCancelled() in a cancelled evaluation.
+    """
+    pass
+
+
+def setCancelCheck(check):
+    """
+    Install the cancel check of the current thread.
+    @param check: function returning True if the evaluation is cancelled, or None
+    @type check: function
+    """
+    _local.check = check
+
+
+def isCancelled():
+    """
+    Return True if the evaluation running in the
+    current thread is cancelled.
+    @return:
+    @rtype: boolean
+    """
+    check = getattr(_local, 'check', None)
+    return check is not None and check()
+
+
+def checkCancelled():
+    """
+    Raise evaluationCancelled if the evaluation running
+    in the current thread is cancelled.
+    """
+    if isCancelled():
+        raise evaluationCancelled()
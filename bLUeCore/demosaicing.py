@@ -19,6 +19,28 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 import numpy as np
 import cv2
 
+from .registry import registered
+
+
+@registered('subtractBlackLevel')
+def subtractBlackLevel(raw_image_visible, raw_colors_visible, black_level_per_channel):
+    """
+    Subtract black levels from a sensor bitmap (uint16 arithmetic).
+    @param raw_image_visible: image from sensor
+    @type raw_image_visible: nd_array, dtype uint16, shape(img_h, img_w)
+    @param raw_colors_visible:
+    @type raw_colors_visible: nd_array, dtype u1, shape(img_h, img_w)
+    @param black_level_per_channel:
+    @type black_level_per_channel: list or array, dtype= int
+    @return: Bayer bitmap
+    @rtype: ndarray, dtype uint16, shape(img_h, img_w)
+    """
+    black_level_per_channel = np.array(black_level_per_channel, dtype=np.uint16)
+    if np.any(black_level_per_channel!=0):
+        return raw_image_visible - black_level_per_channel[raw_colors_visible]
+    return raw_image_visible
+
+
 def demosaic(raw_image_visible, raw_colors_visible, black_level_per_channel):
     """
     demosaic a sensor bitmap. The input array raw_image_visble is the image from sensor. It has
@@ -36,12 +58,8 @@ def demosaic(raw_image_visible, raw_colors_visible, black_level_per_channel):
     @return: demosaic array
     @rtype: ndarray, dtype uint16, shape (img_width, img_height, 3)
     """
-    black_level_per_channel = np.array(black_level_per_channel, dtype=np.uint16)
     # Bayer bitmap (16 bits), subtract black level for each channel
-    if np.any(black_level_per_channel!=0):
-        bayerBuf = raw_image_visible - black_level_per_channel[raw_colors_visible]
-    else:
-        bayerBuf = raw_image_visible
+    bayerBuf = subtractBlackLevel(raw_image_visible, raw_colors_visible, black_level_per_channel)
     # encode Bayer pattern to opencv constant
     tmpdict = {0:'R', 1:'G', 2:'B'}
     pattern = 'cv2.COLOR_BAYER_' + tmpdict[raw_colors_visible[1,1]] + tmpdict[raw_colors_visible[1,2]] + '2RGB'
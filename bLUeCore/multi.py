@@ -15,25 +15,148 @@ Lesser General Lesser Public License for more details.
 You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import partial
+from time import perf_counter
 import numpy as np
 
+try:
+    from multiprocessing import shared_memory  # Python >= 3.8
+except ImportError:
+    shared_memory = None
+
+from bLUeCore.cancellation import checkCancelled, isCancelled, pollInterval
+from bLUeCore.preparedLUT import lutArray, prepareLUT
 from bLUeCore.tetrahedral import interpTetra
-from bLUeCore.trilinear import interpTriLinear
-from settings import USE_TETRA
+from bLUeCore.trilinear import interpTriLinear, interpTriLinearInt
+from bLUeCore.registry import useNumba
+from settings import USE_TETRA, USE_SHARED_MEMORY, INTERP_BACKEND, POOL_SIZE, USE_FIXED_POINT
+
+####################################
+# Parallel interpolation parameters :
+# min image size for parallel interpolation and
+# count of image tiles. Default values are replaced
+# by the results of calibrateParallel(), using setParallelParams().
+####################################
+parallelThreshold = 3000000
+tileCount = 16
+
+
+def setParallelParams(threshold=None, tiles=None):
+    """
+    Set the min image size for parallel interpolation
+    and the count of image tiles. None values are ignored.
+    @param threshold: min image size
+    @type threshold: int
+    @param tiles: tile count
+    @type tiles: int
+    """
+    global parallelThreshold, tileCount
+    if threshold is not None:
+        parallelThreshold = int(threshold)
+    if tiles is not None:
+        tileCount = max(int(tiles), 1)
+
+
+def rowBands(h, count):
+    """
+    Cut a range of h rows into count horizontal bands.
+    @param h: row count
+    @type h: int
+    @param count: band count
+    @type count: int
+    @return: list of (first row, last row + 1)
+    @rtype: list of 2-uples of int
+    """
+    count = min(count, max(h, 1))
+    return [((h * i) // count, (h * (i + 1)) // count) for i in range(count)]
+
 
+def serialInterp(use_tetra=False):
+    """
+    Return the (non parallel) interpolation function.
+    Trilinear interpolation uses the fixed point
+    kernel if USE_FIXED_POINT is set (config.json).
+    @param use_tetra: use tetrahedral interpolation
+    @type use_tetra: boolean
+    @return:
+    @rtype: function
+    """
+    if use_tetra:
+        return interpTetra
+    return interpTriLinearInt if USE_FIXED_POINT else interpTriLinear
+
+
+# thread pool used by interpThreads, created on first use
+_threadPool = None
 
-def interpMulti(LUT, LUTSTEP, ndImg, pool=None, use_tetra=False, convert=True):
+
+def getThreadPool():
+    """
+    Return the (lazily created) thread pool
+    used by the thread interpolation backend.
+    @return:
+    @rtype: ThreadPoolExecutor
+    """
+    global _threadPool
+    if _threadPool is None:
+        _threadPool = ThreadPoolExecutor(max_workers=POOL_SIZE)
+    return _threadPool
+
+
+def waitAll(futures):
+    """
+    Wait for the completion of futures of the thread pool, propagating exceptions.
+    If the evaluation is cancelled while waiting (cf. bLUeCore.cancellation),
+    the futures not yet started are cancelled and evaluationCancelled is raised.
+    @param futures:
+    @type futures: list of Future objects
+    """
+    pending = futures
+    while pending:
+        _, pending = wait(pending, timeout=pollInterval)
+        if pending and isCancelled():
+            for fut in pending:
+                fut.cancel()
+            checkCancelled()
+    for fut in futures:
+        fut.result()
+
+
+def mapPool(pool, f, items):
+    """
+    Equivalent to pool.map(f, items) for a multiprocessing pool. If the evaluation
+    is cancelled while waiting (cf. bLUeCore.cancellation), evaluationCancelled is raised :
+    the results of the running tasks are discarded.
+    @param pool:
+    @type pool: multiprocessing.Pool
+    @param f:
+    @type f: function
+    @param items:
+    @type items: list
+    @return:
+    @rtype: list
+    """
+    res = pool.map_async(f, items)
+    while not res.ready():
+        res.wait(pollInterval)
+        checkCancelled()
+    return res.get()
+
+
+def interpMulti(LUT, LUTSTEP, ndImg, pool=None, use_tetra=False, convert=True, tiles=None):
     """
     Parallel trilinear/tetrahedral interpolation, using
-    a pool of workers.
+    a pool of workers. The image is cut into tiles horizontal
+    bands (default tileCount).
     Convert an input array using a 3D LUT.
     The roles (R or G or B) of the three first LUT channels
     must follow the ordering of the color channels.
     The output image is interpolated from the LUT.
     It has the same type as the input image.
-    @param LUT: 3D LUT array
-    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3)
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3), or PreparedLUT
     @param LUTSTEP: interpolation step
     @type LUTSTEP: number or 3-uple of numbers
     @param ndImg: input array
@@ -44,32 +167,178 @@ def interpMulti(LUT, LUTSTEP, ndImg, pool=None, use_tetra=False, convert=True):
     @type use_tetra : boolean
     @param convert: convert the output to dtype=np.uint8
     @type convert: boolean
+    @param tiles: tile count
+    @type tiles: int
     @return: interpolated array
     @rtype: ndarray, same shape as the input image
     """
-    w, h = ndImg.shape[1], ndImg.shape[0]
-    SLF = 4
-    sl_w = [slice((w * i) // SLF, (w * (i+1)) // SLF) for i in range(SLF)]
-    sl_h = [slice((h * i) // SLF, (h * (i + 1)) // SLF) for i in range(SLF)]
-
-    slices = [ (s1, s2) for s1 in sl_w for s2 in sl_h]
-    imgList = [ndImg[s2, s1] for s1, s2 in slices]
+    bands = rowBands(ndImg.shape[0], tileCount if tiles is None else tiles)
+    imgList = [ndImg[r1:r2] for r1, r2 in bands]
     if pool is None:
         raise ValueError('interpMulti: no processing pool')
-    # get vectorized interpolation as partial function
-    partial_f = partial(interpTetra if use_tetra else interpTriLinear, LUT, LUTSTEP, convert=convert)
+    # get vectorized interpolation as partial function, preparing the LUT once for all slices
+    LUT = prepareLUT(LUT, LUTSTEP)
+    partial_f = partial(serialInterp(use_tetra), LUT, LUTSTEP, convert=convert)
     # parallel interpolation
-    res = pool.map(partial_f, imgList)
+    res = mapPool(pool, partial_f, imgList)
     outImg = np.empty(ndImg.shape)
     # collect results
-    for i, (s1, s2) in enumerate(slices):
-            outImg[s2, s1] = res[i]
+    for i, (r1, r2) in enumerate(bands):
+        outImg[r1:r2] = res[i]
     # np.clip(outImg, 0, 255, out=outImg) # chunks are already clipped
     return outImg # .astype(np.uint8)  # TODO 07/09/18 validate
 
+
+def _attachShared(name):
+    """
+    Attach to an existing shared memory block, without
+    registering it to the resource tracker of the calling process:
+    the block is owned, and unlinked, by the process which created it.
+    @param name: block name
+    @type name: str
+    @return:
+    @rtype: shared_memory.SharedMemory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        pass
+    b = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(b._name, 'shared_memory')
+    return b
+
+
+def _interpSharedBand(args):
+    """
+    Worker function for interpMultiShared.
+    Attach to the shared memory blocks holding the LUT, the
+    input and the output arrays, interpolate a band of rows
+    and write the result directly into the output block.
+    It must be defined at module level to be picklable.
+    @param args: (LUT descr, input descr, output descr, LUTSTEP, use_tetra, convert, (first row, last row))
+                 where each descr is a 3-uple (shared block name, shape, dtype)
+    @type args: tuple
+    """
+    (lutDescr, imgDescr, outDescr, LUTSTEP, use_tetra, convert, (r1, r2)) = args
+    blocks = [_attachShared(d[0]) for d in (lutDescr, imgDescr, outDescr)]
+    try:
+        LUT, ndImg, outImg = [np.ndarray(d[1], dtype=d[2], buffer=b.buf) for d, b in zip((lutDescr, imgDescr, outDescr), blocks)]
+        interp = serialInterp(use_tetra)
+        outImg[r1:r2] = interp(LUT, LUTSTEP, ndImg[r1:r2], convert=convert)
+        # release views before closing blocks
+        del LUT, ndImg, outImg
+    finally:
+        for b in blocks:
+            b.close()
+
+
+def interpMultiShared(LUT, LUTSTEP, ndImg, pool=None, use_tetra=False, convert=True, tiles=None):
+    """
+    Parallel trilinear/tetrahedral interpolation, using a pool of workers
+    and shared memory.
+    The LUT, the input and the output arrays are placed in shared memory blocks,
+    so only block names and row ranges are sent to the workers. Each worker
+    writes its band of rows directly into the output block. The image is cut
+    into tiles bands (default tileCount).
+    The output array has dtype np.uint8 if convert is True, and
+    np.float32 otherwise.
+    Falls back to interpMulti if shared memory is not available.
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3), or PreparedLUT
+    @param LUTSTEP: interpolation step
+    @type LUTSTEP: number or 3-uple of numbers
+    @param ndImg: input array
+    @type ndImg: ndarray dtype float or int, shape (w, h, 3)
+    @param pool: multiprocessing pool
+    @type pool: mulpiprocessing.Pool
+    @param use_tetra: use tetrahedral interpolation
+    @type use_tetra : boolean
+    @param convert: convert the output to dtype=np.uint8
+    @type convert: boolean
+    @param tiles: tile count
+    @type tiles: int
+    @return: interpolated array
+    @rtype: ndarray, same shape as the input image
+    """
+    if pool is None:
+        raise ValueError('interpMultiShared: no processing pool')
+    if shared_memory is None:
+        return interpMulti(LUT, LUTSTEP, ndImg, pool=pool, use_tetra=use_tetra, convert=convert, tiles=tiles)
+    h = ndImg.shape[0]
+    LUT = lutArray(LUT)
+    outShape = ndImg.shape[:2] + (LUT.shape[-1],)
+    outDtype = np.dtype(np.uint8) if convert else np.dtype(np.float32)
+    arrays = [np.ascontiguousarray(LUT), np.ascontiguousarray(ndImg)]
+    blocks = []
+    try:
+        descrs = []
+        for a in arrays:
+            b = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            blocks.append(b)
+            np.ndarray(a.shape, dtype=a.dtype, buffer=b.buf)[...] = a
+            descrs.append((b.name, a.shape, a.dtype.str))
+        bOut = shared_memory.SharedMemory(create=True, size=max(int(np.prod(outShape)) * outDtype.itemsize, 1))
+        blocks.append(bOut)
+        descrs.append((bOut.name, outShape, outDtype.str))
+        bands = rowBands(h, tileCount if tiles is None else tiles)
+        mapPool(pool, _interpSharedBand, [(descrs[0], descrs[1], descrs[2], LUTSTEP, use_tetra, convert, band) for band in bands])
+        # copy the result out of the shared block before releasing it
+        outImg = np.ndarray(outShape, dtype=outDtype, buffer=bOut.buf).copy()
+    finally:
+        for b in blocks:
+            b.close()
+            b.unlink()
+    return outImg
+
+
+def interpThreads(LUT, LUTSTEP, ndImg, use_tetra=False, convert=True, tiles=None):
+    """
+    Parallel trilinear/tetrahedral interpolation, using a pool of threads.
+    The image is cut into tiles horizontal bands of rows (default tileCount), interpolated concurrently
+    and written directly into the output array. NumPy releases the GIL in
+    the interpolation kernels, so no data is copied between processes.
+    The output array has dtype np.uint8 if convert is True, and
+    np.float32 otherwise.
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3), or PreparedLUT
+    @param LUTSTEP: interpolation step
+    @type LUTSTEP: number or 3-uple of numbers
+    @param ndImg: input array
+    @type ndImg: ndarray dtype float or int, shape (w, h, 3)
+    @param use_tetra: use tetrahedral interpolation
+    @type use_tetra : boolean
+    @param convert: convert the output to dtype=np.uint8
+    @type convert: boolean
+    @param tiles: tile count
+    @type tiles: int
+    @return: interpolated array
+    @rtype: ndarray, same shape as the input image
+    """
+    h = ndImg.shape[0]
+    # prepare once for all bands
+    LUT = prepareLUT(LUT, LUTSTEP)
+    outImg = np.empty(ndImg.shape[:2] + (LUT.shape[-1],), dtype=np.uint8 if convert else np.float32)
+    interp = serialInterp(use_tetra)
+
+    def f(r1, r2):
+        outImg[r1:r2] = interp(LUT, LUTSTEP, ndImg[r1:r2], convert=convert)
+
+    bands = rowBands(h, tileCount if tiles is None else tiles)
+    waitAll([getThreadPool().submit(f, r1, r2) for r1, r2 in bands])
+    return outImg
+
+
 def chosenInterp(pool, size):
     """
-    Return the right interpolation method, depending on settings, pool and image size
+    Return the right interpolation method, depending on settings, pool and image size.
+    The parallel backend is chosen by INTERP_BACKEND (config.json) :
+    'processes' uses the multiprocessing pool, 'threads' uses interpThreads and
+    'serial' disables parallel interpolation. Parallel interpolation is used
+    for sizes > parallelThreshold (cf. calibrateParallel()).
+    Compiled kernels (cf. bLUeCore.registry) are parallel by themselves,
+    so they are always called serially : parallelThreshold and tileCount are not used.
     @param pool:
     @type pool: multiprocessing pool
     @param size: image size
@@ -77,8 +346,76 @@ def chosenInterp(pool, size):
     @return:
     @rtype: interpolation function
     """
-    if (pool is not None) and size > 3000000:
-        interp = lambda x, y, z, convert=True: interpMulti(x, y, z, pool=pool, use_tetra=USE_TETRA, convert=convert)
+    if useNumba():
+        interp = serialInterp(USE_TETRA)
+    elif INTERP_BACKEND == 'threads' and size > parallelThreshold:
+        interp = lambda x, y, z, convert=True: interpThreads(x, y, z, use_tetra=USE_TETRA, convert=convert)
+    elif INTERP_BACKEND == 'processes' and (pool is not None) and size > parallelThreshold:
+        f = interpMultiShared if USE_SHARED_MEMORY else interpMulti
+        interp = lambda x, y, z, convert=True: f(x, y, z, pool=pool, use_tetra=USE_TETRA, convert=convert)
+    else:
+        interp = serialInterp(USE_TETRA)
+    return interp
+
+
+def calibrateParallel(pool=None, sizes=(250000, 500000, 1000000, 2000000, 4000000, 8000000), repeat=2):
+    """
+    Time serial and parallel interpolation of random 8 bits images
+    with the configured backend (INTERP_BACKEND) and return
+    the break-even image size and the best tile count. The tile count is chosen
+    first, using the largest size. Next, the break-even size is the largest
+    size for which serial interpolation is faster (0 if parallel interpolation
+    is always faster, 2**31 - 1 if it is never faster).
+    Returns None if parallel interpolation is disabled, or if compiled
+    kernels are used : they are always called serially (cf. chosenInterp()),
+    so the results would not be used.
+    Results should be passed to setParallelParams().
+    @param pool: multiprocessing pool (processes backend only)
+    @type pool: multiprocessing.Pool
+    @param sizes: increasing image sizes
+    @type sizes: tuple of int
+    @param repeat: count of timings for each measure (the best one is kept)
+    @type repeat: int
+    @return: break-even size, tile count
+    @rtype: 2-uple of int
+    """
+    if useNumba():
+        return None
+    if INTERP_BACKEND == 'threads':
+        parallel = lambda L, s, img, tiles: interpThreads(L, s, img, use_tetra=USE_TETRA, tiles=tiles)
+    elif INTERP_BACKEND == 'processes' and pool is not None:
+        f = interpMultiShared if USE_SHARED_MEMORY else interpMulti
+        parallel = lambda L, s, img, tiles: f(L, s, img, pool=pool, use_tetra=USE_TETRA, tiles=tiles)
     else:
-        interp = interpTetra if USE_TETRA else interpTriLinear
-    return interp
\ No newline at end of file
+        return None
+    serial = serialInterp(USE_TETRA)
+
+    def timeIt(f):
+        best = float('inf')
+        for _ in range(repeat):
+            t = perf_counter()
+            f()
+            best = min(best, perf_counter() - t)
+        return best
+
+    # random 3D LUT with default size 33
+    LUT = prepareLUT(np.random.randint(0, 256, size=(33, 33, 33, 3)), 8)
+
+    def randomImg(size):
+        w = int(np.sqrt(size * 3 / 2))
+        return np.random.randint(0, 256, size=(max(size // w, 1), w, 3)).astype(np.uint8)
+
+    # tile count
+    img = randomImg(sizes[-1])
+    candidates = sorted({POOL_SIZE, 2 * POOL_SIZE, 4 * POOL_SIZE, 8 * POOL_SIZE, 16})
+    times = [timeIt(lambda: parallel(LUT, 8, img, tiles)) for tiles in candidates]
+    tiles = candidates[int(np.argmin(times))]
+    # break-even size
+    threshold = 0
+    for size in sizes:
+        img = randomImg(size)
+        if timeIt(lambda: serial(LUT, 8, img)) <= timeIt(lambda: parallel(LUT, 8, img, tiles)):
+            threshold = size
+    if threshold == sizes[-1]:
+        threshold = 2 ** 31 - 1
+    return threshold, tiles
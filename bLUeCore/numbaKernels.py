@@ -0,0 +1,397 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+##########################################################
+# Numba implementations of the kernels registered in
+# bLUeCore.registry. This module is imported on demand,
+# only if Numba is installed and selected by KERNEL_BACKEND.
+# Each function follows the signature and the results of the
+# NumPy reference implementation (up to rounding errors).
+# Loops are parallelized over image rows. Compiled code is
+# cached to disk (cache=True), so it is compiled only once.
+##########################################################
+import numpy as np
+import cv2
+from numba import njit, prange
+
+from .registry import registerCompiled
+from .preparedLUT import prepareLUT
+from .rollingStats import hasOpenCV, movingAverage, movingVariance
+from .trilinear import interpTriLinear, fixedPointParams
+from .tvDenoising import denoise
+from bLUeGui.colorCube import Perc_R, Perc_G, Perc_B, rgb2hsBVec
+
+
+#################
+# 3D LUT
+#################
+
+@njit(parallel=True, cache=True)
+def _triLinear(LUT, invStep, img, out, clip):
+    h, w = img.shape[0], img.shape[1]
+    s0, s1, s2, d = LUT.shape
+    for i in prange(h):
+        for j in range(w):
+            x, y, z = img[i, j, 0] * invStep[0], img[i, j, 1] * invStep[1], img[i, j, 2] * invStep[2]
+            r0, g0, b0 = min(int(x), s0 - 2), min(int(y), s1 - 2), min(int(z), s2 - 2)
+            fr, fg, fb = x - r0, y - g0, z - b0
+            for c in range(d):
+                # same operations as interpTriLinear : alpha = fg, beta = fr, gamma = fb
+                I11 = LUT[r0 + 1, g0, b0 + 1, c] + fg * (LUT[r0 + 1, g0 + 1, b0 + 1, c] - LUT[r0 + 1, g0, b0 + 1, c])
+                I12 = LUT[r0, g0, b0 + 1, c] + fg * (LUT[r0, g0 + 1, b0 + 1, c] - LUT[r0, g0, b0 + 1, c])
+                I21 = LUT[r0 + 1, g0, b0, c] + fg * (LUT[r0 + 1, g0 + 1, b0, c] - LUT[r0 + 1, g0, b0, c])
+                I22 = LUT[r0, g0, b0, c] + fg * (LUT[r0, g0 + 1, b0, c] - LUT[r0, g0, b0, c])
+                I1 = I12 + fr * (I11 - I12)
+                I2 = I22 + fr * (I21 - I22)
+                v = I2 + fb * (I1 - I2)
+                if clip:
+                    v = min(max(v, 0.0), 255.0)
+                out[i, j, c] = v
+
+
+@njit(parallel=True, cache=True)
+def _tetra(LUT, invStep, img, out, clip):
+    h, w = img.shape[0], img.shape[1]
+    s0, s1, s2, d = LUT.shape
+    sz = np.zeros(3, dtype=np.int64)
+    sz[0], sz[1], sz[2] = s0 - 2, s1 - 2, s2 - 2
+    for i in prange(h):
+        a = np.empty(3, dtype=np.int64)
+        f = np.empty(3, dtype=np.float64)
+        v1 = np.empty(3, dtype=np.int64)
+        v2 = np.empty(3, dtype=np.int64)
+        for j in range(w):
+            for k in range(3):
+                x = img[i, j, k] * invStep[k]
+                a[k] = min(int(x), sz[k])
+                f[k] = x - a[k]
+            # first max and last min, as in interpTetra
+            iMax, iMin = 0, 2
+            for k in range(1, 3):
+                if f[k] > f[iMax]:
+                    iMax = k
+            for k in range(1, -1, -1):
+                if f[k] < f[iMin]:
+                    iMin = k
+            fMax, fMin = f[iMax], f[iMin]
+            fMid = f[0] + f[1] + f[2] - fMax - fMin
+            for k in range(3):
+                v1[k] = a[k]
+                v2[k] = a[k] + 1
+            v1[iMax] += 1
+            v2[iMin] -= 1
+            for c in range(d):
+                V0 = LUT[a[0], a[1], a[2], c]
+                V1 = LUT[v1[0], v1[1], v1[2], c]
+                V2 = LUT[v2[0], v2[1], v2[2], c]
+                V3 = LUT[a[0] + 1, a[1] + 1, a[2] + 1, c]
+                # float32 in place operations of interpTetra
+                t3 = np.float32(np.float32(V3 - V2) * fMin)
+                t2 = np.float32(np.float32(V2 - V1) * fMid)
+                t1 = np.float32(np.float32(V1 - V0) * fMax)
+                v = np.float32(np.float32(np.float32(V0 + t1) + t2) + t3)
+                if clip:
+                    v = min(max(v, np.float32(0.0)), np.float32(255.0))
+                out[i, j, c] = v
+
+
+@njit(parallel=True, cache=True)
+def _triLinearInt(LUTInt, st, k, shift, img, out, convert):
+    h, w = img.shape[0], img.shape[1]
+    d = LUTInt.shape[1]
+    mask = (1 << k) - 1
+    half = 1 << (shift - 1)
+    scale = 1.0 / (1 << shift)
+    for i in prange(h):
+        for j in range(w):
+            p0, p1, p2 = np.int64(img[i, j, 0]), np.int64(img[i, j, 1]), np.int64(img[i, j, 2])
+            base = (p0 >> k) * st[0] + (p1 >> k) * st[1] + (p2 >> k) * st[2]
+            f0, f1, f2 = p0 & mask, p1 & mask, p2 & mask
+            for c in range(d):
+                # same operations as interpTriLinearInt
+                a = (np.int64(LUTInt[base, c]) << k) + (LUTInt[base + st[2], c] - np.int64(LUTInt[base, c])) * f2
+                o = base + st[1]
+                b = (np.int64(LUTInt[o, c]) << k) + (LUTInt[o + st[2], c] - np.int64(LUTInt[o, c])) * f2
+                a = (a << k) + (b - a) * f1
+                o = base + st[0]
+                b = (np.int64(LUTInt[o, c]) << k) + (LUTInt[o + st[2], c] - np.int64(LUTInt[o, c])) * f2
+                o = base + st[0] + st[1]
+                cc = (np.int64(LUTInt[o, c]) << k) + (LUTInt[o + st[2], c] - np.int64(LUTInt[o, c])) * f2
+                b = (b << k) + (cc - b) * f1
+                a = (a << k) + (b - a) * f0
+                if convert:
+                    out[i, j, c] = min(max((a + half) >> shift, 0), 255)
+                else:
+                    out[i, j, c] = a * scale
+
+
+def _steps(P):
+    return np.ascontiguousarray(np.broadcast_to(P.invStep, (3,)), dtype=np.float64)
+
+
+@registerCompiled('interpTriLinear')
+def interpTriLinearJit(LUT, LUTSTEP, ndImg, convert=True):
+    P = prepareLUT(LUT, LUTSTEP)
+    out = np.empty(ndImg.shape[:2] + (P.shape[-1],), dtype=np.uint8 if convert else np.float32)
+    _triLinear(P.LUT, _steps(P), ndImg, out, convert)
+    return out
+
+
+@registerCompiled('interpTetra')
+def interpTetraJit(LUT, LUTSTEP, ndImg, convert=True):
+    P = prepareLUT(LUT, LUTSTEP)
+    out = np.empty(ndImg.shape[:2] + (P.shape[-1],), dtype=np.uint8 if convert else np.float32)
+    _tetra(P.LUT, _steps(P), ndImg, out, convert)
+    return out
+
+
+@registerCompiled('interpTriLinearInt')
+def interpTriLinearIntJit(LUT, LUTSTEP, ndImg, convert=True, chunkSize=2 ** 18):
+    P = prepareLUT(LUT, LUTSTEP)
+    params = fixedPointParams(P, LUTSTEP, ndImg)
+    if params is None:
+        return interpTriLinear(P, LUTSTEP, ndImg, convert=convert)
+    k, shift, LUTInt, st = params
+    out = np.empty(ndImg.shape[:2] + (P.shape[-1],), dtype=np.uint8 if convert else np.float32)
+    _triLinearInt(LUTInt, np.array(st, dtype=np.int64), k, shift, ndImg, out, convert)
+    return out
+
+
+#################
+# Rolling stats
+#################
+
+@njit(cache=True)
+def _reflect(i, n):
+    # reflection mode ...2,1,0,1,2...
+    if i < 0:
+        return -i
+    if i >= n:
+        return 2 * n - 2 - i
+    return i
+
+
+@njit(parallel=True, cache=True)
+def _boxSums(a, r, squares):
+    # window sums of a (or of a * a), borders handled by reflection :
+    # separable version, rows first.
+    h, w = a.shape
+    rows = np.empty((h, w), dtype=np.float64)
+    out = np.empty((h, w), dtype=np.float64)
+    for i in prange(h):
+        for j in range(w):
+            t = 0.0
+            for dj in range(-r, r + 1):
+                v = np.float64(a[i, _reflect(j + dj, w)])
+                t += v * v if squares else v
+            rows[i, j] = t
+    for i in prange(h):
+        for j in range(w):
+            t = 0.0
+            for di in range(-r, r + 1):
+                t += rows[_reflect(i + di, h), j]
+            out[i, j] = t
+    return out
+
+
+def _stridesEligible(a, winsize, version):
+    # 2D arrays handled by the 'strides' version, window smaller than the array
+    r = int((winsize - 1) / 2)
+    return a.ndim == 2 and not (hasOpenCV and version == 'kernel') and r < min(a.shape)
+
+
+@registerCompiled('movingAverage')
+def movingAverageJit(a, winsize, version='kernel'):
+    if not _stridesEligible(a, winsize, version):
+        return movingAverage.reference(a, winsize, version=version)
+    r = int((winsize - 1) / 2)
+    m = _boxSums(a, r, False) / ((2 * r + 1) ** 2)
+    return m.astype(a.dtype) if a.dtype.kind == 'f' else m
+
+
+@registerCompiled('movingVariance')
+def movingVarianceJit(a, winsize, version='kernel'):
+    if not _stridesEligible(a, winsize, version):
+        return movingVariance.reference(a, winsize, version=version)
+    r = int((winsize - 1) / 2)
+    n = (2 * r + 1) ** 2
+    f1 = _boxSums(a, r, False) / n
+    f2 = _boxSums(a, r, True) / n
+    return f2 - f1 * f1
+
+
+#################
+# Denoising
+#################
+
+@njit(parallel=True, cache=True)
+def _tvDenoise(img, weight, eps, num_iter_max):
+    h, w = img.shape
+    u = np.zeros((h, w), dtype=np.float64)
+    uNew = np.empty((h, w), dtype=np.float64)
+    px = np.zeros((h, w), dtype=np.float64)
+    py = np.zeros((h, w), dtype=np.float64)
+    tau = 0.125
+    nm = h * w
+    err_init, err_prev = 0.0, 0.0
+    for it in range(num_iter_max):
+        # update the dual variable (gradient of u, periodic borders as np.roll)
+        for i in prange(h):
+            for j in range(w):
+                ux = u[i, (j + 1) % w] - u[i, j]
+                uy = u[(i + 1) % h, j] - u[i, j]
+                pxn = px[i, j] + (tau / weight) * ux
+                pyn = py[i, j] + (tau / weight) * uy
+                norm = max(1.0, np.sqrt(pxn ** 2 + pyn ** 2))
+                px[i, j] = pxn / norm
+                py[i, j] = pyn / norm
+        # update image from divergence
+        err = 0.0
+        for i in prange(h):
+            for j in range(w):
+                div = (px[i, j] - px[i, (j - 1) % w]) + (py[i, j] - py[(i - 1) % h, j])
+                v = img[i, j] + weight * div
+                err += (v - u[i, j]) ** 2
+                uNew[i, j] = v
+        u, uNew = uNew, u
+        error = np.sqrt(err) / np.sqrt(nm)
+        if it == 0:
+            err_init = error
+            err_prev = error
+        # as in the reference version, err_prev is not updated
+        elif np.abs(err_prev - error) < eps * err_init:
+            break
+    return u
+
+
+@registerCompiled('denoise')
+def denoiseJit(img, weight=0.1, eps=1e-3, num_iter_max=200):
+    if img.ndim != 2 or img.dtype.kind != 'f':
+        return denoise.reference(img, weight=weight, eps=eps, num_iter_max=num_iter_max)
+    return _tvDenoise(img, weight, eps, num_iter_max).astype(img.dtype)
+
+
+#################
+# Demosaicing
+#################
+
+@njit(parallel=True, cache=True)
+def _subtractBlackLevel(raw, colors, black, out):
+    h, w = raw.shape
+    for i in prange(h):
+        for j in range(w):
+            # uint16 arithmetic (wraps around), as in the reference version
+            out[i, j] = np.uint16((np.int64(raw[i, j]) - np.int64(black[colors[i, j]])) & 0xFFFF)
+
+
+@registerCompiled('subtractBlackLevel')
+def subtractBlackLevelJit(raw_image_visible, raw_colors_visible, black_level_per_channel):
+    black_level_per_channel = np.array(black_level_per_channel, dtype=np.uint16)
+    if not np.any(black_level_per_channel != 0):
+        return raw_image_visible
+    out = np.empty(raw_image_visible.shape, dtype=np.uint16)
+    _subtractBlackLevel(raw_image_visible, raw_colors_visible, black_level_per_channel, out)
+    return out
+
+
+#################
+# Color spaces
+#################
+
+@njit(parallel=True, cache=True)
+def _hsp2hsv(hsp, out):
+    h, w = hsp.shape[0], hsp.shape[1]
+    for i in prange(h):
+        for j in range(w):
+            hue, s, p = hsp[i, j, 0] / 60.0, hsp[i, j, 1], hsp[i, j, 2]
+            k = min(int(np.floor(hue)), 5)
+            f = hue - np.floor(hue)
+            p2 = p * p
+            # squared max(r, g, b) in each of the 6 regions (cf. hsp2rgbVec)
+            if s == 1.0:
+                if k == 0:
+                    Y = p2 / (Perc_R + Perc_G * f * f)
+                elif k == 1:
+                    Y = p2 / (Perc_G + Perc_R * (1 - f) * (1 - f))
+                elif k == 2:
+                    Y = p2 / (Perc_G + Perc_B * f * f)
+                elif k == 3:
+                    Y = p2 / (Perc_B + Perc_G * (1 - f) * (1 - f))
+                elif k == 4:
+                    Y = p2 / (Perc_B + Perc_R * f * f)
+                else:
+                    Y = p2 / (Perc_R + Perc_B * (1 - f) * (1 - f))
+            else:
+                Mm = 1.0 / (1.0 - s)
+                Mm2 = Mm * Mm
+                part1 = 1.0 - f * (1.0 - Mm)
+                part1 = part1 * part1
+                part2 = 1.0 - (1 - f) * (1.0 - Mm)
+                part2 = part2 * part2
+                if k == 0:
+                    Y = p2 / (Perc_R * Mm2 + Perc_G * part1 + Perc_B) * Mm2
+                elif k == 1:
+                    Y = p2 / (Perc_G * Mm2 + Perc_R * part2 + Perc_B) * Mm2
+                elif k == 2:
+                    Y = p2 / (Perc_G * Mm2 + Perc_B * part1 + Perc_R) * Mm2
+                elif k == 3:
+                    Y = p2 / (Perc_B * Mm2 + Perc_G * part2 + Perc_R) * Mm2
+                elif k == 4:
+                    Y = p2 / (Perc_B * Mm2 + Perc_R * part1 + Perc_G) * Mm2
+                else:
+                    Y = p2 / (Perc_R * Mm2 + Perc_B * part2 + Perc_G) * Mm2
+            v = min(max(np.sqrt(Y), 0.0), 1.0)
+            out[i, j, 0] = np.uint8(hsp[i, j, 0] * 0.5)
+            out[i, j, 1] = np.uint8(s * 255.0)
+            out[i, j, 2] = np.uint8(v * 255.0)
+
+
+@registerCompiled('hsp2rgbVec')
+def hsp2rgbVecJit(hspImg, parallel=True):
+    # the kernel is always parallel (prange)
+    shape = hspImg.shape[:-1]
+    hsp = np.asarray(hspImg, dtype=np.float64)
+    if hsp.ndim != 3:
+        hsp = hsp.reshape((-1, 1, 3))
+    hsv = np.empty(hsp.shape, dtype=np.uint8)
+    _hsp2hsv(hsp, hsv)
+    rgb1 = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+    return rgb1.reshape(shape + (3,))
+
+
+@njit(parallel=True, cache=True)
+def _hsvScale(hsv, rgb, perceptual, out):
+    h, w = hsv.shape[0], hsv.shape[1]
+    for i in prange(h):
+        for j in range(w):
+            out[i, j, 0] = hsv[i, j, 0] * 2.0
+            out[i, j, 1] = hsv[i, j, 1] * (1.0 / 255.0)
+            if perceptual:
+                r, g, b = np.float64(rgb[i, j, 0]), np.float64(rgb[i, j, 1]), np.float64(rgb[i, j, 2])
+                out[i, j, 2] = np.sqrt((r * r * Perc_R + g * g * Perc_G + b * b * Perc_B) / (255.0 * 255))
+            else:
+                out[i, j, 2] = hsv[i, j, 2] * (1.0 / 255.0)
+
+
+@registerCompiled('rgb2hsBVec')
+def rgb2hsBVecJit(rgbImg, perceptual=False):
+    if rgbImg.ndim != 3:
+        return rgb2hsBVec.reference(rgbImg, perceptual=perceptual)
+    hsv = cv2.cvtColor(rgbImg.astype(np.uint8), cv2.COLOR_RGB2HSV)
+    out = np.empty(hsv.shape, dtype=np.float64)
+    _hsvScale(hsv, rgbImg, perceptual, out)
+    return out
@@ -0,0 +1,173 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+# unique identifiers for versioned LUTs
+_uidCounter = count()
+
+# LRU cache of prepared LUTs
+_preparedCache = OrderedDict()
+PREPARED_CACHE_SIZE = 8
+
+
+class PreparedLUT(object):
+    """
+    Interpolation state of a 3D LUT, computed once per LUT revision :
+    float32 contiguous copy of the LUT, item strides, offsets of the
+    eight vertices of the unit cube in the flattened LUT, and reciprocals of the
+    interpolation steps. Fixed point copies of the LUT are built on demand
+    and kept with the object.
+    Interpolation functions accept a PreparedLUT instead of a LUT array.
+    """
+    def __init__(self, LUT, LUTSTEP):
+        """
+        @param LUT: 3D LUT array
+        @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, d)
+        @param LUTSTEP: interpolation step
+        @type LUTSTEP: number or 3-uple of numbers
+        """
+        # Probably due to a numpy bug, ravel_multi_index sometimes returns wrong indices
+        # for non contiguous arrays.
+        if not LUT.flags['C_CONTIGUOUS']:
+            raise ValueError('PreparedLUT : LUT array must be contiguous')
+        self.source = LUT
+        self.LUT = LUT.astype(np.float32)
+        self.LUT.setflags(write=False)
+        self.shape = self.LUT.shape
+        self.step = LUTSTEP
+        self.invStep = 1.0 / np.asarray(LUTSTEP, dtype=float)
+        st = np.array(self.LUT.strides)
+        self.strides = st // st[-1]  # we count items instead of bytes
+        st = self.strides
+        # vertex offsets, ordering (r, g, b) : 000, 100, 010, 110, 001, 101, 011, 111
+        self.vertexOffsets = np.array([i * st[0] + j * st[1] + k * st[2]
+                                       for k in range(2) for j in range(2) for i in range(2)])
+        # max of absolute values, used by fixed point interpolation
+        self.maxAbs = float(np.max(np.abs(self.LUT)))
+        self.__fixed = {}
+
+    def matches(self, LUTSTEP):
+        """
+        Test whether the object was prepared for LUTSTEP.
+        @param LUTSTEP:
+        @type LUTSTEP: number or 3-uple of numbers
+        @return:
+        @rtype: boolean
+        """
+        return np.array_equal(np.asarray(self.step), np.asarray(LUTSTEP))
+
+    def fixedPoint(self, p):
+        """
+        Return the LUT, scaled by 2**p, rounded and
+        converted to int32, flattened to shape (s1 * s2 * s3, d).
+        @param p: count of fractional bits
+        @type p: int
+        @return:
+        @rtype: ndarray, dtype np.int32
+        """
+        buf = self.__fixed.get(p, None)
+        if buf is None:
+            buf = np.rint(self.source.astype(np.float64) * (1 << p)).astype(np.int32).reshape(-1, self.shape[-1])
+            self.__fixed[p] = buf
+        return buf
+
+
+def prepareLUT(LUT, LUTSTEP):
+    """
+    Return a PreparedLUT for LUT and LUTSTEP. If LUT is already a
+    PreparedLUT, it is returned unchanged when its step matches LUTSTEP.
+    No caching is done : cached objects are obtained from getPreparedLUT.
+    @param LUT:
+    @type LUT: ndarray or PreparedLUT
+    @param LUTSTEP:
+    @type LUTSTEP: number or 3-uple of numbers
+    @return:
+    @rtype: PreparedLUT
+    """
+    if isinstance(LUT, PreparedLUT):
+        return LUT if LUT.matches(LUTSTEP) else PreparedLUT(LUT.source, LUTSTEP)
+    return PreparedLUT(LUT, LUTSTEP)
+
+
+def lutArray(LUT):
+    """
+    Return the LUT array of LUT.
+    @param LUT:
+    @type LUT: ndarray or PreparedLUT
+    @return:
+    @rtype: ndarray
+    """
+    return LUT.source if isinstance(LUT, PreparedLUT) else LUT
+
+
+def getPreparedLUT(key, LUT, LUTSTEP):
+    """
+    Return the cached PreparedLUT for key and LUTSTEP, building it
+    if needed. Keys are usually (uid, version) pairs, as returned
+    by versionedLUT.versionKey. The cache holds the PREPARED_CACHE_SIZE
+    most recently used objects.
+    @param key: hashable identifier of the LUT revision
+    @type key: hashable
+    @param LUT: LUT array
+    @type LUT: ndarray
+    @param LUTSTEP:
+    @type LUTSTEP: number or 3-uple of numbers
+    @return:
+    @rtype: PreparedLUT
+    """
+    k = (key, tuple(np.atleast_1d(LUTSTEP).tolist()))
+    p = _preparedCache.get(k, None)
+    if p is not None:
+        _preparedCache.move_to_end(k)
+        return p
+    p = PreparedLUT(LUT, LUTSTEP)
+    _preparedCache[k] = p
+    while len(_preparedCache) > PREPARED_CACHE_SIZE:
+        _preparedCache.popitem(last=False)
+    return p
+
+
+class versionedLUT(object):
+    """
+    Mixin class for LUT containers, maintaining a version counter.
+    The version must be bumped (bumpVersion()) each time the LUT
+    data is modified in place, so that cached prepared
+    states (cf. getPreparedLUT) are invalidated.
+    """
+    def initVersion(self):
+        self.__uid = next(_uidCounter)
+        self.__version = 0
+
+    @property
+    def version(self):
+        return self.__version
+
+    @property
+    def versionKey(self):
+        """
+        Identifier of the current LUT revision.
+        @return:
+        @rtype: 2-uple of int
+        """
+        return self.__uid, self.__version
+
+    def bumpVersion(self):
+        self.__version += 1
@@ -0,0 +1,130 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+##########################################
+# Registry of numeric kernels.
+# Each registered kernel has a NumPy reference
+# implementation and, optionally, a compiled
+# (Numba) one, with the same signature.
+# The implementation used is chosen by
+# KERNEL_BACKEND (config.json) : 'numpy', 'numba' or
+# 'auto' (Numba if it is installed).
+##########################################
+from functools import wraps
+from importlib.util import find_spec
+
+from settings import KERNEL_BACKEND
+
+# Numba is detected without importing it : the (slow)
+# import is done on the first call to a compiled kernel.
+hasNumba = find_spec('numba') is not None
+
+# name --> NumPy implementation
+_reference = {}
+# name --> Numba implementation
+_compiled = {}
+# name --> chosen implementation
+_chosen = {}
+
+
+def useNumba():
+    """
+    Return True if compiled kernels are selected and available.
+    @return:
+    @rtype: boolean
+    """
+    return hasNumba and KERNEL_BACKEND in ['numba', 'auto']
+
+
+def _loadCompiled():
+    """
+    Import the compiled kernels, registering them.
+    On failure, the NumPy implementations are used.
+    """
+    global hasNumba
+    try:
+        from . import numbaKernels  # noqa: F401
+    except Exception as e:  # ImportError, numba errors
+        print('Numba kernels disabled : %s' % str(e))
+        hasNumba = False
+
+
+def registered(name):
+    """
+    Decorator registering a NumPy function as the reference
+    implementation of the kernel name. The decorated function
+    dispatches its calls to the chosen implementation (cf. chosenKernel()).
+    The reference implementation remains available as the attribute
+    reference of the decorated function.
+    @param name: kernel name
+    @type name: str
+    @return: decorator
+    @rtype: function
+    """
+    def decorator(f):
+        _reference[name] = f
+
+        @wraps(f)
+        def dispatch(*args, **kwargs):
+            return chosenKernel(name)(*args, **kwargs)
+        dispatch.reference = f
+        return dispatch
+    return decorator
+
+
+def registerCompiled(name):
+    """
+    Decorator registering a function as the compiled
+    implementation of the kernel name.
+    @param name: kernel name
+    @type name: str
+    @return: decorator
+    @rtype: function
+    """
+    def decorator(f):
+        _compiled[name] = f
+        return f
+    return decorator
+
+
+def chosenKernel(name):
+    """
+    Return the implementation of the kernel name
+    selected by KERNEL_BACKEND.
+    @param name: kernel name
+    @type name: str
+    @return:
+    @rtype: function
+    """
+    f = _chosen.get(name, None)
+    if f is None:
+        if useNumba() and not _compiled:
+            _loadCompiled()
+        f = _compiled.get(name, None) if useNumba() else None
+        if f is None:
+            f = _reference[name]
+        _chosen[name] = f
+    return f
+
+
+def kernelNames():
+    """
+    Return the names of the registered kernels.
+    @return:
+    @rtype: list of str
+    """
+    return sorted(_reference.keys())
@@ -19,6 +19,8 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
 
+from .registry import registered
+
 hasOpenCV = False
 try:
     import cv2
@@ -81,6 +83,7 @@ def strides_2d(a, r, linear=True):
     # reshape
     return s.reshape(a.shape + (shape[2] * shape[3],)) if linear else s
 
+@registered('movingAverage')
 def movingAverage(a, winsize, version='kernel'):
     """
     Compute the moving averages of a 1D or 2D array.
@@ -118,6 +121,7 @@ def movingAverage(a, winsize, version='kernel'):
     else:
         raise ValueError('array ndims must be 1 or 2')
 
+@registered('movingVariance')
 def movingVariance(a, winsize, version='kernel'):
     """
     Compute the moving variance of a 1D or 2D array.
@@ -18,11 +18,104 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
 
+from bLUeCore.preparedLUT import prepareLUT, lutArray
+from bLUeCore.registry import registered
 
+
+@registered('interpTetra')
 def interpTetra(LUT, LUTSTEP, ndImg, convert=True):
     """
     Implement a vectorized version of tetrahedral interpolation.
 
+    For each pixel, the fractional parts fR, fG, fB of its coordinates
+    in the bounding unit cube are sorted : fmax >= fmid >= fmin. The
+    enclosing tetrahedron has vertices V0 (origin of the cube), V1 = V0 + e_max,
+    V2 = V3 - e_min and V3 (opposite vertex), where e_i is the unit vector of axis i.
+    Only these four vertices are gathered, and
+    Y = V0 + fmax * (V1 - V0) + fmid * (V2 - V1) + fmin * (V3 - V2).
+    Ties are broken consistently, so max and min axes are always distinct.
+
+    Convert a array ndImg with shape (w, h, d)  with d >=3 by interpolating
+    its values in a 3D LUT array LUT with shape s = (s1, s2, s3, d).
+    Inputs are taken from the third axis of ndImg[:,:,:3]. they are input to
+    the three first axes of the LUT, keeping the same ordering (i.e. v[i] is input to axis i).
+    Output values are interpolated from the LUT.
+
+    LUTSTEP is the number or the 3-uple of numbers giving the unitary interpolation
+    steps for each axis of the LUT table.
+
+    All input values for axis i of the LUT must be in the (right opened)
+    interval [0, max[ with max = (s[i] - 1) * LUTSTEP[i]. Closed intervals
+    [0, max] can be used instead by adding a sentinel to each axis. Then, with
+    max = (s[i] - 2) * LUTSTEP[i], the LUT values for sentinel sides are not used.
+
+    if convert is True (default), the output array is clipped to (0, 255) and converted
+    to dtype=np.uint8, otherwise the output array has the same shape as ndImg and
+    dtype= np.float32.
+
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3), or PreparedLUT
+    @param LUTSTEP: interpolation step
+    @type LUTSTEP: number or 3-uple of numbers
+    @param ndImg: input array
+    @type ndImg: ndarray dtype float or int, shape (w, h, 3)
+    @param convert: convert the output to dtype=np.uint8
+    @type convert: boolean
+    @return: interpolated array
+    @rtype: ndarray, same shape as the input image
+    """
+    P = prepareLUT(LUT, LUTSTEP)
+    LUT = P.LUT
+    ndImgF = ndImg[:, :, :3] * P.invStep
+    a = ndImgF.astype(np.int16)
+    s = P.shape
+    st = P.strides
+    flatIndex = np.ravel_multi_index((a[:, :, 0, np.newaxis],
+                                      a[:, :, 1, np.newaxis],
+                                      a[:, :, 2, np.newaxis],
+                                      np.arange(s[-1])),
+                                     s)  # broadcasted to shape (w,h,d)
+    # fractional parts
+    f = ndImgF - a
+    del ndImgF, a
+    # axes of max and min fractional parts : first max and last min,
+    # so that they are distinct, even for ties.
+    iMax = np.argmax(f, axis=2)
+    iMin = 2 - np.argmax(f[:, :, ::-1] <= f.min(axis=2)[..., np.newaxis], axis=2)
+    fMax = np.take_along_axis(f, iMax[..., np.newaxis], axis=2)
+    fMin = np.take_along_axis(f, iMin[..., np.newaxis], axis=2)
+    fMid = f.sum(axis=2)[..., np.newaxis] - fMax - fMin
+    del f
+    # vertices of the tetrahedron
+    st3 = P.vertexOffsets[7]
+    V0 = np.take(LUT, flatIndex)
+    V1 = np.take(LUT, flatIndex + st[iMax][..., np.newaxis])
+    V2 = np.take(LUT, flatIndex + (st3 - st[iMin])[..., np.newaxis])
+    V3 = np.take(LUT, flatIndex + st3)
+    del flatIndex, iMax, iMin
+    # Y = V0 + fMax * (V1 - V0) + fMid * (V2 - V1) + fMin * (V3 - V2), computed in place
+    V3 -= V2
+    V3 *= fMin
+    V2 -= V1
+    V2 *= fMid
+    V1 -= V0
+    V1 *= fMax
+    Y1 = V0
+    Y1 += V1
+    Y1 += V2
+    Y1 += V3
+    if convert:
+        np.clip(Y1, 0, 255, out=Y1)
+        Y1 = Y1.astype(np.uint8)
+    return Y1
+
+
+def interpTetraSelect(LUT, LUTSTEP, ndImg, convert=True):
+    """
+    Implement a vectorized version of tetrahedral interpolation,
+    computing the values for all six tetrahedra. It is kept as a reference
+    implementation for interpTetra.
+
     Convert a array ndImg with shape (w, h, d)  with d >=3 by interpolating
     its values in a 3D LUT array LUT with shape s = (s1, s2, s3, d).
     Inputs are taken from the third axis of ndImg[:,:,:3]. they are input to
@@ -41,7 +134,7 @@ def interpTetra(LUT, LUTSTEP, ndImg, convert=True):
     to dtype=np.uint8, otherwise the output array has the same shape as ndImg and
     dtype= np.float32.
 
-    It turns out that tetrahedral interpolation is 2 times slower
+    It turns out that this version is 2 times slower
     than trilinear.
     @param LUT: 3D LUT array
     @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3)
@@ -54,10 +147,11 @@ def interpTetra(LUT, LUTSTEP, ndImg, convert=True):
     @return: interpolatd array
     @rtype: ndarray, same shape as the input image
     """
+    LUT = lutArray(LUT)
     # Probably due to a numpy bug, ravel_multi_index sometimes returns wrong indices
     # for non contiguous arrays.
     if not LUT.flags['C_CONTIGUOUS']:
-        raise ValueError('interpTetra : LUT array must be contiguous')
+        raise ValueError('interpTetraSelect : LUT array must be contiguous')
     # As interpolation computes differences, we switch to a signed type,
     # minimizing memory usage and implicit conversions.
     LUT = LUT.astype(np.float32)
@@ -17,7 +17,11 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import numpy as np
 
+from bLUeCore.preparedLUT import prepareLUT
+from bLUeCore.registry import registered
 
+
+@registered('interpTriLinear')
 def interpTriLinear(LUT, LUTSTEP, ndImg, convert=True):
     """
     Implement a vectorized version of trilinear interpolation.
@@ -40,8 +44,8 @@ def interpTriLinear(LUT, LUTSTEP, ndImg, convert=True):
     to dtype=np.uint8, otherwise the output array has the same shape as ndImg and
     dtype= np.float32.
 
-    @param LUT: 3D LUT array
-    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3)
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, 3), or PreparedLUT
     @param LUTSTEP: interpolation step
     @type LUTSTEP: number or 3-uple of numbers
     @param ndImg: input array
@@ -51,24 +55,19 @@ def interpTriLinear(LUT, LUTSTEP, ndImg, convert=True):
     @return: interpolated array
     @rtype: ndarray, same shape as the input image
     """
-    # Probably due to a numpy bug, ravel_multi_index sometimes returns wrong indices
-    # for non contiguous arrays.
-    if not LUT.flags['C_CONTIGUOUS']:
-        raise ValueError('interpTriLinear : LUT array must be contiguous')
-    # As interpolation computes differences, we switch to a signed type,
-    # minimizing memory usage and implicit conversions.
-    # LUT = LUT.astype(np.int16)
-    LUT = LUT.astype(np.float32)
+    # As interpolation computes differences, we use a signed type,
+    # minimizing memory usage and implicit conversions : the prepared
+    # LUT holds a float32 copy of the LUT (contiguity is checked by PreparedLUT).
+    P = prepareLUT(LUT, LUTSTEP)
+    LUT = P.LUT
     # We will use the bounding unit cube around each point (r, g, b)/LUTSTEP :
     # get its vertex closest to the origin and the corresponding channel colors.
-    ndImgF = ndImg / LUTSTEP
+    ndImgF = ndImg * P.invStep
     a = ndImgF.astype(np.int16)
     r0, g0, b0 = a[:, :, 0], a[:, :, 1], a[:, :, 2]
 
     # get indices of the vertex channels in the flattened LUT
-    s = LUT.shape
-    st = np.array(LUT.strides)
-    st = st // st[-1]  # we count items instead of bytes
+    s = P.shape
     flatIndex = np.ravel_multi_index((r0[...,np.newaxis],
                                       g0[...,np.newaxis],
                                       b0[...,np.newaxis],
@@ -77,14 +76,15 @@ def interpTriLinear(LUT, LUTSTEP, ndImg, convert=True):
 
     # apply LUT to the vertices of the bounding cube.
     # np.take uses the the flattened LUT, but keeps the shape of flatIndex
+    off = P.vertexOffsets
     ndImg00 = np.take(LUT, flatIndex)                            # = LUT[r0, g0, b0] but faster
-    ndImg01 = np.take(LUT, flatIndex + st[0])                    # = LUT[r1, g0, b0] where r1 = r0 + 1
-    ndImg02 = np.take(LUT, flatIndex + st[1])                    # = LUT[r0, g1, b0]
-    ndImg03 = np.take(LUT, flatIndex + (st[0] + st[1]))          # = LUT[r1, g1, b0]
-    ndImg10 = np.take(LUT, flatIndex + st[2])                    # = LUT[r0, g0, b1]
-    ndImg11 = np.take(LUT, flatIndex + (st[0] + st[2]))          # = LUT[r1, g0, b1]
-    ndImg12 = np.take(LUT, flatIndex + (st[1] + st[2]))          # = LUT[r0, g1, b1]
-    ndImg13 = np.take(LUT, flatIndex + (st[0] + st[1] + st[2]))  # = LUT[r1, g1, b1]
+    ndImg01 = np.take(LUT, flatIndex + off[1])                   # = LUT[r1, g0, b0] where r1 = r0 + 1
+    ndImg02 = np.take(LUT, flatIndex + off[2])                   # = LUT[r0, g1, b0]
+    ndImg03 = np.take(LUT, flatIndex + off[3])                   # = LUT[r1, g1, b0]
+    ndImg10 = np.take(LUT, flatIndex + off[4])                   # = LUT[r0, g0, b1]
+    ndImg11 = np.take(LUT, flatIndex + off[5])                   # = LUT[r1, g0, b1]
+    ndImg12 = np.take(LUT, flatIndex + off[6])                   # = LUT[r0, g1, b1]
+    ndImg13 = np.take(LUT, flatIndex + off[7])                   # = LUT[r1, g1, b1]
 
     # interpolation
     alpha = ndImgF[:, :, 1] - g0
@@ -118,3 +118,136 @@ def interpTriLinear(LUT, LUTSTEP, ndImg, convert=True):
         np.clip(IValue, 0, 255, out=IValue)
         IValue = IValue.astype(np.uint8)
     return IValue
+
+
+def fixedPointParams(P, LUTSTEP, ndImg):
+    """
+    Return the parameters of fixed point interpolation, or None
+    if the interpolation is not eligible (cf. interpTriLinearInt()) :
+    the log2 k of LUTSTEP, the total shift 3 * k + p, where p is the
+    count of fractional bits, the fixed point LUT and the vertex strides.
+    @param P:
+    @type P: PreparedLUT
+    @param LUTSTEP: interpolation step
+    @type LUTSTEP: number
+    @param ndImg: input array
+    @type ndImg: ndarray
+    @return:
+    @rtype: 4-uple or None
+    """
+    k = int(np.log2(LUTSTEP)) if np.isscalar(LUTSTEP) and LUTSTEP >= 1 else -1
+    s = P.shape
+    if ndImg.dtype != np.uint8 or k < 0 or 2 ** k != LUTSTEP or any([(255 >> k) + 1 >= si for si in s[:3]]):
+        return None
+    # fixed point LUT : 2 * max|LUT| * 2**p * LUTSTEP**3 must fit in int32
+    M = max(P.maxAbs, 1.0)
+    p = max(30 - 3 * k - int(np.ceil(np.log2(M + 1))), 0)
+    # rounding needs at least one fractional bit
+    if 3 * k + p < 1:
+        return None
+    # vertex strides, counted in vertices
+    st = [int(x) for x in P.strides[:3] // s[-1]]
+    return k, 3 * k + p, P.fixedPoint(p), st
+
+
+@registered('interpTriLinearInt')
+def interpTriLinearInt(LUT, LUTSTEP, ndImg, convert=True, chunkSize=2 ** 18):
+    """
+    Fixed point version of interpTriLinear, for 8 bits images.
+
+    The LUT is scaled to integers with p fractional bits and the
+    interpolation weights are the integer remainders v & (LUTSTEP - 1), so that
+    all computations are exact int32 operations, with a single rounding
+    at the end. p is chosen as large as possible without int32 overflow.
+    The image is processed by chunks of rows (about chunkSize pixels), using
+    preallocated scratch buffers, so peak memory does not depend on the image size.
+    Results are identical to those of interpTriLinear, up to +-1.
+
+    LUTSTEP must be a number with integer power of 2 value and ndImg must
+    have dtype np.uint8. Otherwise, the function falls back to interpTriLinear.
+
+    if convert is True (default), the output array is clipped to (0, 255) and converted
+    to dtype=np.uint8, otherwise the output array has dtype= np.float32.
+
+    @param LUT: 3D LUT array or prepared LUT
+    @type LUT: ndarray, dtype float or int, shape(s1, s2, s3, d), or PreparedLUT
+    @param LUTSTEP: interpolation step
+    @type LUTSTEP: number
+    @param ndImg: input array
+    @type ndImg: ndarray dtype np.uint8, shape (h, w, d'), d' >= 3
+    @param convert: convert the output to dtype=np.uint8
+    @type convert: boolean
+    @param chunkSize: approximate pixel count of chunks
+    @type chunkSize: int
+    @return: interpolated array
+    @rtype: ndarray, shape (h, w, d)
+    """
+    P = prepareLUT(LUT, LUTSTEP)
+    params = fixedPointParams(P, LUTSTEP, ndImg)
+    if params is None:
+        return interpTriLinear(P, LUTSTEP, ndImg, convert=convert)
+    k, shift, LUTInt, st = params
+    d = P.shape[-1]
+    mask = (1 << k) - 1
+
+    h, w = ndImg.shape[:2]
+    outImg = np.empty((h, w, d), dtype=np.uint8 if convert else np.float32)
+    rows = max(chunkSize // max(w, 1), 1)
+    n = rows * w
+    # scratch buffers
+    base, idx = np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)
+    c = np.empty(n, dtype=np.int32)
+    f0, f1, f2 = [np.empty((n, 1), dtype=np.int32) for _ in range(3)]
+    A, B, C, T = [np.empty((n, d), dtype=np.int32) for _ in range(4)]
+
+    for r in range(0, h, rows):
+        chunk = ndImg[r:r + rows]
+        m = chunk.shape[0] * w
+        px = chunk.reshape(m, -1)
+        a, b, cc, t = A[:m], B[:m], C[:m], T[:m]
+        bs, ix, ci = base[:m], idx[:m], c[:m]
+        fr = (f0[:m], f1[:m], f2[:m])
+        # bounding cube origin (flat index) and integer weights
+        bs[...] = 0
+        for i in range(3):
+            np.right_shift(px[:, i], k, out=ci, casting='unsafe')
+            ci *= st[i]
+            bs += ci
+            np.bitwise_and(px[:, i], mask, out=fr[i][:, 0], casting='unsafe')
+
+        def gatherLerp(dst, off0, off1):
+            # dst = V0 * LUTSTEP + (V1 - V0) * f2
+            np.add(bs, off0, out=ix)
+            np.take(LUTInt, ix, axis=0, out=dst, mode='clip')
+            np.add(bs, off1, out=ix)
+            np.take(LUTInt, ix, axis=0, out=t, mode='clip')
+            np.subtract(t, dst, out=t)
+            np.multiply(t, fr[2], out=t)
+            dst <<= k
+            dst += t
+
+        def lerp(dst, src, f):
+            # dst = dst * LUTSTEP + (src - dst) * f, src is overwritten
+            src -= dst
+            src *= f
+            dst <<= k
+            dst += src
+
+        gatherLerp(a, 0, st[2])                            # r0, g0
+        gatherLerp(b, st[1], st[1] + st[2])                # r0, g1
+        lerp(a, b, fr[1])
+        gatherLerp(b, st[0], st[0] + st[2])                # r1, g0
+        gatherLerp(cc, st[0] + st[1], st[0] + st[1] + st[2])  # r1, g1
+        lerp(b, cc, fr[1])
+        lerp(a, b, fr[0])
+
+        out = outImg[r:r + rows].reshape(m, d)
+        if convert:
+            # round and clip
+            a += 1 << (shift - 1)
+            a >>= shift
+            np.clip(a, 0, 255, out=a)
+            out[...] = a
+        else:
+            np.multiply(a, 1.0 / (1 << shift), out=out, casting='unsafe')
+    return outImg
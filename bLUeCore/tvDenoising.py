@@ -24,6 +24,10 @@ LICENSE CC-BY 4.0 Cf. https://creativecommons.org/licenses/by/4.0/
 
 import numpy as np
 
+from .registry import registered
+
+
+@registered('denoise')
 def denoise(img, weight=0.1, eps=1e-3, num_iter_max=200):
     """Perform total-variation denoising on a grayscale image.
 
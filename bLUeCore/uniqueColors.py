@@ -0,0 +1,109 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from settings import UNIQUE_COLORS_MAX_RATIO, UNIQUE_COLORS_MIN_SIZE
+
+
+def packColors(ndImg):
+    """
+    Pack the three first channels of an 8 bits image
+    into 24 bits keys : key = (c0 << 16) | (c1 << 8) | c2.
+    @param ndImg: image array
+    @type ndImg: ndarray, dtype np.uint8, shape (h, w, d), d >= 3
+    @return: keys
+    @rtype: ndarray, dtype np.uint32, shape (h, w)
+    """
+    keys = ndImg[:, :, 0].astype(np.uint32)
+    keys <<= 8
+    keys |= ndImg[:, :, 1]
+    keys <<= 8
+    keys |= ndImg[:, :, 2]
+    return keys
+
+
+def unpackColors(keys):
+    """
+    Inverse of packColors.
+    @param keys:
+    @type keys: ndarray, dtype np.uint32 or int, shape (n,)
+    @return: colors
+    @rtype: ndarray, dtype np.uint8, shape (n, 3)
+    """
+    colors = np.empty((len(keys), 3), dtype=np.uint8)
+    colors[:, 0] = keys >> 16
+    colors[:, 1] = (keys >> 8) & 255
+    colors[:, 2] = keys & 255
+    return colors
+
+
+def mapUnique(f, ndImg, maxRatio=None, stats=None):
+    """
+    Apply a pointwise function f to an 8 bits image, evaluating f
+    only once for each distinct color.
+    Colors are packed into 24 bits keys, and distinct colors are found
+    using a presence map. f is applied to the array of distinct colors
+    and the results are scattered back to the image with a single take.
+    If the ratio of distinct colors to the image size is higher than maxRatio,
+    or if the image is too small to benefit from collapsing,
+    f is applied to the whole image (dense path).
+    f must take a (h, w, 3) uint8 array and return an array of shape (h, w, d).
+    If stats is a dict, it is updated with the keys 'path' ('unique' or 'dense'),
+    'colors' (count of distinct colors, or None) and 'ratio'.
+    @param f: pointwise function
+    @type f: function
+    @param ndImg: input image
+    @type ndImg: ndarray, dtype np.uint8, shape (h, w, 3)
+    @param maxRatio: max ratio distinct colors / pixels for the unique path. Default UNIQUE_COLORS_MAX_RATIO
+    @type maxRatio: float
+    @param stats:
+    @type stats: dict
+    @return: f(ndImg)
+    @rtype: ndarray, shape (h, w, d)
+    """
+    if maxRatio is None:
+        maxRatio = UNIQUE_COLORS_MAX_RATIO
+    if stats is None:
+        stats = {}
+    h, w = ndImg.shape[:2]
+    size = h * w
+    if ndImg.dtype != np.uint8 or ndImg.ndim != 3 or ndImg.shape[2] != 3 or size < UNIQUE_COLORS_MIN_SIZE:
+        stats.update(path='dense', colors=None, ratio=None)
+        return f(ndImg)
+    keys = packColors(ndImg)
+    presence = np.zeros(1 << 24, dtype=bool)
+    presence[keys] = True
+    unique = np.flatnonzero(presence)
+    n = len(unique)
+    ratio = n / size
+    if ratio > maxRatio:
+        stats.update(path='dense', colors=n, ratio=ratio)
+        return f(ndImg)
+    stats.update(path='unique', colors=n, ratio=ratio)
+    # lay out distinct colors as a (nearly) square image, padded with black,
+    # to keep tiling of parallel interpolation efficient.
+    m = int(np.ceil(np.sqrt(n)))
+    colors = np.zeros((m * m, 3), dtype=np.uint8)
+    colors[:n] = unpackColors(unique)
+    values = f(colors.reshape(m, m, 3))
+    values = values.reshape(m * m, -1)[:n]
+    # index table : key --> rank of key in unique. Only entries for
+    # present keys are initialized and read.
+    table = np.empty(1 << 24, dtype=np.int32)
+    table[unique] = np.arange(n, dtype=np.int32)
+    return np.take(values, table[keys], axis=0)
@@ -22,9 +22,8 @@ from PySide2.QtCore import QSize, QRect, QPoint, Qt
 from PySide2.QtGui import QImage, QPixmap, QColor, QPainter
 
 from bLUeCore.SavitskyGolay import SavitzkyGolayFilter
-from bLUeGui.colorCIE import sRGB2LabVec
-from bLUeGui.colorCube import rgb2hspVec
 from bLUeGui.graphicsSpline import channelValues
+from conversionCache import colorCache
 
 
 class bImage(QImage):
@@ -45,9 +44,6 @@ class bImage(QImage):
         super().__init__(*args, **kwargs)
         self.__filename = ''
         self.__rPixmap = None
-        self.__hspbBuffer = None
-        self.__LabBuffer = None
-        self.__HSVBuffer = None
         self.maskedImageContainer = None
         self.maskedThumbContainer = None
         self.mask = None
@@ -71,75 +67,61 @@ class bImage(QImage):
     def rPixmap(self, pixmap):
         self.__rPixmap = pixmap
 
-    @property
-    def hspbBuffer(self):
-        return self.__hspbBuffer
-
-    @hspbBuffer.setter
-    def hspbBuffer(self, buffer):
-        self.__hspbBuffer = buffer
-
-    @property
-    def LabBuffer(self):
-        return self.__LabBuffer
-
-    @LabBuffer.setter
-    def LabBuffer(self, buffer):
-        self.__LabBuffer = buffer
-
-    @property
-    def HSVBuffer(self):
-        return self.__HSVBuffer
-
-    @HSVBuffer.setter
-    def HSVBuffer(self, buffer):
-        self.__HSVBuffer = buffer
+    def getColorBuffer(self, space, copy=False):
+        """
+        return the image buffer in a color mode. The buffer
+        is shared with other images (cf. conversionCache.py).
+        Override to change the source image.
+        @param space: 'HSpB', 'Lab' or 'HSV'
+        @type space: str
+        @param copy: return a private (writable) buffer
+        @type copy: boolean
+        @return: color buffer, read-only unless copy is True
+        @rtype: ndarray
+        """
+        return colorCache.getBuffer(self.cacheKey(), space, QImageConstBuffer(self), copy=copy)
 
-    def getHspbBuffer(self):
+    def getHspbBuffer(self, copy=False):
         """
         return the image buffer in color mode HSpB.
-        Override to enable buffering
+        @param copy: return a private (writable) buffer
+        @type copy: boolean
         @return: HSPB buffer
         @rtype: ndarray
         """
-        self.hspbBuffer = rgb2hspVec(QImageBuffer(self)[:, :, :3][:, :, ::-1])
-        return self.hspbBuffer
+        return self.getColorBuffer('HSpB', copy=copy)
 
-    def getLabBuffer(self):
+    def getLabBuffer(self, copy=False):
         """
         return the image buffer in color mode Lab.
-        Override to enable buffering
-       """
-        self.LabBuffer = sRGB2LabVec(QImageBuffer(self)[:, :, :3][:, :, ::-1])
-        return self.LabBuffer
+        L range is 0..1, a, b ranges are -128..+128
+        @param copy: return a private (writable) buffer
+        @type copy: boolean
+        @return: Lab buffer
+        @rtype: ndarray
+        """
+        return self.getColorBuffer('Lab', copy=copy)
 
-    def getHSVBuffer(self):
+    def getHSVBuffer(self, copy=False):
         """
         return the image buffer in color mode HSV.
-        Override to enable buffering
+        H,S,V ranges are 0..255 (opencv convention for 8 bits images)
+        @param copy: return a private (writable) buffer
+        @type copy: boolean
+        @return: HSV buffer
+        @rtype: ndarray, dtype=np.uint8
         """
-        self.HSVBuffer = cv2.cvtColor(QImageBuffer(self)[:, :, :3], cv2.COLOR_BGR2HSV)
-        return self.HSVBuffer
+        return self.getColorBuffer('HSV', copy=copy)
 
     def cacheInvalidate(self):
         """
         Invalidate cache buffers.
         (called by applyToStack after layer.execute)
+        Color space buffers are indexed by the cache key
+        of their source image (cf. conversionCache.py) :
+        they are never stale and nothing is done here.
         """
-        self.hspbBuffer = None
-        self.LabBuffer = None
-        self.HSVBuffer = None
-        # maskedxxxContainer objects are meant to be
-        # of type bImage, or a subclass of bImage : we
-        # try to invalidate their cache buffers recursively.
-        try:
-            self.maskedImageContainer.cacheInvalidate()
-        except AttributeError:
-            pass
-        try:
-            self.maskedThumbContainer.cacheInvalidate()
-        except AttributeError:
-            pass
+        pass
 
     def updatePixmap(self, maskOnly=False):
         """
@@ -222,10 +204,10 @@ class bImage(QImage):
                         painter.fillRect(left, 0, 10, 10, QColor(255, 255*gPercent, 0))
         # green percent for clipping indicators
         gPercent = 1.0
-        bufL = cv2.cvtColor(QImageBuffer(self)[:, :, :3], cv2.COLOR_BGR2GRAY)[..., np.newaxis]  # returns Y (YCrCb) : Y = 0.299*R + 0.587*G + 0.114*B
+        bufL = cv2.cvtColor(QImageConstBuffer(self)[:, :, :3], cv2.COLOR_BGR2GRAY)[..., np.newaxis]  # returns Y (YCrCb) : Y = 0.299*R + 0.587*G + 0.114*B
         buf = None  # TODO added 5/11/18 validate
         if mode == 'RGB':
-            buf = QImageBuffer(self)[:, :, :3][:, :, ::-1]  # RGB
+            buf = QImageConstBuffer(self)[:, :, :3][:, :, ::-1]  # RGB
         elif mode == 'HSV':
             buf = self.getHSVBuffer()
         elif mode == 'HSpB':
@@ -331,3 +313,22 @@ def QImageBuffer(qimg):
     # convert buffer to ndarray and reshape
     h, w = qimg.height(), qimg.width()
     return np.asarray(ptr, dtype=np.uint8).reshape(h, w, Bpp)  # specifying dtype is mandatory to prevent copy of data
+
+
+def QImageConstBuffer(qimg):
+    """
+    Returns a read-only view of the buffer of a QImage. Unlike
+    QImageBuffer(), the image buffer is neither copied nor detached :
+    the cache key of the image is not modified.
+    @param qimg:
+    @type qimg: QImage
+    @return: The buffer array
+    @rtype: numpy ndarray, shape = (h,w, bytes_per_pixel), dtype=uint8
+    """
+    bpp = qimg.depth()
+    if bpp == 1:
+        raise ValueError("QImageConstBuffer : unsupported image format 1 bit per pixel")
+    Bpp = bpp // 8
+    ptr = qimg.constBits()
+    h, w = qimg.height(), qimg.width()
+    return np.frombuffer(ptr, dtype=np.uint8).reshape(h, w, Bpp)
@@ -17,6 +17,8 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import cv2
 import numpy as np
+
+from bLUeCore.cancellation import checkCancelled
 from debug import tdec
 
 #############################################################################
@@ -120,13 +122,67 @@ beta = 1.0 / gamma
 b = (a / (1.0 + a)) ** gamma
 # c = 255.0 * d
 
-F = 255.0 ** beta
-table0 = np.arange(256, dtype=np.float64)
-table2 = table0 / (255 * d)
-# tabulate ( (x + a) / (1 + a) )**gamma
-table3 = np.power((table0 / 255 + a) / (1 + a), gamma)    # np.power(table0 / 255.0, gamma) TODO 5/11/18 missing a corrected validate
-# tabulate (1 + a) * x**(1/gamma) - a
-table5 = np.power(table0, beta) * (1.0 + a) / F - a   # TODO 5/11/18 missing -a corrected validate
+#########################################################
+# Conversion tables :
+# decoding 8 bits values is a 256 entries gather, and
+# encoding interpolates a table of about ENCODE_TABLE_SIZE
+# intervals. The transfer function is not continuous at
+# gammaLinearTreshold1 : the table step is chosen to
+# put the threshold on a node, and each interval is
+# interpolated on a single branch of the function.
+# Encoding to 8 bits values uses a table of
+# ENCODE8_TABLE_SIZE + 1 rounded values (nearest node).
+#########################################################
+ENCODE_TABLE_SIZE = 4096
+ENCODE8_TABLE_SIZE = 65536
+
+
+def c2clVec(c):
+    """
+    Vectorized sRGB to linear RGB conversion (analytic).
+    @param c: values in range 0..1
+    @type c: ndarray
+    @return: linear values, range 0..1
+    @rtype: ndarray, dtype=float
+    """
+    return np.where(c <= gammaLinearTreshold2, c / d, np.power((c + a) / (1 + a), gamma))
+
+
+def cl2cVec(c):
+    """
+    Vectorized linear RGB to sRGB conversion (analytic).
+    @param c: linear values in range 0..1
+    @type c: ndarray
+    @return: values in range 0..1
+    @rtype: ndarray, dtype=float
+    """
+    return np.where(c <= gammaLinearTreshold1, c * d, (1.0 + a) * np.power(c, beta) - a)
+
+
+def buildEncodeTables():
+    """
+    Returns the scale mapping linear values to table positions, the values
+    of the transfer function (range 0..255) at the left nodes of the table
+    intervals, and the interpolation slopes.
+    @return:
+    @rtype: 3-uple float, ndarray, ndarray
+    """
+    scale = round(gammaLinearTreshold1 * ENCODE_TABLE_SIZE) / gammaLinearTreshold1
+    n = int(np.ceil(scale))
+    nodes = np.arange(n + 2) / scale
+    # values of the branch of each interval at its ends
+    linear = (nodes[:-1] + nodes[1:]) / 2 <= gammaLinearTreshold1
+    left = np.where(linear, nodes[:-1] * d, (1.0 + a) * np.power(nodes[:-1], beta) - a) * 255
+    right = np.where(linear, nodes[1:] * d, (1.0 + a) * np.power(nodes[1:], beta) - a) * 255
+    return scale, left, right - left
+
+
+decodeTable = c2clVec(np.arange(256, dtype=np.float64) / 255)
+encodeScale, encodeTable, encodeSlopes = buildEncodeTables()
+encode8Table = np.rint(cl2cVec(np.linspace(0.0, 1.0, ENCODE8_TABLE_SIZE + 1)) * 255).astype(np.uint8)
+tables32 = {'decode': decodeTable.astype(np.float32), 'encode': encodeTable.astype(np.float32),
+            'slopes': encodeSlopes.astype(np.float32)}
+
 
 def rgbLinear2rgb(r, g, b):
     """
@@ -148,22 +204,52 @@ def rgbLinear2rgb(r, g, b):
 
     return cl2c(r) * 255, cl2c(g) * 255, cl2c(b) * 255
 
-def rgbLinear2rgbVec(img):
+def rgbLinear2rgbVec(img, dtype=np.float64, interpolate=True):
     """
     Vectorized conversion from linear RGB to sRGB.
     See U{https://en.wikipedia.org/wiki/SRGB}
-    Linear r,g,b values are in range 0..1.
+    Linear r,g,b values are clipped to range 0..1.
     Output values are in range 0..255.
+    The transfer function is read from a table (cf. buildEncodeTables()),
+    with linear interpolation if interpolate is True.
+    @param img: linear RGB image, range 0..1
+    @type img: numpy array, dtype=float
+    @param dtype: output type, np.float32 or np.float64
+    @type dtype: numpy dtype
+    @param interpolate:
+    @type interpolate: boolean
+    @return: converted RGB image
+    @rtype: numpy array, dtype=dtype, range 0..255
+    """
+    if dtype == np.float32:
+        table, slopes = tables32['encode'], tables32['slopes']
+    else:
+        table, slopes = encodeTable, encodeSlopes
+    x = np.multiply(img, encodeScale, dtype=dtype)
+    np.clip(x, 0, encodeScale, out=x)
+    i = x.astype(np.intp)
+    if not interpolate:
+        return np.take(table, i)
+    # x <-- fractional part
+    x -= i
+    x *= np.take(slopes, i)
+    x += np.take(table, i)
+    return x
+
+def rgbLinear2rgb8Vec(img):
+    """
+    Vectorized conversion from linear RGB to 8 bits sRGB.
+    Linear r,g,b values are clipped to range 0..1 and
+    the output values are rounded (cf. rgbLinear2rgbVec()).
     @param img: linear RGB image, range 0..1
     @type img: numpy array, dtype=float
     @return: converted RGB image
-    @rtype: numpy array, dtype=float, range 0..255
+    @rtype: numpy array, dtype=np.uint8, range 0..255
     """
-    img2 = img * d
-    imgDiscretized = (img * 255.0).astype(int)
-    #np.clip(imgDiscretized, 0, 255, out=imgDiscretized)  # TODO 5/11/18 removed
-    img3 = table5[imgDiscretized]
-    return np.where(imgDiscretized <= gammaLinearTreshold1 * 255, img2, img3) * 255 # TODO 5/11/18 bug corrected img--> imgDiscretized
+    x = np.multiply(img, ENCODE8_TABLE_SIZE, dtype=np.float32)
+    x += 0.5
+    np.clip(x, 0, ENCODE8_TABLE_SIZE, out=x)
+    return np.take(encode8Table, x.astype(np.intp))
 
 def rgb2rgbLinear(r, g, b):
     """
@@ -186,7 +272,7 @@ def rgb2rgbLinear(r, g, b):
 
     return c2cl(r), c2cl(g), c2cl(b)
 
-def rgb2rgbLinearVec(img):
+def rgb2rgbLinearVec(img, dtype=np.float64):
     """
     Converts image from sRGB to linear RGB.
     Input values are integers in range 0..255.
@@ -194,13 +280,95 @@ def rgb2rgbLinearVec(img):
     See https://en.wikipedia.org/wiki/SRGB
     @param img: RGB image, range 0..255
     @type img: numpy array, dtype int
+    @param dtype: output type, np.float32 or np.float64
+    @type dtype: numpy dtype
     @return: converted linear RGB image
-    @rtype: numpy array, dtype=float
+    @rtype: numpy array, dtype=dtype
+    """
+    table = tables32['decode'] if dtype == np.float32 else decodeTable
+    return np.take(table, img)
+
+
+class linearPipeline(object):
+    """
+    Pointwise operator in linear sRGB : 8 bits values are
+    decoded (cf. rgb2rgbLinearVec()), transformed by a 3x3 matrix
+    and encoded to 8 bits values (cf. rgbLinear2rgb8Vec()).
+    Consecutive scale and matrix operations are folded into a single
+    matrix, and the image is converted in a single pass, by chunks of
+    rows, so float arrays are allocated for a chunk only.
+    Matrices act on RGB column vectors. Images are in BGR(A) order (QImage buffers).
     """
-    img2 = table2[img[...]]  # img2 = img / c, faster
-    img3 = table3[img[...]]  # img3 = ( (img + a) / (1+a) ) ** gamma
-    tr = gammaLinearTreshold2 * 255.0
-    return np.where(img <= tr, img2, img3)
+    # max pixel count of chunks
+    chunkSize = 2 ** 18
+
+    def __init__(self):
+        self.M = np.identity(3)
+
+    def scale(self, c):
+        """
+        Multiply linear values by c.
+        @param c: scalar or RGB multipliers
+        @type c: float or 3-uple of float
+        @return: self
+        @rtype: linearPipeline
+        """
+        self.M = np.diag(np.broadcast_to(c, (3,))) @ self.M
+        return self
+
+    def transform(self, A):
+        """
+        Apply the matrix A to linear values.
+        @param A:
+        @type A: 3x3 array
+        @return: self
+        @rtype: linearPipeline
+        """
+        self.M = np.asarray(A, dtype=np.float64) @ self.M
+        return self
+
+    def normalize(self, bufIn):
+        """
+        Scale the pipeline so that the max output value is 1 for bufIn. The max values
+        of the input channels are read from their histograms : the normalization
+        is exact for diagonal matrices, and the max output value is at most 1 for
+        other matrices.
+        @param bufIn: input image, BGR(A) order
+        @type bufIn: ndarray, dtype=np.uint8
+        @return: self
+        @rtype: linearPipeline
+        """
+        buf = np.ascontiguousarray(bufIn)
+        top = []
+        for k in (2, 1, 0):
+            hist = cv2.calcHist([buf], [k], None, [256], [0, 256]).ravel()
+            nz = np.flatnonzero(hist)
+            top.append(nz[-1] if len(nz) > 0 else 0)
+        m = np.max(np.clip(self.M, 0, None) @ decodeTable[top])
+        if m > 0:
+            self.M = self.M / m
+        return self
+
+    def apply(self, bufIn, bufOut):
+        """
+        Convert the first 3 channels of bufIn to bufOut. Other channels
+        are not modified.
+        @param bufIn: input image, BGR(A) order
+        @type bufIn: ndarray, dtype=np.uint8
+        @param bufOut: output image, BGR(A) order, same height and width
+        @type bufOut: ndarray, dtype=np.uint8
+        @return: bufOut
+        @rtype: ndarray
+        """
+        # matrix acting on BGR row vectors
+        M = self.M[::-1, ::-1].T.astype(np.float32)
+        h, w = bufIn.shape[:2]
+        rows = max(1, self.chunkSize // max(w, 1))
+        for r in range(0, h, rows):
+            checkCancelled()
+            buf = rgb2rgbLinearVec(bufIn[r:r + rows, :, :3], dtype=np.float32)
+            bufOut[r:r + rows, :, :3] = rgbLinear2rgb8Vec(buf @ M)
+        return bufOut
 
 
 def sRGB2XYZVec(imgBuf):
@@ -16,9 +16,11 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import cv2
-import gc
 import numpy as np
 
+from bLUeCore.cancellation import checkCancelled
+from bLUeCore.registry import registered
+
 ###############################################
 # Weights for perceptual brightness calculation
 ###############################################
@@ -81,6 +83,7 @@ def rgb2hsB(r, g, b, perceptual=False):
     assert 0<=H<=360 and 0<=S<=1 and 0<=V<=1, "rgb2hsv conversion error r=%d, g=%d, b=%d, h=%f, s=%f, v=%f" %(r,g,b,H,S,V)
     return H, S, V
 
+@registered('rgb2hsBVec')
 def rgb2hsBVec(rgbImg, perceptual=False):
     """
     Vectorized version of rgb2hsB.
@@ -276,86 +279,103 @@ def hsp2rgb_ClippingInd(h,s,p, trunc=True):
             r, g, b = r / M, g / M, b / M
     return int(round(r * 255.0)), int(round(g * 255.0)), int(round(b * 255.0)), (M > 1)
 
-def hsp2rgbVec(hspImg):
+##############################################################
+# hsp2rgbVec : in each of the 6 hue regions, max(r, g, b)**2 is
+#     p**2 / (A + B * (u + t * (1 - u))**2 + C * u**2),
+# where u = 1 - s, t = f (resp. 1 - f) in even (resp. odd)
+# regions, f is the fractional part of h / 60, and
+# A, B, C are the weights of the max, mid and min channels.
+##############################################################
+hspRegionWeights = np.array([[Perc_R, Perc_G, Perc_B],
+                             [Perc_G, Perc_R, Perc_B],
+                             [Perc_G, Perc_B, Perc_R],
+                             [Perc_B, Perc_G, Perc_R],
+                             [Perc_B, Perc_R, Perc_G],
+                             [Perc_R, Perc_B, Perc_G]])
+# per region weights A, B, C, and t = tOffset + tSign * f
+hspA, hspB, hspC = [np.ascontiguousarray(hspRegionWeights[:, i]) for i in range(3)]
+tOffset = np.array([0.0, 1.0, 0.0, 1.0, 0.0, 1.0])
+tSign = np.array([1.0, -1.0, 1.0, -1.0, 1.0, -1.0])
+
+# pixel count of the chunks converted by hsp2rgbVec
+hspChunkSize = 2 ** 16
+
+
+def hsp2rgbChunk(hsp, out):
+    """
+    Converts a chunk of H, S, pB values to RGB (cf. hsp2rgbVec).
+    Only the branch of the hue region of each pixel is computed.
+    @param hsp: H, S, pB values, range H:0..360, S:0..1, pB:0..1
+    @type hsp: ndarray, shape (n, 3), dtype=np.float
+    @param out: RGB values
+    @type out: ndarray, shape (n, 3), dtype=np.uint8
+    """
+    h, s, p = hsp[:, 0] * (1.0 / 60.0), hsp[:, 1], hsp[:, 2]
+    k = h.astype(np.intp)
+    np.clip(k, 0, 5, out=k)
+    # fractional part
+    h -= k
+    t = np.take(tSign, k)
+    t *= h
+    t += np.take(tOffset, k)
+    u = 1.0 - s
+    # t <-- u + t * (1 - u)
+    t *= s
+    t += u
+    # t <-- A + B * t**2 + C * u**2
+    t *= t
+    t *= np.take(hspB, k)
+    u *= u
+    u *= np.take(hspC, k)
+    t += u
+    t += np.take(hspA, k)
+    # t <-- max(r, g, b)
+    np.sqrt(t, out=t)
+    np.divide(p, t, out=t)
+    np.clip(t, 0, 1, out=t)
+    t *= 255.0
+    # a single row image : cvtColor vectorizes along rows
+    hsv = np.empty((1, len(t), 3), dtype=np.uint8)
+    hsv[0, :, 0] = hsp[:, 0] * 0.5
+    hsv[0, :, 1] = s * 255.0
+    hsv[0, :, 2] = t
+    out[...] = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)[0]
+
+
+@registered('hsp2rgbVec')
+def hsp2rgbVec(hspImg, parallel=True):
     """
     Vectorized version of hsp2rgb.
-    We first convert to HSV and next we use cv2.cvtColor()
-    to convert from HSV to RGB
-    @param hspImg: (n,m,3) array of H, S, pB values, range H:0..360, S:0..1, pB:0..1
+    We compute the HSV brightness max(r, g, b) and next we use cv2.cvtColor()
+    to convert from HSV to RGB. The image is converted by chunks of hspChunkSize
+    pixels, so the size of temporary arrays does not depend on the image size.
+    If parallel is True, images larger than bLUeCore.multi.parallelThreshold are
+    cut into bands of rows, converted concurrently by the thread pool of bLUeCore.multi.
+    @param hspImg: (..., 3) array of H, S, pB values, range H:0..360, S:0..1, pB:0..1
     @type hspImg: ndarray dtype=np.float
+    @param parallel:
+    @type parallel: boolean
     @return: identical shape array of RGB values
-    @rtype: ndarray dtype=np.float
+    @rtype: ndarray dtype=np.uint8
     """
-    h, s, p = hspImg[..., 0], hspImg[..., 1], hspImg[..., 2]
-
-    shape = h.shape
-
-    h = np.ravel(h)
-    s = np.ravel(s)
-    p = np.ravel(p)
-    h = h / 60.0
-    i = np.floor(h).astype(int)
-    f = h - i
-
-    old_settings = np.seterr(all='ignore')
-    Mm = 1.0 / (1.0 - s)
-    Mm2 = Mm * Mm
-    f2 = f * f
-    oneMinusf = 1 - f
-    oneMinusMm = 1.0 - Mm
-    oneMinusf2 = oneMinusf * oneMinusf
-    p2 = p * p
-
-    part1 = 1.0 - f * oneMinusMm
-    part1 = np.where(Mm == np.inf, f, part1)  # TODO some invalid values remain for s = 1
-    part2 = 1.0 - oneMinusf * oneMinusMm
-    part2 = np.where(Mm == np.inf, oneMinusf, part2)
-
-    part1 = part1 * part1
-    part2 = part2 * part2
-    # In each of the 6 regions defined by j=i+1, Yj=max(R,G,B)**2
-    X1 = np.where(Mm == np.inf, 0, p2 / (Perc_R * Mm2 + Perc_G * part1 + Perc_B))        # b
-    Y1 = np.where(Mm == np.inf, p2 / (Perc_R + Perc_G * f2), X1 * Mm2)                   # r
-    X1=None
-
-    X2 = np.where(Mm == np.inf, 0, p2 / (Perc_G * Mm2 + Perc_R * part2 + Perc_B))        # b
-    Y2 = np.where(Mm == np.inf, p2 / (Perc_G + Perc_R * oneMinusf2), X2 * Mm2)           # g
-    X2=None
-
-    X3 = np.where(Mm == np.inf, 0, p2 / (Perc_G * Mm2 + Perc_B * part1 + Perc_R))        # r
-    Y3 = np.where(Mm == np.inf, p2 / (Perc_G + Perc_B * f2), X3 * Mm2)                   # g
-    X3=None
-
-    gc.collect()
-
-    X4 = np.where(Mm == np.inf, 0, p2 / (Perc_B * Mm2 + Perc_G * part2 + Perc_R))        # r
-    Y4 = np.where(Mm == np.inf, p2 / (Perc_B + Perc_G * oneMinusf2), X4 * Mm2)           # b
-    X4=None
-
-    X5 = np.where(Mm == np.inf, 0, p2 / (Perc_B * Mm2 + Perc_R * part1 + Perc_G))        # g
-    Y5 = np.where(Mm == np.inf, p2 / (Perc_B + Perc_R * f2), X5 * Mm2)                   # b
-    X5=None
-
-    X6 = np.where(Mm == np.inf, 0, p2 / (Perc_R * Mm2 + Perc_B * part2 + Perc_G))        # g
-    Y6 = np.where(Mm == np.inf, p2 / (Perc_R + Perc_B * oneMinusf2), X6 * Mm2)           # r
-    X6=None
-
-    gc.collect()
-
-    np.seterr(**old_settings)
-    # stack as rows
-    clistMax = np.vstack((Y1, Y2, Y3, Y4, Y5, Y6))
-
-    orderMax= np.arange(6)
-    tmp = np.arange(np.prod(shape))
-
-    rgbMax = clistMax[orderMax[i], tmp]
-    rgbMax = np.sqrt(rgbMax)
-    np.clip(rgbMax, 0, 1, out=rgbMax)
-    hsv = np.dstack((h, s, rgbMax))
-    hsv *=  [30.0, 255.0, 255.0]
-    rgb1=cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
-    return rgb1.reshape(shape + (3,))
+    from bLUeCore import multi
+    shape = hspImg.shape
+    hsp = hspImg.reshape((-1, 3))
+    n = hsp.shape[0]
+    out = np.empty((n, 3), dtype=np.uint8)
+
+    def f(i1, i2):
+        for i in range(i1, i2, hspChunkSize):
+            # no-op in the threads of the pool (cf. bLUeCore.cancellation)
+            checkCancelled()
+            j = min(i + hspChunkSize, i2)
+            hsp2rgbChunk(hsp[i:j], out[i:j])
+
+    if parallel and n >= multi.parallelThreshold:
+        multi.waitAll([multi.getThreadPool().submit(f, i1, i2) for i1, i2 in multi.rowBands(n, multi.tileCount)])
+    else:
+        f(0, n)
+    return out.reshape(shape)
 
 def hsp2rgbVecSmall(hspImg):  # TODO 22/07/18 unused ?
     """
@@ -16,9 +16,11 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import threading
 from tempfile import mktemp
 
-from PySide2.QtCore import Qt, QDir
+from PySide2 import QtCore
+from PySide2.QtCore import Qt, QDir, QObject
 from os.path import isfile
 
 from PySide2.QtWidgets import QMessageBox, QPushButton, QFileDialog, QDialog, QSlider, QVBoxLayout, QHBoxLayout, QLabel
@@ -47,14 +49,40 @@ def dlgInfo(text, info=''):
     msg.setInformativeText(info)
     msg.exec_()
 
+class warningRelay(QObject):
+    """
+    Shows the warning dialogs requested by worker
+    threads : widgets can only be used by the GUI thread.
+    """
+    sig = QtCore.Signal(str, str)
+
+    def __init__(self):
+        super().__init__()
+        # the relay lives in the GUI thread : the connection is queued
+        self.sig.connect(self.warn, Qt.QueuedConnection)
+
+    @QtCore.Slot(str, str)
+    def warn(self, text, info):
+        dlgWarn(text, info=info)
+
+
+# created by the main thread at import
+relay = warningRelay()
+
+
 def dlgWarn(text, info=''):
     """
     Shows a simple warning dialog.
+    When called by a worker thread, the dialog is
+    shown later by the GUI thread.
     @param text:
     @type text: str
     @param info:
     @type info: str
     """
+    if threading.current_thread() is not threading.main_thread():
+        relay.sig.emit(text, info)
+        return
     msg = QMessageBox()
     msg.setWindowTitle('Warning')
     msg.setIcon(QMessageBox.Warning)
@@ -46,6 +46,11 @@ class abstractForm:
     This container is designed for multiple
     inheritance only and should never be instantiated.
     """
+    # set if writeToStream() does not serialize the whole state
+    # of the form : the layer output is then identified by the
+    # count of changes made in the form (cf. QLayer.updateParamKey())
+    streamIsPartial = False
+
     @property
     def layer(self):
         return self.__layer
@@ -113,6 +118,20 @@ class abstractForm:
         """
         pass
 
+    def isSliderDeferred(self, slider):
+        """
+        Returns True if slider is dragged and its intermediate
+        values must be ignored : the layer is updated when the slider
+        is released, unless the stack can be previewed at a low
+        resolution while dragging (cf. QLayer.canPreviewDrag()).
+        @param slider:
+        @type slider: QSlider
+        @return:
+        @rtype: boolean
+        """
+        canPreviewDrag = getattr(self.layer, 'canPreviewDrag', None)
+        return slider.isSliderDown() and (canPreviewDrag is None or not canPreviewDrag())
+
 
 #################################################
 # Base graphic forms.
@@ -711,6 +711,9 @@ class graphicsSplineForm(graphicsCurveForm):
     """
     Form for interactive cubic or quadratic spline.
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     @classmethod
     def getNewWindow(cls, targetImage=None, axeSize=500, layer=None, parent=None, curveType='quadric'):
         newWindow = graphicsSplineForm(targetImage=targetImage, axeSize=axeSize, layer=layer,
@@ -750,8 +753,7 @@ class graphicsSplineForm(graphicsCurveForm):
             """
             self.scene().cubicItem.reset()
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
 
         # buttons
         pushButton1 = QPushButton("Reset to Auto Curve")
@@ -0,0 +1,92 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+Compare the serial, threads and processes backends
+of 3D LUT interpolation across image sizes.
+Run from the bLUe directory (settings are read from config.json) :
+
+    python -m benchmarks.interpBackends [-s SIZES] [-r REPEAT]
+
+SIZES is a comma separated list of image sizes in megapixels.
+"""
+import argparse
+import multiprocessing
+from time import perf_counter
+
+import numpy as np
+
+from bLUeCore.multi import interpMulti, interpMultiShared, interpThreads
+from bLUeCore.trilinear import interpTriLinear
+from settings import POOL_SIZE
+
+
+def timeIt(f, repeat):
+    """
+    Return the best wall time of repeat calls to f.
+    @param f:
+    @type f: function
+    @param repeat:
+    @type repeat: int
+    @return:
+    @rtype: float
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        t = perf_counter()
+        f()
+        best = min(best, perf_counter() - t)
+    return best
+
+
+def run(sizes, repeat=3):
+    """
+    Time each backend on random 8 bits images of the
+    given sizes and print the results.
+    @param sizes: image sizes (megapixels)
+    @type sizes: list of float
+    @param repeat:
+    @type repeat: int
+    """
+    rng = np.random.default_rng(0)
+    # LUT3D default size and step
+    LUT = rng.uniform(0, 255, (33, 33, 33, 3)).astype(np.float32)
+    step = 8
+    pool = multiprocessing.Pool(POOL_SIZE)
+    try:
+        backends = [('serial', lambda img: interpTriLinear(LUT, step, img)),
+                    ('threads', lambda img: interpThreads(LUT, step, img)),
+                    ('processes', lambda img: interpMulti(LUT, step, img, pool=pool)),
+                    ('processes (shm)', lambda img: interpMultiShared(LUT, step, img, pool=pool))]
+        print('pool size %d' % POOL_SIZE)
+        print('%10s' % 'MPixels' + ''.join(['%18s' % name for name, _ in backends]))
+        for size in sizes:
+            w = int(np.sqrt(size * 1e6 * 3 / 2))
+            h = int(size * 1e6) // w
+            img = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+            times = [timeIt(lambda: f(img), repeat) for _, f in backends]
+            print('%10.1f' % size + ''.join(['%18.2f' % t for t in times]))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='3D LUT interpolation backends benchmark')
+    parser.add_argument('-s', '--sizes', default='1,3,6,12,24', help='comma separated image sizes (megapixels)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run([float(s) for s in args.sizes.split(',')], repeat=args.repeat)
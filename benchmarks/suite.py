@@ -0,0 +1,367 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark suite for the bLUeCore kernels and the hot paths of
+vImage.apply*. It runs without display (Qt offscreen platform).
+Synthetic images of the given sizes are generated, and, for each case,
+the wall time, the peak RSS and the peak of allocated bytes (tracemalloc)
+are reported in JSON, so that results can be compared between commits.
+Run from the bLUe directory (settings are read from config.json) :
+
+    python -m benchmarks.suite [-s SIZES] [-r REPEAT] [-k PATTERN] [-o OUTPUT]
+    python -m benchmarks.suite --compare OLD NEW
+
+SIZES is a comma separated list of image sizes in megapixels (default 2,12,24,45).
+Only cases whose name contains PATTERN are run. Without OUTPUT, results
+are written to stdout. The second form prints the ratios of the
+wall times of two result files.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter
+
+# must be set before the first import of PySide2
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+from bLUeCore.multi import interpMulti
+from bLUeCore.preparedLUT import prepareLUT
+from bLUeCore.registry import useNumba
+from bLUeCore.tetrahedral import interpTetra
+from bLUeCore.trilinear import interpTriLinear, interpTriLinearInt
+from bLUeGui.colorCIE import rgb2rgbLinearVec, rgbLinear2rgbVec, rgbLinear2rgb8Vec
+from settings import POOL_SIZE, INTERP_BACKEND, KERNEL_BACKEND, USE_FIXED_POINT
+
+# The vImage cases need PySide2 : without it, only
+# the bLUeCore cases are run.
+try:
+    from PySide2.QtGui import QImage
+    from PySide2.QtWidgets import QApplication
+    from bLUeGui.bLUeImage import QImageBuffer
+    from bLUeCore.kernel import filterIndex
+    from MarkedImg import mImage
+    hasQt = True
+except ImportError as e:
+    print('vImage cases disabled : %s' % str(e), file=sys.stderr)
+    hasQt = False
+
+# the QApplication instance must stay alive while Qt objects are used
+_app = None
+
+
+class formStub(object):
+    """
+    Minimal stand-in for the graphics forms
+    read by the vImage.apply* methods.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def peakRSS():
+    """
+    Return the peak resident set size of the process (bytes).
+    @return:
+    @rtype: int
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB under Linux, bytes under macOS
+    return r if sys.platform == 'darwin' else r * 1024
+
+
+def resetPeakRSS():
+    """
+    Reset the peak RSS of the process, if the platform allows it (Linux >= 4.0).
+    Otherwise, the reported peak RSS is the peak since the start of the process.
+    @return: True if reset
+    @rtype: boolean
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure(f, repeat):
+    """
+    Time repeat calls to f, recording the peak RSS,
+    and measure the peak of allocated bytes during an extra call.
+    A first (untimed) call warms up caches and compiled kernels.
+    @param f:
+    @type f: function
+    @param repeat:
+    @type repeat: int
+    @return:
+    @rtype: dict
+    """
+    f()
+    resetOk = resetPeakRSS()
+    walls = []
+    for _ in range(repeat):
+        t = perf_counter()
+        f()
+        walls.append(perf_counter() - t)
+    rss = peakRSS()
+    # tracemalloc slows down allocations : it is not used while timing
+    tracemalloc.start()
+    try:
+        f()
+        allocated = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall': min(walls), 'median': float(np.median(walls)), 'walls': walls,
+            'peakRSS': rss, 'peakRSSReset': resetOk, 'allocated': allocated}
+
+
+def imageShape(size):
+    """
+    Return the (h, w) shape of a 3:2 image with size megapixels.
+    @param size:
+    @type size: float
+    @return:
+    @rtype: 2-uple of int
+    """
+    w = int(np.sqrt(size * 1e6 * 3 / 2))
+    return int(size * 1e6) // w, w
+
+
+def syntheticImage(h, w, seed=0, out=None):
+    """
+    Build a synthetic 8 bits BGR image : smooth color
+    gradients plus noise, so the count of distinct colors
+    is similar to that of a photograph. The image is built by
+    chunks of rows to limit memory usage.
+    @param h:
+    @type h: int
+    @param w:
+    @type w: int
+    @param seed:
+    @type seed: int
+    @param out: output array, default a new array
+    @type out: ndarray, shape (h, w, 3), dtype np.uint8
+    @return:
+    @rtype: ndarray, shape (h, w, 3), dtype np.uint8
+    """
+    rng = np.random.default_rng(seed)
+    if out is None:
+        out = np.empty((h, w, 3), dtype=np.uint8)
+    x = np.arange(w, dtype=np.float32) / w
+    rows = max(2 ** 20 // w, 1)
+    for r in range(0, h, rows):
+        y = (np.arange(r, min(r + rows, h), dtype=np.float32) / h)[:, np.newaxis]
+        for c, (a, b) in enumerate([(3.1, 1.7), (2.3, 4.1), (1.3, 2.9)]):
+            v = 127.5 * (1.0 + np.sin(a * 2 * np.pi * x + b * 2 * np.pi * y + c))
+            v += rng.normal(0, 4, v.shape).astype(np.float32)
+            np.clip(v, 0, 255, out=v)
+            out[r:r + rows, :, c] = v
+    return out
+
+
+def coreCases(img, pool):
+    """
+    bLUeCore cases.
+    @param img:
+    @type img: ndarray, shape (h, w, 3), dtype np.uint8
+    @param pool:
+    @type pool: multiprocessing.Pool
+    @return: list of (name, function)
+    @rtype: list
+    """
+    rng = np.random.default_rng(0)
+    # LUT3D default size and step
+    step = 8
+    LUT = prepareLUT(rng.uniform(0, 255, (33, 33, 33, 3)).astype(np.float32), step)
+    return [('interpTriLinear', lambda: interpTriLinear(LUT, step, img)),
+            ('interpTriLinearInt', lambda: interpTriLinearInt(LUT, step, img)),
+            ('interpTetra', lambda: interpTetra(LUT, step, img)),
+            ('interpMulti', lambda: interpMulti(LUT, step, img, pool=pool)),
+            ('rgb2rgbLinearVec', lambda: rgb2rgbLinearVec(img, dtype=np.float32)),
+            ('rgbLinear2rgbVec', lambda: rgbLinear2rgbVec(img / 255.0)),
+            ('rgbLinear2rgb8Vec', lambda: rgbLinear2rgb8Vec(img / 255.0))]
+
+
+def applyCases(img):
+    """
+    vImage.apply* cases. All cases use a single
+    adjustment layer, on top of the background of img.
+    @param img:
+    @type img: mImage
+    @return: list of (name, function)
+    @rtype: list
+    """
+    layer = img.addAdjustmentLayer(name='benchmark')
+    # non identity curves : avoid neutral point bypasses
+    curve = np.clip(255.0 * (np.arange(256) / 255.0) ** 0.8, 0, 255).astype(int)
+    stackedLUT = np.vstack((curve,) * 3)
+
+    def withForm(f, **kwargs):
+        # set the graphics form read by the apply method
+        def g():
+            layer.getGraphicsForm = lambda: form
+            f()
+        form = formStub(**kwargs)
+        return g
+
+    contrast = dict(contrastCorrection=0.25, satCorrection=0.1, brightnessCorrection=0.1)
+    noOptions = {'CLAHE': False, 'High': True, 'manualCurve': False}
+    claheOptions = {'CLAHE': True, 'High': True, 'manualCurve': False}
+    mixer = np.array([[0.9, 0.1, 0.0], [0.05, 0.9, 0.05], [0.0, 0.1, 0.9]])
+    noise = ['Wavelets', 'Bilateral', 'NLMeans']
+    filters = [('unsharp', filterIndex.UNSHARP), ('blur', filterIndex.BLUR1),
+               ('surface blur', filterIndex.SURFACEBLUR)]
+    cases = [('apply1DLUT', lambda: layer.apply1DLUT(stackedLUT)),
+             ('applyHSV1DLUT', lambda: layer.applyHSV1DLUT(stackedLUT)),
+             ('applyLab1DLUT', lambda: layer.applyLab1DLUT(stackedLUT)),
+             ('applyHSPB1DLUT', lambda: layer.applyHSPB1DLUT(stackedLUT)),
+             ('applyContrast HSV warp', withForm(lambda: layer.applyContrast(version='HSV'),
+                                                 options=noOptions, **contrast)),
+             ('applyContrast HSV CLAHE', withForm(lambda: layer.applyContrast(version='HSV'),
+                                                  options=claheOptions, **contrast)),
+             ('applyContrast Lab warp', withForm(lambda: layer.applyContrast(version='Lab'),
+                                                 options=noOptions, **contrast)),
+             ('applyContrast Lab CLAHE', withForm(lambda: layer.applyContrast(version='Lab'),
+                                                  options=claheOptions, **contrast)),
+             ('applyExposure', withForm(lambda: layer.applyExposure({}), expCorrection=0.5)),
+             ('applyMixer', withForm(lambda: layer.applyMixer({}), mixerMatrix=mixer)),
+             ('applyTemperature photo filter', withForm(layer.applyTemperature, tempCorrection=4000, tintCorrection=0.1,
+                                                        options={'Photo Filter': True, 'Chromatic Adaptation': False})),
+             ('applyTemperature chromatic adaptation', withForm(layer.applyTemperature, tempCorrection=4000,
+                                                                tintCorrection=0.1,
+                                                                options={'Photo Filter': False,
+                                                                         'Chromatic Adaptation': True}))]
+    for name, category in filters:
+        cases.append(('applyFilter2D %s' % name, withForm(layer.applyFilter2D, kernelCategory=category,
+                                                          radius=10, amount=50.0, tone=100.0)))
+    for name in noise:
+        cases.append(('applyNoiseReduction %s' % name, withForm(layer.applyNoiseReduction, noiseCorrection=3,
+                                                                options={n: n == name for n in noise})))
+    cases.append(('histogram', lambda: img.layersStack[0].histogram()))
+    return cases
+
+
+def gitRevision():
+    """
+    Return the current git commit, or None.
+    @return:
+    @rtype: str
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat=3, pattern=''):
+    """
+    Run the cases whose name contains pattern on
+    synthetic images of the given sizes.
+    @param sizes: image sizes (megapixels)
+    @type sizes: list of float
+    @param repeat:
+    @type repeat: int
+    @param pattern:
+    @type pattern: str
+    @return: results
+    @rtype: dict
+    """
+    results = []
+    meta = {'commit': gitRevision(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'repeat': repeat,
+            'POOL_SIZE': POOL_SIZE, 'INTERP_BACKEND': INTERP_BACKEND, 'KERNEL_BACKEND': KERNEL_BACKEND,
+            'numba': useNumba(), 'USE_FIXED_POINT': USE_FIXED_POINT, 'qt': hasQt}
+    global _app
+    if hasQt and _app is None:
+        _app = QApplication.instance() or QApplication(sys.argv)
+    pool = multiprocessing.Pool(POOL_SIZE)
+    try:
+        for size in sizes:
+            h, w = imageShape(size)
+            img = syntheticImage(h, w)
+            cases = coreCases(img, pool)
+            if hasQt:
+                qImg = QImage(w, h, QImage.Format_ARGB32)
+                buf = QImageBuffer(qImg)
+                buf[:, :, :3] = img
+                buf[:, :, 3] = 255
+                cases += applyCases(mImage(QImg=qImg))
+            for name, f in cases:
+                if pattern not in name:
+                    continue
+                r = measure(f, repeat)
+                r.update(name=name, size=size, shape=[h, w])
+                results.append(r)
+                print('%-40s %6.1f MP %8.3f s' % (name, size, r['wall']), file=sys.stderr)
+            del cases, img
+    finally:
+        pool.close()
+        pool.join()
+    return {'meta': meta, 'results': results}
+
+
+def compare(old, new):
+    """
+    Print the ratios new/old of wall times for the
+    cases present in both result files.
+    @param old: path to results
+    @type old: str
+    @param new: path to results
+    @type new: str
+    """
+    with open(old) as f:
+        r0 = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    with open(new) as f:
+        r1 = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    print('%-40s %8s %10s %10s %8s' % ('case', 'MP', 'old (s)', 'new (s)', 'ratio'))
+    for key in sorted(set(r0) & set(r1)):
+        t0, t1 = r0[key]['wall'], r1[key]['wall']
+        print('%-40s %8.1f %10.3f %10.3f %8.2f' % (key[0], key[1], t0, t1, t1 / t0 if t0 > 0 else float('inf')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bLUe benchmark suite')
+    parser.add_argument('-s', '--sizes', default='2,12,24,45', help='comma separated image sizes (megapixels)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-k', '--pattern', default='', help='run only the cases whose name contains PATTERN')
+    parser.add_argument('-o', '--output', default=None, help='JSON output file (default stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        res = run([float(s) for s in args.sizes.split(',')], repeat=args.repeat, pattern=args.pattern)
+        if args.output is None:
+            json.dump(res, sys.stdout, indent=1)
+        else:
+            with open(args.output, 'w') as f:
+                json.dump(res, f, indent=1)
@@ -0,0 +1,138 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+###############################################
+# Cache of color space conversions (HSV, HSpB, Lab)
+# of image buffers, shared by all images and layers.
+# Buffers are indexed by the revision of the source
+# image (QImage.cacheKey(), modified by each write
+# access to the image), the color space and the
+# resolution of the source, so they never need
+# to be invalidated. Cached arrays are read-only and
+# returned without copy : callers modifying them
+# must ask for a private copy. The total size of the
+# cached arrays is bounded by CONVERSION_CACHE_SIZE
+# (config.json) : least recently used entries are
+# evicted first.
+###############################################
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from bLUeGui.colorCIE import sRGB2LabVec
+from bLUeGui.colorCube import rgb2hspVec
+from settings import CONVERSION_CACHE_SIZE
+
+# conversions of BGR(A) buffers
+colorSpaces = {'HSpB': lambda buf: rgb2hspVec(buf[:, :, :3][:, :, ::-1]),
+               'Lab': lambda buf: sRGB2LabVec(buf[:, :, :3][:, :, ::-1]),
+               'HSV': lambda buf: cv2.cvtColor(buf[:, :, :3], cv2.COLOR_BGR2HSV)
+               }
+
+
+class conversionCache(object):
+    """
+    LRU cache of color space buffers, bounded by
+    the total size (in bytes) of the arrays.
+    The cache can be accessed concurrently by
+    the GUI thread and the stack evaluation worker.
+    """
+    def __init__(self, budget):
+        """
+        @param budget: max size (bytes)
+        @type budget: int
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getBuffer(self, revision, space, buf, copy=False, cached=True):
+        """
+        Return the conversion of buf to a color space. Unless copy is True,
+        the returned array is shared and read-only.
+        @param revision: revision of the source image (QImage.cacheKey())
+        @type revision: int
+        @param space: 'HSpB', 'Lab' or 'HSV'
+        @type space: str
+        @param buf: source buffer, BGR(A) order
+        @type buf: ndarray, dtype=uint8
+        @param copy: return a private (writable) array
+        @type copy: boolean
+        @param cached: look up and store the result in the cache
+        @type cached: boolean
+        @return:
+        @rtype: ndarray
+        """
+        if not cached:
+            return colorSpaces[space](buf)
+        key = (revision, space, buf.shape[:2])
+        with self.lock:
+            out = self.entries.get(key, None)
+            if out is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if out is None:
+            out = colorSpaces[space](buf)
+            out.flags.writeable = False
+            self.put(key, out)
+        return out.copy() if copy else out
+
+    def put(self, key, buf):
+        """
+        Cache buf for key, evicting the least
+        recently used entries if needed.
+        Arrays larger than the budget are not cached.
+        @param key:
+        @type key: tuple
+        @param buf:
+        @type buf: ndarray
+        """
+        if buf.nbytes > self.budget:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            while self.entries and self.size + buf.nbytes > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+            self.entries[key] = buf
+            self.size += buf.nbytes
+
+    def stats(self):
+        """
+        Return the counts of hits and misses,
+        the count of cached arrays and their size (bytes).
+        @return:
+        @rtype: dict
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+colorCache = conversionCache(CONVERSION_CACHE_SIZE * 2**20)
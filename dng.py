@@ -20,6 +20,7 @@ from os.path import basename
 
 import exiftool
 import numpy as np
+from bLUeCore.preparedLUT import versionedLUT, getPreparedLUT
 from bLUeGui.spline import cubicSpline
 from settings import DNG_PROFILES_DIR2, DNG_PROFILES_DIR1
 
@@ -112,7 +113,7 @@ class dngProfileToneCurve:
         return cubicSpline(self.dataX * maxrange, self.dataY * maxrange, np.arange(maxrange + 1))
 
 
-class dngProfileLookTable:
+class dngProfileLookTable(versionedLUT):
     """
     (hue, saturation, value) 3D LUT class.
     Property data holds the table array.
@@ -120,6 +121,7 @@ class dngProfileLookTable:
     Due to modulo arithmetic for hue and to the presence of sentinels,
     divs and data.shape are different.
     Input values for axis=i must be mapped to the (closed) interval  [0, divs[i]]
+    In place modifications of data must be followed by a call to bumpVersion().
     """
     def __init__(self, dngDict):
         """
@@ -129,6 +131,7 @@ class dngProfileLookTable:
         @param dngDict:
         @type dngDict: dict
         """
+        self.initVersion()
         self.isValid = False
         divs, encoding, data = dngDict.get('ProfileLookTableDims', None), dngDict.get('ProfileLookTableEncoding', None), dngDict.get('ProfileLookTableData', None)
         if divs is None or data is None:  # encoding not used yet : it seems to be missing in dng files
@@ -184,6 +187,17 @@ class dngProfileLookTable:
         """
         return self.__data
 
+    def getPrepared(self, steps):
+        """
+        Return the prepared state of the current table revision,
+        for use by interpolation functions.
+        @param steps: interpolation steps
+        @type steps: 3-uple of numbers
+        @return:
+        @rtype: PreparedLUT
+        """
+        return getPreparedLUT(self.versionKey, self.data, steps)
+
 
 class dngProfileIlluminants:
     """
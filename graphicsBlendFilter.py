@@ -27,6 +27,9 @@ class blendFilterIndex:
 
 
 class blendFilterForm (baseForm):
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     @classmethod
     def getNewWindow(cls, targetImage=None, axeSize=500, layer=None, parent=None):
         wdgt = blendFilterForm(targetImage=targetImage, axeSize=axeSize, layer=layer, parent=parent)
@@ -64,7 +67,7 @@ class blendFilterForm (baseForm):
 
         # filter range done event handler
         def frUpdate(start, end):
-            if self.sliderFilterRange.isSliderDown() or (start == self.filterStart and end == self.filterEnd):
+            if self.isSliderDeferred(self.sliderFilterRange) or (start == self.filterStart and end == self.filterEnd):
                 return
             try:
                 self.sliderFilterRange.startValueChanged.disconnect()
@@ -117,8 +120,7 @@ class blendFilterForm (baseForm):
             if self.listWidget1.options[key]:
                 self.kernelCategory = self.filterDict[key]
                 break
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def writeToStream(self, outStream):
         layer = self.layer
@@ -29,6 +29,9 @@ class CoBrSatForm(baseForm):
     """
     Contrast, Brightness, Saturation adjustment form
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     layerTitle = "Cont/Bright/Sat"
     contrastDefault = 0.0
     brightnessDefault = 0.0
@@ -120,7 +123,7 @@ class CoBrSatForm(baseForm):
         def contrastUpdate(value):
             self.contrastValue.setText(str("{:d}".format(self.sliderContrast.value())))
             # move not yet terminated or value not modified
-            if self.sliderContrast.isSliderDown() or self.slider2Contrast(value) == self.contrastCorrection:
+            if self.isSliderDeferred(self.sliderContrast) or self.slider2Contrast(value) == self.contrastCorrection:
                 return
             self.sliderContrast.valueChanged.disconnect()
             self.sliderContrast.sliderReleased.disconnect()
@@ -158,7 +161,7 @@ class CoBrSatForm(baseForm):
         def saturationUpdate(value):
             self.saturationValue.setText(str("{:+d}".format(int(self.slidersaturation2User(self.sliderSaturation.value())))))
             # move not yet terminated or value not modified
-            if self.sliderSaturation.isSliderDown() or self.slider2Saturation(value) == self.satCorrection:
+            if self.isSliderDeferred(self.sliderSaturation) or self.slider2Saturation(value) == self.satCorrection:
                 return
             self.sliderSaturation.valueChanged.disconnect()
             self.sliderSaturation.sliderReleased.disconnect()
@@ -193,7 +196,7 @@ class CoBrSatForm(baseForm):
         def brightnessUpdate(value):
             self.brightnessValue.setText(str("{:+d}".format(int(self.sliderBrightness2User(self.sliderBrightness.value())))))
             # move not yet terminated or value not modified
-            if self.sliderBrightness.isSliderDown() or self.slider2Brightness(value) == self.brightnessCorrection:
+            if self.isSliderDeferred(self.sliderBrightness) or self.slider2Brightness(value) == self.brightnessCorrection:
                 return
             self.sliderBrightness.valueChanged.disconnect()
             self.sliderBrightness.sliderReleased.disconnect()
@@ -289,8 +292,7 @@ class CoBrSatForm(baseForm):
 
             # curve changed slot
             def f():
-                self.layer.applyToStack()
-                self.layer.parentImage.onImageChanged()
+                self.layer.applyToStackAsync()
             form.scene().quadricB.curveChanged.sig.connect(f)
         else:
             form = self.contrastForm
@@ -335,8 +337,7 @@ class CoBrSatForm(baseForm):
         data changed slot.
         """
         self.enableSliders()
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
         # enable/disable options relative to multi-mode
         for intname in ['High', 'manualCurve']:
             item = self.listWidget2.items[intname]
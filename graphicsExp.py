@@ -25,6 +25,9 @@ from utils import QbLUeSlider, QbLUeLabel
 
 
 class ExpForm (baseForm):
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     defaultExpCorrection = 0.0
     defaultStep = 0.1
 
@@ -60,7 +63,7 @@ class ExpForm (baseForm):
         # exp change/released slot
         def f():
             self.expValue.setText(str("{:+.1f}".format(self.sliderExp.value() * self.defaultStep)))
-            if self.sliderExp.isSliderDown() or (self.expCorrection == self.sliderExp.value() * self.defaultStep):
+            if self.isSliderDeferred(self.sliderExp) or (self.expCorrection == self.sliderExp.value() * self.defaultStep):
                 return
             try:
                 self.sliderExp.valueChanged.disconnect()
@@ -96,8 +99,7 @@ class ExpForm (baseForm):
         self.setDefaults()
 
     def updateLayer(self):
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def setDefaults(self):
         try:
@@ -27,6 +27,9 @@ from utils import optionsWidget, QbLUeSlider
 
 class filterForm (baseForm):
 
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     defaultRadius = 10
     defaultTone = 100.0
     defaultAmount = 50.0
@@ -100,7 +103,7 @@ class filterForm (baseForm):
             self.radiusValue.setText(str('%d ' % self.sliderRadius.value()))
             self.amountValue.setText(str('%d ' % self.sliderAmount.value()))
             self.toneValue.setText(str('%d ' % self.sliderTone.value()))
-            if self.sliderRadius.isSliderDown() or self.sliderAmount.isSliderDown() or self.sliderTone.isSliderDown():
+            if self.isSliderDeferred(self.sliderRadius) or self.isSliderDeferred(self.sliderAmount) or self.isSliderDeferred(self.sliderTone):
                 return
             try:
                 for slider in [self.sliderRadius, self.sliderAmount, self.sliderTone]:
@@ -176,8 +179,7 @@ class filterForm (baseForm):
             if self.listWidget1.options[key]:
                 self.kernelCategory = self.filterDict[key]
                 break
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def enableSliders(self):
         opt = self.listWidget1.options
@@ -30,6 +30,9 @@ class HVLUT2DForm(graphicsCurveForm):
     """
     Form for interactive HV 2D LUT
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     @classmethod
     def getNewWindow(cls, targetImage=None, axeSize=500, layer=None, parent=None):
         newWindow = HVLUT2DForm(targetImage=targetImage, axeSize=axeSize, layer=layer, parent=parent)
@@ -82,7 +85,7 @@ class HVLUT2DForm(graphicsCurveForm):
         def satUpdate(value):
             self.satValue.setText(str("{:d}".format(value)))
             # move not yet terminated or values not modified
-            if self.sliderSat.isSliderDown() or value == self.satThr:
+            if self.isSliderDeferred(self.sliderSat) or value == self.satThr:
                 return
             try:
                 self.sliderSat.valueChanged.disconnect()
@@ -172,12 +175,13 @@ class HVLUT2DForm(graphicsCurveForm):
         for i in range(hdivs):
             pt = sp[int(i * hstep * axeSize / 360)]
             data[i, sThr:, :, 0] = - (pt.y() - d) / 5
+        # LUT was modified in place
+        self.LUT.bumpVersion()
 
     def updateLayer(self):
         self.updateLUT()
         l = self.scene().layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def colorPickedSlot(self, x, y, modifiers):
         """
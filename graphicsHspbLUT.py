@@ -110,8 +110,7 @@ class graphicsHspbForm(graphicsCurveForm):
 
         def f():
             layer = graphicsScene.layer
-            layer.applyToStack()
-            layer.parentImage.onImageChanged()
+            layer.applyToStackAsync()
         self.scene().cubicR.curveChanged.sig.connect(f)
         self.scene().cubicG.curveChanged.sig.connect(f)
         self.scene().cubicB.curveChanged.sig.connect(f)
@@ -172,8 +171,7 @@ class graphicsHspbForm(graphicsCurveForm):
         graphicsScene.cubicItem.reset()
         self.updateHist(graphicsScene.cubicItem)
         layer = graphicsScene.layer
-        layer.applyToStack()
-        layer.parentImage.onImageChanged()
+        layer.applyToStackAsync()
 
     def resetAllCurves(self):
         """
@@ -185,8 +183,7 @@ class graphicsHspbForm(graphicsCurveForm):
             cubicItem.reset()
         self.updateHists()
         layer = graphicsScene.layer
-        layer.applyToStack()
-        layer.parentImage.onImageChanged()
+        layer.applyToStackAsync()
 
     def writeToStream(self, outStream):
         graphicsScene = self.scene()
@@ -97,5 +97,4 @@ class invertForm(baseForm):
         """
         overriding dataChanged slot
         """
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
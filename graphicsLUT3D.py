@@ -146,8 +146,7 @@ class nodeGroup(QGraphicsItemGroup):
                 i.isControlPoint = True  # 28/10
             self.grid.drawGrid()
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         self.mouseIsPressed = False
         self.mouseIsMoved = False
 
@@ -172,8 +171,7 @@ class nodeGroup(QGraphicsItemGroup):
             for i in self.childItems():
                 i.syncLUT()
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         actionScaleUp.triggered.connect(f2)
         # scale down
         actionScaleDown = QAction('scale down', None)
@@ -186,8 +184,7 @@ class nodeGroup(QGraphicsItemGroup):
                 i.syncLUT(i.pos())
             # self.scene().onUpdateLUT(options=self.scene().options)
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         actionScaleDown.triggered.connect(f3)
         # rotate cw
         actionRotateCW = QAction('rotate CW', None)
@@ -200,8 +197,7 @@ class nodeGroup(QGraphicsItemGroup):
                 i.syncLUT()
             # self.scene().onUpdateLUT(options=self.scene().options)
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         actionRotateCW.triggered.connect(f4)
         # rotate ccw
         actionRotateCCW = QAction('rotate CCW', None)
@@ -214,8 +210,7 @@ class nodeGroup(QGraphicsItemGroup):
                 i.syncLUT()
             # self.scene().onUpdateLUT(options=self.scene().options)
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         actionRotateCCW.triggered.connect(f5)
 
         menu.exec_(event.screenPos())
@@ -268,8 +263,7 @@ class activeNode(QGraphicsPathItem):
         grid.drawGrid()
         grid.drawTrace = False
         l = grid.scene().layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def __init__(self, position, cModel, gridRow=0, gridCol=0, parent=None, grid=None):
         """
@@ -385,6 +379,8 @@ class activeNode(QGraphicsPathItem):
                 nbghd1[..., 3] = 0
             else:
                 nbghd1[..., 3] = 255
+        # LUT was modified in place
+        self.scene().lut.bumpVersion()
 
     def gridPos(self):
         """
@@ -470,8 +466,7 @@ class activeNode(QGraphicsPathItem):
         self.syncLUT()
         if self.mouseIsMoved:
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         self.mouseIsPressed = False
         self.mouseIsMoved = False
         self.grid.drawTrace = False
@@ -827,6 +822,9 @@ class graphicsForm3DLUT(baseGraphicsForm):
     """
     Form for 3D LUT editing.
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     # node markers
     qpp0 = activeNode.qppR
     qpp1 = activeNode.qppE
@@ -1187,8 +1185,7 @@ class graphicsForm3DLUT(baseGraphicsForm):
         """
         self.grid.smooth()
         self.grid.drawGrid()
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def onReset(self):
         """
@@ -1205,8 +1202,7 @@ class graphicsForm3DLUT(baseGraphicsForm):
         self.grid.reset()
         self.selected = None
         self.grid.drawGrid()
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def enableButtons(self):
         self.pushButton4.setEnabled(not self.graphicsScene.options['keep alpha'])
@@ -1242,11 +1238,11 @@ class graphicsForm3DLUT(baseGraphicsForm):
         imgBuf = QImageBuffer(currentImg)
         # resize the alpha channel
         imgmask = cv2.resize(imgBuf[:, :, 3], (layer.width(), layer.height()))
-        layer.historyListMask.addItem(layer.mask.copy())
+        layer.historyListMask.addItem(layer.mask)
         mask = QImageBuffer(layer.mask)
         mask[:, :, 2] = imgmask
-        layer.applyToStack()
-        layer.parentImage.onImageChanged()
+        layer.historyListMask.commit(layer.mask)
+        layer.applyToStackAsync()
 
     def writeToStream(self, outStream):
         layer = self.layer
@@ -133,8 +133,7 @@ class graphicsLabForm(graphicsCurveForm):
 
         def f():
             l = graphicsScene.layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         self.scene().cubicR.curveChanged.sig.connect(f)
         self.scene().cubicG.curveChanged.sig.connect(f)
         self.scene().cubicB.curveChanged.sig.connect(f)
@@ -207,8 +206,7 @@ class graphicsLabForm(graphicsCurveForm):
         fp.sort(key=lambda z: z.scenePos().x())
         cubicL.updatePath()
         cubicL.updateLUTXY()
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def setWhitePoint(self, r, g, b, luminance=True, balance=True):
         """
@@ -282,8 +280,7 @@ class graphicsLabForm(graphicsCurveForm):
                 p.setPos(min(cubic.size, cubic.size + wPoint) - corr, -cubic.size)
                 cubic.updatePath()
                 cubic.updateLUTXY()
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def drawBackground(self, qp, qrF):
         """
@@ -346,8 +343,7 @@ class graphicsLabForm(graphicsCurveForm):
         graphicsScene.cubicItem.reset()
         self.updateHist(graphicsScene.cubicItem)
         l = graphicsScene.layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def resetAllCurves(self):
         """
@@ -359,8 +355,7 @@ class graphicsLabForm(graphicsCurveForm):
             cubicItem.reset()
         self.updateHists()
         l = graphicsScene.layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def writeToStream(self, outStream):
         graphicsScene = self.scene()
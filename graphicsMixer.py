@@ -100,8 +100,7 @@ class mixerForm(baseGraphicsForm):
         baryCoordG = self.invM @ [self.gPoint.x(), self.gPoint.y(), 1]
         baryCoordB = self.invM @ [self.bPoint.x(), self.bPoint.y(), 1]
         self.mixerMatrix = np.vstack((baryCoordR, baryCoordG, baryCoordB))
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def setDefaults(self):
         try:
@@ -25,6 +25,9 @@ from utils import optionsWidget, QbLUeSlider
 
 class noiseForm (baseForm):
 
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     noiseCorrection = 0
 
     @staticmethod
@@ -113,8 +116,7 @@ class noiseForm (baseForm):
         """
         data changed slot
         """
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def thrUpdate(self, value):
         """
@@ -126,7 +128,7 @@ class noiseForm (baseForm):
         """
         self.thrValue.setText(str("{:.0f}".format(self.slider2Thr(self.sliderThr.value()))))
         # move not yet terminated or value unchanged
-        if self.sliderThr.isSliderDown() or self.slider2Thr(value) == self.noiseCorrection:
+        if self.isSliderDeferred(self.sliderThr) or self.slider2Thr(value) == self.noiseCorrection:
             return
         try:
             self.sliderThr.valueChanged.disconnect()
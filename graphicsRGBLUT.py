@@ -28,6 +28,9 @@ class graphicsForm(graphicsCurveForm):
     """
     Form for interactive RGB curves
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     @classmethod
     def getNewWindow(cls, targetImage=None, axeSize=500, layer=None, parent=None):
         newWindow = graphicsForm(targetImage=targetImage, axeSize=axeSize, layer=layer, parent=parent)
@@ -94,8 +97,7 @@ class graphicsForm(graphicsCurveForm):
             pushButton2.setEnabled(item.text() != 'RGB')
             self.scene().cubicItem.setVisible(True)
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
             # Force redraw histogram
             self.scene().invalidate(QRectF(0.0, -self.scene().axeSize, self.scene().axeSize, self.scene().axeSize),
                                     QGraphicsScene.BackgroundLayer)
@@ -116,8 +118,7 @@ class graphicsForm(graphicsCurveForm):
 
         def f():
             l = self.scene().layer
-            l.applyToStack()
-            l.parentImage.onImageChanged()
+            l.applyToStackAsync()
         self.scene().cubicRGB.curveChanged.sig.connect(f)
         self.scene().cubicR.curveChanged.sig.connect(f)
         self.scene().cubicG.curveChanged.sig.connect(f)
@@ -177,8 +178,7 @@ class graphicsForm(graphicsCurveForm):
             cubic.updatePath()
             cubic.updateLUTXY()
         l = self.scene().layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def setWhitePoint(self, r, g, b):
         """
@@ -217,8 +217,7 @@ class graphicsForm(graphicsCurveForm):
             cubic.updatePath()
             cubic.updateLUTXY()
         l = self.scene().layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def drawBackground(self, qp, qrF):
         """
@@ -277,8 +276,7 @@ class graphicsForm(graphicsCurveForm):
         self.updateHist(graphicsScene.cubicItem)
         # self.scene().onUpdateLUT()
         l = graphicsScene.layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def resetAllCurves(self):
         """
@@ -290,8 +288,7 @@ class graphicsForm(graphicsCurveForm):
             cubicItem.reset()
         self.updateHists()
         l = graphicsScene.layer
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def writeToStream(self, outStream):
         """
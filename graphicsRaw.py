@@ -74,6 +74,9 @@ class rawForm (baseForm):
     """
     Postprocessing of raw files.
     """
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     dataChanged = QtCore.Signal(int)
 
     @classmethod
@@ -329,7 +332,7 @@ class rawForm (baseForm):
         def expUpdate(value):
             self.expValue.setText(str("{:+.1f}".format(self.sliderExp2User(self.sliderExp.value()))))
             # move not yet terminated or value not modified
-            if self.sliderExp.isSliderDown() or self.slider2Exp(value) == self.expCorrection:
+            if self.isSliderDeferred(self.sliderExp) or self.slider2Exp(value) == self.expCorrection:
                 return
             try:
                 self.sliderExp.valueChanged.disconnect()
@@ -369,7 +372,7 @@ class rawForm (baseForm):
         def brUpdate(value):
             self.brValue.setText(str("{:+d}".format(int(self.brSlider2User(self.sliderBrightness.value())))))
             # move not yet terminated or value not modified
-            if self.sliderBrightness.isSliderDown() or self.slider2Br(value) == self.brCorrection:
+            if self.isSliderDeferred(self.sliderBrightness) or self.slider2Br(value) == self.brCorrection:
                 return
             try:
                 self.sliderBrightness.valueChanged.disconnect()
@@ -406,7 +409,7 @@ class rawForm (baseForm):
         def contUpdate(value):
             self.contValue.setText(str("{:.0f}".format(self.slider2Cont(self.sliderCont.value()))))
             # move not yet terminated or value not modified
-            if self.sliderCont.isSliderDown() or self.slider2Cont(value) == self.tempCorrection:
+            if self.isSliderDeferred(self.sliderCont) or self.slider2Cont(value) == self.tempCorrection:
                 return
             try:
                 self.sliderCont.valueChanged.disconnect()
@@ -446,7 +449,7 @@ class rawForm (baseForm):
         def satUpdate(value):
             self.satValue.setText(str("{:+d}".format(self.slider2Sat(self.sliderSat.value()))))
             # move not yet terminated or value not modified
-            if self.sliderSat.isSliderDown() or self.slider2Sat(value) == self.satCorrection:
+            if self.isSliderDeferred(self.sliderSat) or self.slider2Sat(value) == self.satCorrection:
                 return
             try:
                 self.sliderSat.valueChanged.disconnect()
@@ -587,8 +590,7 @@ class rawForm (baseForm):
             def f():
                 layer = self.layer
                 layer.bufCache_HSV_CV32 = None
-                layer.applyToStack()
-                layer.parentImage.onImageChanged()
+                layer.applyToStackAsync()
             form.scene().quadricB.curveChanged.sig.connect(f)
             self.toneForm = form
             dockT = stateAwareQDockWidget(self.parent())
@@ -641,8 +643,7 @@ class rawForm (baseForm):
 
             def f():
                 layer = self.layer
-                layer.applyToStack()
-                layer.parentImage.onImageChanged()
+                layer.applyToStackAsync()
             form.scene().quadricB.curveChanged.sig.connect(f)
             self.contrastForm = form
             dockC = stateAwareQDockWidget(self.parent())
@@ -664,7 +665,7 @@ class rawForm (baseForm):
     def tempUpdate(self, value):
         self.tempValue.setText(str("{:.0f}".format(self.slider2Temp(self.sliderTemp.value()))))
         # move not yet terminated or value not modified
-        if self.sliderTemp.isSliderDown() or self.slider2Temp(value) == self.tempCorrection:
+        if self.isSliderDeferred(self.sliderTemp) or self.slider2Temp(value) == self.tempCorrection:
             return
         try:
             self.sliderTemp.valueChanged.disconnect()
@@ -686,7 +687,7 @@ class rawForm (baseForm):
     def tintUpdate(self, value):
         self.tintValue.setText(str("{:.0f}".format(self.sliderTint2User(self.sliderTint.value()))))
         # move not yet terminated or value not modified
-        if self.sliderTint.isSliderDown() or self.slider2Tint(value) == self.tintCorrection:
+        if self.isSliderDeferred(self.sliderTint) or self.slider2Tint(value) == self.tintCorrection:
             return
         try:
             self.sliderTint.valueChanged.disconnect()
@@ -760,8 +761,7 @@ class rawForm (baseForm):
             else:
                 ct.hide()
         self.enableSliders()
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     def enableSliders(self):
         useUserWB = self.listWidget2.options["User WB"]
@@ -27,6 +27,9 @@ from utils import optionsWidget, QbLUeSlider, QbLUeLabel
 
 class temperatureForm (baseForm):
 
+    # writeToStream() does not serialize the whole state of the form
+    streamIsPartial = True
+
     @classmethod
     def getNewWindow(cls, targetImage=None, axeSize=500, layer=None, parent=None):
         wdgt = temperatureForm(axeSize=axeSize, layer=layer, parent=parent)
@@ -91,7 +94,7 @@ class temperatureForm (baseForm):
         def tempUpdate(value):
             self.tempValue.setText(str("{:d}".format(self.sliderTemp2User(value))))
             # move not yet terminated or values not modified
-            if self.sliderTemp.isSliderDown() or self.slider2Temp(value) == self.tempCorrection:
+            if self.isSliderDeferred(self.sliderTemp) or self.slider2Temp(value) == self.tempCorrection:
                 return
             try:
                 self.sliderTemp.valueChanged.disconnect()
@@ -107,7 +110,7 @@ class temperatureForm (baseForm):
         def tintUpdate(value):
             self.tintValue.setText(str("{:d}".format(self.sliderTint2User(value))))
             # move not yet terminated or values not modified
-            if self.sliderTint.isSliderDown() or self.slider2Tint(value) == self.tintCorrection:
+            if self.isSliderDeferred(self.sliderTint) or self.slider2Tint(value) == self.tintCorrection:
                 return
             try:
                 self.sliderTint.valueChanged.disconnect()
@@ -173,8 +176,7 @@ class temperatureForm (baseForm):
         data changed slot
         """
         self.enableSliders()
-        self.layer.applyToStack()
-        self.layer.parentImage.onImageChanged()
+        self.layer.applyToStackAsync()
 
     @staticmethod
     def slider2Temp(v):
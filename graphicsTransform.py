@@ -83,8 +83,7 @@ class transForm (baseForm):
         """
         l = self.layer
         l.tool.setBaseTransform()
-        l.applyToStack()
-        l.parentImage.onImageChanged()
+        l.applyToStackAsync()
 
     def reset(self):
         self.layer.tool.resetTrans()
@@ -31,6 +31,8 @@ from QtGui1 import window
 from bLUeGui.bLUeImage import QImageBuffer
 from bLUeGui.dialog import openDlg, dlgWarn
 from bLUeGui.memory import weakProxy
+from conversionCache import colorCache
+from memoryManager import formatBytes, layerMemory
 from settings import TABBING
 from utils import  QbLUeSlider
 import resources_rc  # hidden import mandatory : DO NOT REMOVE !!!
@@ -155,7 +157,8 @@ class QLayerView(QTableView) :
         def m(state):  # state : Qt.Checked Qt.UnChecked
             if self.img is None:
                 return
-            self.img.useThumb = (state == Qt.Checked)
+            # the images of the previous level are kept (cf. mImage.setPreviewLevel())
+            self.img.setPreviewLevel(vImage.thumbSize if state == Qt.Checked else None, base=True)
             window.updateStatus()
             self.img.cacheInvalidate()
             for layer in self.img.layersStack:
@@ -182,6 +185,10 @@ class QLayerView(QTableView) :
         titleLabel = QLabel('Layer')
         titleLabel.setMaximumSize(100, 30)
 
+        # memory readout (cf. updateMemory())
+        self.memoryLabel = QLabel()
+        self.memoryLabel.setToolTip('Memory held by the image layers / memory budget')
+
         # opacity slider
         self.opacitySlider = QbLUeSlider(Qt.Horizontal)
         self.opacitySlider.setStyleSheet(QbLUeSlider.bLueSliderDefaultBWStylesheet)
@@ -298,6 +305,7 @@ class QLayerView(QTableView) :
         hl0 = QHBoxLayout()
         hl0.addWidget(titleLabel)
         hl0.addStretch(1)
+        hl0.addWidget(self.memoryLabel)
         hl0.addWidget(self.previewOptionBox)
         l.addLayout(hl0)
         hl =  QHBoxLayout()
@@ -387,7 +395,7 @@ Note that upper visible layers slow down mask edition.<br>
         self.img = None
         self.currentWin = None
         model = layerModel()
-        model.setColumnCount(3)
+        model.setColumnCount(4)
         self.setModel(None)
 
     def setLayers(self, mImg, delete=False):
@@ -403,7 +411,7 @@ Note that upper visible layers slow down mask edition.<br>
         # back link to image
         self.img = weakProxy(mImg)
         model = layerModel()
-        model.setColumnCount(3)
+        model.setColumnCount(4)
         l = len(mImg.layersStack)
 
         # dataChanged event handler : enables edition of layer name
@@ -457,6 +465,10 @@ Note that upper visible layers slow down mask edition.<br>
             items.append(item_name)
             item_mask = QStandardItem('m')
             items.append(item_mask)
+            # col 3 : memory held by the layer (cf. updateMemory())
+            item_memory = QStandardItem(formatBytes(lay.memoryUsage))
+            item_memory.setToolTip('Memory held by the layer')
+            items.append(item_memory)
             model.appendRow(items)
         self.setModel(model)
         self.horizontalHeader().hide()
@@ -465,6 +477,7 @@ Note that upper visible layers slow down mask edition.<br>
         header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(3, QHeaderView.ResizeToContents)
         # select active layer
         self.selectRow(len(mImg.layersStack) - 1 - mImg.activeLayerIndex)
         layerview = mImg.getActiveLayer().view  # TODO added 25/11/18
@@ -492,6 +505,27 @@ Note that upper visible layers slow down mask edition.<br>
             self.currentWin.activateWindow()
 
 
+    def updateMemory(self, total):
+        """
+        Update the memory readout of layers (cf. mImage.enforceMemoryBudget()).
+        @param total: size (bytes) of the memory held by the image
+        @type total: int
+        """
+        model = self.model()
+        if model is None or self.img is None:
+            return
+        stack = self.img.layersStack
+        # the model may be updated by a drop event
+        if model.rowCount() != len(stack) or model.columnCount() < 4:
+            return
+        for r, layer in enumerate(reversed(stack)):
+            model.item(r, 3).setText(formatBytes(layer.memoryUsage))
+        self.memoryLabel.setText('%s / %s' % (formatBytes(total), formatBytes(layerMemory.budget)))
+        stats = colorCache.stats()
+        self.memoryLabel.setToolTip('Memory held by the image layers / memory budget\n'
+                                    'Color space buffers : %s, %d hits, %d misses' %
+                                    (formatBytes(stats['size']), stats['hits'], stats['misses']))
+
     def updateRow(self, row):
         minInd, maxInd = self.model().index(row, 0), self.model().index(row, 3)
         self.model().dataChanged.emit(minInd, maxInd)
@@ -880,14 +914,14 @@ Note that upper visible layers slow down mask edition.<br>
             self.img.onImageChanged()
 
         def undoMask():
-            mask = layer.historyListMask.undo(saveitem=layer.mask.copy())
+            mask = layer.historyListMask.undo(layer.mask)
             if mask is not None:
                 layer.mask = mask
             layer.applyToStack()
             self.img.onImageChanged()
 
         def redoMask():
-            mask = layer.historyListMask.redo()
+            mask = layer.historyListMask.redo(layer.mask)
             if mask is not None:
                 layer.mask = mask
             layer.applyToStack()
@@ -21,9 +21,12 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
 from bLUeCore.bLUeLUT3D import LUT3D
+from settings import FUSION_LUT_SIZE
 
 LUTSIZE = LUT3D.defaultSize
 LUT3DIdentity = LUT3D(None, size=LUTSIZE)
+# identity 3D LUT for the halds of fused layers (cf. QLayer.applyToStack())
+LUT3DFusionIdentity = LUT3DIdentity if FUSION_LUT_SIZE == LUTSIZE else LUT3D(None, size=FUSION_LUT_SIZE)
 LUTSTEP = LUT3DIdentity.step
 LUT3D_ORI = LUT3DIdentity.LUT3DArray
 a,b,c,d = LUT3D_ORI.shape
@@ -0,0 +1,245 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+###############################################
+# Accounting of the memory held by the layers of
+# an image and enforcement of the memory budget
+# MEMORY_BUDGET (config.json). When the budget is
+# exceeded, recomputable buffers are released first :
+# color space buffers (cf. conversionCache.py), images of
+# the inactive preview levels, layer output cache, masked
+# image containers.
+# Next, the large ndarray caches of layers (cf.
+# QLayer.getSpillables()) are spilled to memory mapped
+# scratch files, and loaded back on access (cf. fault()).
+# Layer images and masks are QImage objects owning their
+# buffers : they are accounted, but never released.
+###############################################
+import tempfile
+
+import numpy as np
+from PySide2.QtGui import QImage, QPixmap
+
+from conversionCache import colorCache
+from outputCache import layerOutputCache
+from settings import MEMORY_BUDGET, MEMORY_SPILL_DIR
+
+
+def isSpilled(buf):
+    """
+    Return True if buf is an ndarray spilled to a scratch file.
+    @param buf:
+    @type buf: object
+    @return:
+    @rtype: boolean
+    """
+    return isinstance(buf, np.memmap) and buf._mmap is not None
+
+
+def fault(buf):
+    """
+    Load a spilled array back into memory. Other
+    objects are returned unchanged.
+    @param buf:
+    @type buf: object
+    @return:
+    @rtype: object
+    """
+    if isSpilled(buf):
+        return np.array(buf)
+    return buf
+
+
+def formatBytes(count):
+    """
+    Return a short readable string for a byte count.
+    @param count:
+    @type count: int
+    @return:
+    @rtype: str
+    """
+    if count >= 2**30:
+        return '%.1fG' % (count / 2**30)
+    return '%dM' % (count // 2**20)
+
+
+class memoryManager(object):
+    """
+    Accounts for the memory held by the layers of an
+    image and enforces a budget (cf. enforce()).
+    The manager must be called by the GUI thread
+    while no stack evaluation is in progress.
+    """
+    def __init__(self, budget, spillDir=None):
+        """
+        @param budget: max size (bytes)
+        @type budget: int
+        @param spillDir: directory of scratch files, None for the default temporary directory
+        @type spillDir: str
+        """
+        self.budget = budget
+        self.spillDir = spillDir
+
+    def sizeOf(self, obj, seen):
+        """
+        Return the size (bytes) of the memory held by an image, a pixmap
+        or an array. Spilled arrays (cf. spill()) are not counted.
+        Shared QImage objects (implicit sharing) and shared arrays are counted
+        once : seen holds the cache keys of the images and the ids of the arrays
+        already counted.
+        @param obj:
+        @type obj: QImage or QPixmap or ndarray
+        @param seen:
+        @type seen: set
+        @return:
+        @rtype: int
+        """
+        if isinstance(obj, QImage):
+            key = obj.cacheKey()
+            if key in seen:
+                return 0
+            seen.add(key)
+            return obj.bytesPerLine() * obj.height()
+        if isinstance(obj, QPixmap):
+            return obj.width() * obj.height() * obj.depth() // 8
+        if isinstance(obj, np.ndarray):
+            if isSpilled(obj) or ('array', id(obj)) in seen:
+                return 0
+            seen.add(('array', id(obj)))
+            return obj.nbytes
+        return 0
+
+    def getLayerBuffers(self, layer):
+        """
+        Return the images, pixmaps and arrays held by a layer.
+        @param layer:
+        @type layer: QLayer
+        @return:
+        @rtype: list
+        """
+        buffers = [layer, layer.thumb, layer.maskedImageContainer, layer.maskedThumbContainer, layer.rPixmap,
+                   layer.opacityMaskBuffer, layer.viewMask, getattr(layer, 'qPixmap', None), getattr(layer, 'sourceImg', None)]
+        # reading layer.mask would rebuild a compressed mask
+        buffers += layer.getMaskBuffers()
+        # mask before the current modification (cf. utils.maskHistory)
+        buffers.append(layer.historyListMask.pending)
+        for state in layer.previewStates.values():
+            # thumb, container and pixmap (cf. QLayer.swapPreviewLevel())
+            buffers += [state[0], state[1], state[4]]
+        buffers += list(layer.getSpillables().values())
+        return buffers
+
+    def getUsage(self, img):
+        """
+        Compute the memory held by each layer of img, including the
+        presentation layer, and the total memory held by the image, by
+        the layer output cache (cf. outputCache.py) and by the color space
+        buffers (cf. conversionCache.py). The memory held by
+        a layer is stored into layer.memoryUsage.
+        @param img:
+        @type img: mImage
+        @return: total size (bytes)
+        @rtype: int
+        """
+        seen = set()
+        total = self.sizeOf(img, seen) + self.sizeOf(img.thumb, seen) + layerOutputCache.size + colorCache.size
+        for layer in img.layersStack + [img.prLayer]:
+            layer.memoryUsage = sum(self.sizeOf(buf, seen) for buf in self.getLayerBuffers(layer)) + \
+                                layer.historyListMask.getSize()
+            total += layer.memoryUsage
+        return total
+
+    def getReleasers(self, img):
+        """
+        Return the actions releasing memory, in order of increasing cost :
+            - color space buffers,
+            - images of the inactive preview levels,
+            - layer output cache,
+            - masked image containers,
+            - spilling of large arrays (inactive layers first).
+        @param img:
+        @type img: mImage
+        @return:
+        @rtype: list of functions
+        """
+        active = img.getActiveLayer()
+        stack = img.layersStack
+        inactive = [layer for layer in stack if layer is not active]
+        releasers = []
+
+        def releaseStates(layer):
+            if None in layer.previewStates:
+                # the full size images must be evaluated again
+                img.fullRenderKey = None
+            layer.previewStates.clear()
+
+        def releaseContainers(layer):
+            layer.maskedImageContainer, layer.maskedThumbContainer = None, None
+
+        def spillBuffers(layer):
+            for name, buf in layer.getSpillables().items():
+                if isinstance(buf, np.ndarray) and not isSpilled(buf):
+                    setattr(layer, name, self.spill(buf))
+
+        releasers.append(colorCache.clear)
+        releasers += [lambda l=layer: releaseStates(l) for layer in stack + [img.prLayer]]
+        releasers.append(layerOutputCache.clear)
+        # the container of the top visible layer is the input of the presentation layer
+        top = img.prLayer.getTopVisibleStackIndex()
+        releasers += [lambda l=layer: releaseContainers(l) for layer in stack if layer.getStackIndex() != top]
+        releasers += [lambda l=layer: spillBuffers(l) for layer in inactive + [active] if layer is not None]
+        return releasers
+
+    def spill(self, buf):
+        """
+        Copy an array to a memory mapped scratch file. The file is
+        removed when the returned array is deleted.
+        @param buf:
+        @type buf: ndarray
+        @return:
+        @rtype: memmap
+        """
+        if buf.nbytes == 0:
+            return buf
+        with tempfile.TemporaryFile(dir=self.spillDir) as f:
+            mm = np.memmap(f, dtype=buf.dtype, mode='w+', shape=buf.shape)
+        mm[...] = buf
+        mm.flush()
+        return mm
+
+    def enforce(self, img):
+        """
+        Release or spill buffers of img until the total memory held by
+        the image is within the budget, then update the accounting
+        of layers (cf. getUsage()).
+        @param img:
+        @type img: mImage
+        @return: total size (bytes)
+        @rtype: int
+        """
+        total = self.getUsage(img)
+        if total <= self.budget:
+            return total
+        for release in self.getReleasers(img):
+            release()
+            total = self.getUsage(img)
+            if total <= self.budget:
+                break
+        return total
+
+
+layerMemory = memoryManager(MEMORY_BUDGET * 2**20, spillDir=MEMORY_SPILL_DIR or None)
@@ -0,0 +1,111 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+###############################################
+# Cache of layer output images, shared by all
+# layers and images. Outputs are indexed by the
+# fingerprint of the layer input and parameters
+# (cf. QLayer.getOutputKey()). The total size of the
+# cached images is bounded by OUTPUT_CACHE_SIZE (config.json) :
+# least recently used entries are evicted first.
+###############################################
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+
+from settings import OUTPUT_CACHE_SIZE
+
+
+def fingerprint(*items):
+    """
+    Return a short digest of a sequence of bytes
+    and str objects.
+    @param items:
+    @type items: bytes or str
+    @return:
+    @rtype: bytes
+    """
+    h = blake2b(digest_size=16)
+    for item in items:
+        h.update(item.encode() if isinstance(item, str) else item)
+        # separator
+        h.update(b'\0')
+    return h.digest()
+
+
+class outputCache(object):
+    """
+    LRU cache of ndarray objects, bounded by
+    the total size (in bytes) of the arrays.
+    The cache can be accessed concurrently by
+    the GUI thread and the stack evaluation worker.
+    """
+    def __init__(self, budget):
+        """
+        @param budget: max size (bytes)
+        @type budget: int
+        """
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the array cached for key, or None.
+        The array must not be modified.
+        @param key:
+        @type key: bytes
+        @return:
+        @rtype: ndarray
+        """
+        with self.lock:
+            buf = self.entries.get(key, None)
+            if buf is not None:
+                self.entries.move_to_end(key)
+            return buf
+
+    def put(self, key, buf):
+        """
+        Cache a copy of buf for key, evicting
+        the least recently used entries if needed.
+        Arrays larger than the budget are not cached.
+        @param key:
+        @type key: bytes
+        @param buf:
+        @type buf: ndarray
+        """
+        if buf.nbytes > self.budget:
+            return
+        buf = buf.copy()
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            while self.entries and self.size + buf.nbytes > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+            self.entries[key] = buf
+            self.size += buf.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+layerOutputCache = outputCache(OUTPUT_CACHE_SIZE * 2**20)
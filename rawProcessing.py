@@ -25,7 +25,7 @@ from PySide2.QtGui import QImage
 
 from bLUeCore.multi import interpMulti, chosenInterp
 from bLUeGui.bLUeImage import QImageBuffer, bImage
-from bLUeGui.colorCIE import rgbLinear2rgbVec, sRGB_lin2XYZInverse, bradfordAdaptationMatrix
+from bLUeGui.colorCIE import rgbLinear2rgb8Vec, sRGB_lin2XYZInverse, bradfordAdaptationMatrix
 from bLUeGui.graphicsSpline import channelValues
 from bLUeGui.histogramWarping import warpHistogram
 from debug import tdec
@@ -231,12 +231,19 @@ def rawPostProcess(rawLayer, pool=None):
     # before tone curve (cf. Adobe dng spec. p. 65)
     ##########################
     if doCameraLookTable:
-        hsvLUT = dngProfileLookTable(adjustForm.dngDict)
+        # the look table is rebuilt only when the profile changes,
+        # so its prepared state remains cached between calls.
+        cache = rawLayer.lookTableCache
+        if cache is not None and cache[0] is adjustForm.dngDict:
+            hsvLUT = cache[1]
+        else:
+            hsvLUT = dngProfileLookTable(adjustForm.dngDict)
+            rawLayer.lookTableCache = (adjustForm.dngDict, hsvLUT)
         if hsvLUT.isValid:
             divs = hsvLUT.divs
             steps = tuple([360 / divs[0], 1.0 / (divs[1] - 1), 1.0 / (divs[2] - 1)]) # TODO -1 added 16/01/18 validate
             interp = chosenInterp(pool, currentImage.width() * currentImage.height())
-            coeffs = interp(hsvLUT.data, steps, bufHSV_CV32, convert=False)
+            coeffs = interp(hsvLUT.getPrepared(steps), steps, bufHSV_CV32, convert=False)
             bufHSV_CV32[:, :, 0] = np.mod(bufHSV_CV32[:, :, 0] + coeffs[:, :, 0], 360)
             bufHSV_CV32[:, :, 1:] = bufHSV_CV32[:, :, 1:] * coeffs[:, :, 1:]
             np.clip(bufHSV_CV32, (0, 0, 0), (360, 1, 1), out=bufHSV_CV32)
@@ -290,15 +297,10 @@ def rawPostProcess(rawLayer, pool=None):
     bufpostF32_1 = cv2.cvtColor(bufHSV_CV32, cv2.COLOR_HSV2RGB)  #* 65535 # .astype(np.uint16)
     # np.clip(bufpostF32_1, 0, 1, out=bufpostF32_1) # TODO 8/11/18 removed
 
-    ###################
-    # apply gamma curve
-    ###################
-    bufpostF32_255 = rgbLinear2rgbVec(bufpostF32_1)
-    # np.clip(bufpostF32_255, 0, 255, out=bufpostF32_255)  # clip not needed after rgbLinear2rgbVec thresholds correction 8/11/18
-    #############################
-    # Conversion to 8 bits/channel
-    #############################
-    bufpostUI8 = bufpostF32_255.astype(np.uint8)  # (bufpost16.astype(np.float32) / 256).astype(np.uint8) TODO 5/11/18 changed
+    #####################################################
+    # apply gamma curve and convert to 8 bits/channel
+    #####################################################
+    bufpostUI8 = rgbLinear2rgb8Vec(bufpostF32_1)
     ###################################################
     # bufpostUI8 = (bufpost16/256).astype(np.uint8)
     #################################################
@@ -0,0 +1,416 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+#################################################
+# Asynchronous evaluation of the layer stack.
+# Requests are coalesced (latest wins) : a request
+# from layer k cancels the in-flight evaluation
+# at the next layer boundary, and the next evaluation
+# starts from the lowest layer still to be evaluated.
+# The worker thread never touches widgets or pixmaps :
+# they are updated by the GUI thread when a complete,
+# non stale, result is available (cf. onRendered()).
+# While a slider is dragged, the stack is evaluated
+# at a low resolution. When the mouse button is released,
+# it is evaluated at increasing resolutions (cf. climb()).
+# In preview mode, the full size stack is evaluated when
+# the user is idle (cf. startBackground()). The GUI thread
+# keeps the preview images : the worker thread gets the full
+# size images and caches of layers (cf. MarkedImg.levelAttribute),
+# saved by the GUI thread when it stops (cf. endBackground()).
+# Any interaction stops it without waiting for the worker :
+# long kernels poll the cancellation (cf. bLUeCore.cancellation),
+# and the full size images computed so far are kept.
+#################################################
+import threading
+import traceback
+
+from PySide2 import QtCore
+from PySide2.QtCore import QObject, Qt, QEvent, QTimer
+from PySide2.QtWidgets import QApplication
+
+from bLUeCore.cancellation import evaluationCancelled, setCancelCheck
+from bLUeGui.dialog import dlgWarn
+from settings import ASYNC_RENDER, BACKGROUND_RENDER, BACKGROUND_RENDER_DELAY
+
+
+def isGuiThread():
+    """
+    Return True if the current thread is the GUI thread
+    (i.e. the main thread).
+    @return:
+    @rtype: boolean
+    """
+    return threading.current_thread() is threading.main_thread()
+
+
+def isDragging():
+    """
+    Return True if the left mouse button is pressed : a slider
+    or a control point is probably dragged.
+    @return:
+    @rtype: boolean
+    """
+    return bool(QApplication.mouseButtons() & Qt.LeftButton)
+
+
+def runInGuiThread(img, f):
+    """
+    Call f at once in the GUI thread. In a worker thread,
+    the call is deferred until the evaluation result is shown.
+    @param img:
+    @type img: mImage
+    @param f:
+    @type f: function
+    """
+    if isGuiThread():
+        f()
+    else:
+        img.getScheduler().deferred.append(f)
+
+
+def lowerLayer(layer1, layer2):
+    """
+    Return the lower of two layers of the same stack.
+    A None layer is ignored.
+    @param layer1:
+    @type layer1: QLayer
+    @param layer2:
+    @type layer2: QLayer
+    @return:
+    @rtype: QLayer
+    """
+    if layer1 is None:
+        return layer2
+    if layer2 is None:
+        return layer1
+    return layer1 if layer1.getStackIndex() <= layer2.getStackIndex() else layer2
+
+
+class renderScheduler(QObject):
+    """
+    Evaluates the layer stack of an mImage in a worker thread.
+    The thread is started on demand and terminates when no
+    request is pending.
+    """
+    # emitted by the worker thread : generation of the completed evaluation
+    rendered = QtCore.Signal(int)
+    # emitted by the worker thread at the end of the background evaluation
+    backgroundDone = QtCore.Signal()
+
+    def __init__(self, img):
+        """
+        @param img:
+        @type img: mImage
+        """
+        super().__init__()
+        self.img = img
+        self.cond = threading.Condition()
+        # count of requests : an evaluation started for a
+        # previous generation is stale.
+        self.generation = 0
+        # lowest layer to evaluate, or None
+        self.pending = None
+        self.worker = None
+        # set by takeOver() : the worker stops at the next layer boundary
+        self.suspended = False
+        # callables to run in the GUI thread when the result is shown
+        self.deferred = []
+        # set while the full size stack is evaluated in the background,
+        # fingerprint of the evaluated stack (cf. mImage.getStackKey())
+        self.background = False
+        self.backgroundKey = None
+        # set while the background evaluation is pending, running,
+        # and until the full size caches are saved (cf. endBackground())
+        self.backgroundJob = False
+        self.backgroundRunning = False
+        self.unsaved = False
+        # set if the last background evaluation completed
+        self.backgroundComplete = False
+        # the background evaluation starts when the timer expires
+        self.idleTimer = QTimer()
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.timeout.connect(self.startBackground)
+        # the receiver lives in the GUI thread : the connection is queued
+        self.rendered.connect(self.onRendered, Qt.QueuedConnection)
+        self.backgroundDone.connect(self.onBackgroundDone, Qt.QueuedConnection)
+
+    def request(self, layer, background=False):
+        """
+        Schedule the evaluation of layer and of
+        the upper layers. The in-flight evaluation, if any,
+        is cancelled at the next layer boundary, or by
+        the kernel running (cf. bLUeCore.cancellation).
+        @param layer:
+        @type layer: QLayer
+        @param background: evaluate the full size stack (cf. startBackground())
+        @type background: boolean
+        """
+        with self.cond:
+            self.generation += 1
+            if self.backgroundJob:
+                # the background evaluation is not started
+                self.pending = None
+            self.pending = lowerLayer(self.pending, layer)
+            self.backgroundJob = background
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def isBusy(self):
+        """
+        Return True if an evaluation is pending or in progress.
+        @return:
+        @rtype: boolean
+        """
+        with self.cond:
+            return self.worker is not None
+
+    def takeOver(self):
+        """
+        Cancel the in-flight evaluation, if any, and wait for the worker
+        to stop. Return the lowest layer not yet evaluated, or None.
+        Called by the synchronous evaluation (cf. QLayer.applyToStack()).
+        @return:
+        @rtype: QLayer
+        """
+        self.stopBackground()
+        with self.cond:
+            self.generation += 1
+            self.suspended = True
+            while self.worker is not None:
+                self.cond.wait()
+            first, self.pending = self.pending, None
+            self.suspended = False
+        self.endBackground()
+        # run pending GUI updates of the cancelled evaluation
+        self.flushDeferred()
+        return first
+
+    def run(self):
+        """
+        Worker thread loop : evaluate the pending requests,
+        then terminate.
+        """
+        img = self.img
+        while True:
+            with self.cond:
+                if self.pending is None or self.suspended:
+                    self.worker = None
+                    self.cond.notify_all()
+                    return
+                first, generation, background = self.pending, self.generation, self.backgroundJob
+                self.pending, self.backgroundJob = None, False
+                self.backgroundRunning = background
+            # the form updates of the background evaluation are discarded
+            deferred = [] if background else self.deferred
+
+            def cancelled(layer):
+                # called at layer boundaries : the next layer
+                # to evaluate is put back into the pending requests.
+                # The background evaluation is restarted by startBackground().
+                with self.cond:
+                    if self.generation != generation:
+                        if not background:
+                            self.pending = lowerLayer(self.pending, layer)
+                        return True
+                return False
+
+            complete = False
+            img.backgroundMode.value = background
+            setCancelCheck(lambda: self.generation != generation)
+            try:
+                if first.evaluateStack(cancelled=cancelled, deferred=deferred) is None:
+                    if background:
+                        # blend the stack (cf. mImage.save())
+                        img.prLayer.inputImg()
+                    complete = True
+            except evaluationCancelled:
+                pass
+            except Exception as e:
+                traceback.print_exc()
+                with self.cond:
+                    stale = self.generation != generation
+                # the errors of a stale evaluation may be caused by changes
+                # made to the stack by the GUI thread : the next evaluation
+                # reports them, if they persist.
+                if not stale:
+                    # the warning is shown by the GUI thread (cf. dlgWarn())
+                    dlgWarn('Layer stack evaluation failed', info=str(e))
+            finally:
+                img.backgroundMode.value = False
+                setCancelCheck(None)
+            if background:
+                with self.cond:
+                    self.backgroundRunning = False
+                    self.backgroundComplete = complete
+                self.backgroundDone.emit()
+            elif complete:
+                self.rendered.emit(generation)
+
+    @QtCore.Slot(int)
+    def onRendered(self, generation):
+        """
+        Show the result of a completed evaluation, if it is not stale.
+        @param generation:
+        @type generation: int
+        """
+        with self.cond:
+            if generation != self.generation or self.pending is not None:
+                return
+        img = self.img
+        self.flushDeferred()
+        img.prLayer.execute(l=None, pool=None)
+        img.setModified(True)
+        img.onImageChanged()
+        img.enforceMemoryBudget()
+        self.climb()
+
+    @QtCore.Slot()
+    def onBackgroundDone(self):
+        """
+        Save the full size caches at the end of
+        the background evaluation.
+        """
+        if self.background:
+            self.background = False
+            QApplication.instance().removeEventFilter(self)
+        self.endBackground()
+
+    def watchRelease(self):
+        """
+        Start watching mouse button releases : the preview
+        ladder is climbed when the dragging ends.
+        """
+        QApplication.instance().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if self.background:
+            if event.type() in (QEvent.MouseButtonPress, QEvent.KeyPress, QEvent.Wheel,
+                                QEvent.MouseMove, QEvent.HoverMove):
+                # the user is not idle
+                self.stopBackground()
+                self.scheduleBackground()
+        elif event.type() == QEvent.MouseButtonRelease:
+            QTimer.singleShot(0, self.climb)
+        return False
+
+    def climb(self):
+        """
+        Evaluate the stack at the next preview level (cf. mImage.getPreviewLadder()),
+        if no evaluation is in progress and no slider is dragged.
+        """
+        img = self.img
+        if self.isBusy() or isDragging():
+            return
+        ladder = img.getPreviewLadder()
+        level = img.previewLevel
+        if level == ladder[-1] and img.useThumb == (level is not None):
+            QApplication.instance().removeEventFilter(self)
+            self.scheduleBackground()
+            return
+        level = ladder[ladder.index(level) + 1] if level in ladder[:-1] else ladder[-1]
+        img.requestPreviewLevel(level)
+
+    def scheduleBackground(self):
+        """
+        Start the background evaluation of the full size stack
+        after BACKGROUND_RENDER_DELAY ms, unless the timer is restarted.
+        """
+        if BACKGROUND_RENDER and self.img.previewBase is not None:
+            self.idleTimer.start(BACKGROUND_RENDER_DELAY)
+
+    def startBackground(self):
+        """
+        In preview mode, evaluate the full size stack in the worker thread, if it was
+        modified since its last evaluation (cf. mImage.getStackKey()). The GUI thread
+        keeps the preview images and caches, the worker thread gets those of the full
+        size level (cf. QLayer.beginBackground()) : any user interaction stops the
+        evaluation (cf. eventFilter()). Next evaluations, including the evaluation
+        done by mImage.save(), skip the layers already evaluated (cf. endBackground()).
+        """
+        img = self.img
+        if not (BACKGROUND_RENDER and ASYNC_RENDER) or img.previewBase is None or img.isHald or img.useHald:
+            return
+        if img.previewLevel != img.previewBase or not img.useThumb:
+            return
+        if img.displayWidget is not None and img.displayWidget.img is not img:
+            # the image was closed
+            return
+        if self.isBusy() or isDragging():
+            self.scheduleBackground()
+            return
+        # the last background evaluation may be unsaved
+        self.endBackground()
+        if not all(layer.isWorkerSafe() for layer in img.layersStack):
+            return
+        key = img.getStackKey()
+        if key is None or key == img.fullRenderKey:
+            return
+        for layer in img.layersStack + [img.prLayer]:
+            layer.beginBackground()
+        self.background, self.backgroundKey, self.unsaved = True, key, True
+        QApplication.instance().installEventFilter(self)
+        self.request(img.layersStack[0], background=True)
+
+    def stopBackground(self):
+        """
+        Stop the background evaluation of the full size stack, if any. The
+        worker stops at the next layer boundary or cancellation check
+        (cf. bLUeCore.cancellation) : the method does not wait for it.
+        """
+        if not self.background:
+            return
+        self.background = False
+        QApplication.instance().removeEventFilter(self)
+        with self.cond:
+            self.generation += 1
+            if self.backgroundJob:
+                # the background evaluation is not started
+                self.pending, self.backgroundJob = None, False
+        self.endBackground()
+
+    def endBackground(self):
+        """
+        Save the full size caches updated by the background evaluation
+        (cf. QLayer.endBackground()), if it is stopped. Called
+        by the GUI thread.
+        """
+        with self.cond:
+            if not self.unsaved or self.background or self.backgroundJob or self.backgroundRunning:
+                return
+            complete = self.backgroundComplete
+        self.unsaved = False
+        img = self.img
+        for layer in img.layersStack + [img.prLayer]:
+            layer.endBackground()
+        if complete:
+            img.fullRenderKey = self.backgroundKey
+        if not self.isBusy():
+            img.enforceMemoryBudget()
+
+    def flushDeferred(self):
+        """
+        Update the pixmaps and forms of the evaluated layers.
+        """
+        deferred, self.deferred = self.deferred, []
+        for f in deferred:
+            f()
+        for layer in self.img.layersStack:
+            if layer.pixmapStale:
+                layer.pixmapStale = False
+                layer.updatePixmap()
@@ -46,14 +46,65 @@ DNG_PROFILES_DIR2 = CONFIG["DNG_PROFILES"]["DIR2"]
 #############
 # 3D LUT
 ############
-# use tetrahedral interpolation instead of trilinear; trilinear is faster
+# use tetrahedral interpolation instead of trilinear; speeds are similar,
+# but fixed point trilinear (USE_FIXED_POINT) is faster
 USE_TETRA = CONFIG["ENV"]["USE_TETRA"]  # False
+# use fixed point trilinear interpolation for 8 bits images
+USE_FIXED_POINT = CONFIG["ENV"]["USE_FIXED_POINT"]  # True
+
+# 8 bits images : interpolate only distinct colors when
+# the ratio distinct colors / pixels is below UNIQUE_COLORS_MAX_RATIO
+UNIQUE_COLORS_MAX_RATIO = CONFIG["ENV"]["UNIQUE_COLORS_MAX_RATIO"]  # 0.5
+UNIQUE_COLORS_MIN_SIZE = CONFIG["ENV"]["UNIQUE_COLORS_MIN_SIZE"]  # 1000000
+
+# numeric kernels : "numpy", "numba" or "auto" (Numba if installed, cf. bLUeCore/registry.py)
+KERNEL_BACKEND = CONFIG["ENV"]["KERNEL_BACKEND"]  # "auto"
 
 ######################
 # parallel interpolation
 #######################
 USE_POOL = CONFIG["ENV"]["USE_POOL"] # True
 POOL_SIZE = CONFIG["ENV"]["POOL_SIZE"] # 4
+# exchange images with the pool through shared memory instead of pickling slices
+USE_SHARED_MEMORY = CONFIG["ENV"]["USE_SHARED_MEMORY"]  # True
+# parallel backend : "processes", "threads" or "serial"
+INTERP_BACKEND = CONFIG["ENV"]["INTERP_BACKEND"]  # "processes"
+
+##############
+# Layer fusion
+##############
+# evaluate runs of consecutive pointwise layers on a hald and apply them as a single 3D LUT
+FUSE_LAYERS = CONFIG["ENV"]["FUSE_LAYERS"]  # True
+# size of the fused 3D LUT : 33 or 65
+FUSION_LUT_SIZE = CONFIG["ENV"]["FUSION_LUT_SIZE"]  # 33
+# apply HSV, HSpB and Lab curves as an RGB 3D LUT (False : exact conversions)
+BAKE_CURVES = CONFIG["ENV"]["BAKE_CURVES"]  # True
+# size of the curve 3D LUT : 33 or 65
+CURVE_LUT_SIZE = CONFIG["ENV"]["CURVE_LUT_SIZE"]  # 33
+
+###################
+# Stack evaluation
+###################
+# evaluate the stack in a worker thread after changes in layer forms (cf. renderScheduler.py)
+ASYNC_RENDER = CONFIG["ENV"]["ASYNC_RENDER"]  # True
+# memory budget (MB) for the cache of layer output images (cf. outputCache.py)
+OUTPUT_CACHE_SIZE = CONFIG["ENV"]["OUTPUT_CACHE_SIZE"]  # 1024
+# memory budget (MB) for the cache of color space buffers (cf. conversionCache.py)
+CONVERSION_CACHE_SIZE = CONFIG["ENV"]["CONVERSION_CACHE_SIZE"]  # 512
+# preview the stack at a low resolution while dragging sliders (cf. mImage.getPreviewLadder())
+PREVIEW_LADDER = CONFIG["ENV"]["PREVIEW_LADDER"]  # True
+# min size (pixels) of the low resolution preview
+PREVIEW_DRAG_SIZE = CONFIG["ENV"]["PREVIEW_DRAG_SIZE"]  # 400
+# in preview mode, evaluate the full size stack when the user is idle (cf. renderScheduler.startBackground())
+BACKGROUND_RENDER = CONFIG["ENV"]["BACKGROUND_RENDER"]  # True
+# idle time (ms) before the background evaluation starts
+BACKGROUND_RENDER_DELAY = CONFIG["ENV"]["BACKGROUND_RENDER_DELAY"]  # 500
+# memory budget (MB) for the buffers held by the layers of an image (cf. memoryManager.py)
+MEMORY_BUDGET = CONFIG["ENV"]["MEMORY_BUDGET"]  # 8192
+# directory of the scratch files holding spilled buffers, default temporary directory if empty
+MEMORY_SPILL_DIR = CONFIG["ENV"]["MEMORY_SPILL_DIR"]  # ""
+# memory budget (MB) for the undo/redo history of each layer mask (cf. utils.maskHistory)
+MASK_HISTORY_SIZE = CONFIG["ENV"]["MASK_HISTORY_SIZE"]  # 64
 
 ########
 # Theme
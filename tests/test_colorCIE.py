@@ -0,0 +1,76 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+#################################################
+# The table driven sRGB <--> linear conversions
+# must agree with the analytic conversions
+# cl2cVec and c2clVec. Errors are measured
+# in range 0..255.
+#################################################
+import numpy as np
+import pytest
+
+from bLUeGui.colorCIE import cl2cVec, c2clVec, rgbLinear2rgbVec, rgbLinear2rgb8Vec, rgb2rgbLinearVec, \
+    gammaLinearTreshold1, ENCODE8_TABLE_SIZE
+
+size = 100000
+
+
+def linearImg():
+    """
+    Random linear values, range 0..1, with the ends of the range.
+    """
+    c = np.random.default_rng(0).uniform(0.0, 1.0, (1, size, 3))
+    c[0, :2, :] = np.array([0.0, 1.0])[:, None]
+    return c
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_rgbLinear2rgbVec(dtype):
+    c = linearImg()
+    result = rgbLinear2rgbVec(c, dtype=dtype)
+    assert result.dtype == dtype
+    assert result.shape == c.shape
+    assert np.max(np.abs(result - cl2cVec(c) * 255)) <= 1e-3
+
+
+def test_rgbLinear2rgbVec_no_interpolation():
+    c = linearImg()
+    result = rgbLinear2rgbVec(c, interpolate=False)
+    assert np.max(np.abs(result - cl2cVec(c) * 255)) <= 0.5
+
+
+def test_rgbLinear2rgb8Vec():
+    c = linearImg()
+    result = rgbLinear2rgb8Vec(c)
+    assert result.dtype == np.uint8
+    err = np.abs(result - cl2cVec(c) * 255)
+    # rounding error, and the distance to the nearest table node
+    far = np.abs(c - gammaLinearTreshold1) > 1.0 / ENCODE8_TABLE_SIZE
+    assert np.max(err[far]) <= 0.51
+    # cl2cVec is not continuous at gammaLinearTreshold1 : the nearest
+    # node may be on the other branch.
+    jump = (cl2cVec(gammaLinearTreshold1) - cl2cVec(np.nextafter(gammaLinearTreshold1, 1))) * 255
+    assert np.max(err) <= 0.51 + jump
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_rgb2rgbLinearVec(dtype):
+    x = np.arange(256, dtype=np.uint8)
+    result = rgb2rgbLinearVec(x, dtype=dtype)
+    assert result.dtype == dtype
+    assert np.max(np.abs(result - c2clVec(x / 255))) * 255 <= 1e-4
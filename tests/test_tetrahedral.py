@@ -0,0 +1,81 @@
+"""
+This File is part of bLUe software.
+
+Copyright (C) 2017  Bernard Virot <bernard.virot@libertysurf.fr>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+Lesser General Lesser Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+#################################################
+# interpTetra evaluates only the enclosing tetrahedron
+# of each pixel : it must agree with interpTetraSelect,
+# which evaluates the six tetrahedra.
+#################################################
+import numpy as np
+import pytest
+
+from bLUeCore.tetrahedral import interpTetra, interpTetraSelect
+
+size = 20000
+# 8 bits inputs, LUTSTEP = 8, with sentinels
+step = 8
+s = 256 // step + 2
+# float HSV inputs, H in [0, 360[, S, V in [0, 1[
+divs = (18, 8, 8)
+steps = (360.0 / divs[0], 1.0 / divs[1], 1.0 / divs[2])
+
+
+def uint8Img(rng):
+    return rng.integers(0, 256, (1, size, 3), dtype=np.uint8)
+
+
+def tiesImg(rng):
+    """
+    8 bits image with ties : the fractional parts of channels 0 and 1
+    are equal, channel 2 shares them on odd pixels.
+    """
+    img = (rng.integers(0, 256 // step, (1, size, 3)) * step).astype(np.uint8)
+    frac = rng.integers(0, step, (1, size, 2)).astype(np.uint8)
+    img[:, :, 0] += frac[:, :, 0]
+    img[:, :, 1] += frac[:, :, 0]
+    img[:, :, 2] += np.where(np.arange(size) % 2, frac[:, :, 0], frac[:, :, 1])
+    return img
+
+
+def hsvImg(rng):
+    return rng.uniform(0.0, 1.0, (1, size, 3)) * [360.0, 1.0, 1.0]
+
+
+cases = {'uint8': lambda rng: (rng.uniform(0, 255, (s, s, s, 3)), step, uint8Img(rng)),
+         'uint8 ties': lambda rng: (rng.uniform(0, 255, (s, s, s, 3)), step, tiesImg(rng)),
+         'uint8 4 channels': lambda rng: (rng.uniform(0, 255, (s, s, s, 4)), step, uint8Img(rng)),
+         'float HSV': lambda rng: (rng.uniform(-1, 1, tuple(d + 2 for d in divs) + (3,)), steps, hsvImg(rng))}
+
+
+@pytest.mark.parametrize('name', list(cases))
+def test_float_output(name):
+    LUT, LUTSTEP, img = cases[name](np.random.default_rng(0))
+    LUT = np.ascontiguousarray(LUT, dtype=np.float32)
+    expected = interpTetraSelect(LUT, np.array(LUTSTEP), img, convert=False)
+    result = interpTetra(LUT, LUTSTEP, img, convert=False)
+    assert result.shape == expected.shape
+    assert np.max(np.abs(result - expected)) <= 1e-4
+
+
+@pytest.mark.parametrize('name', ['uint8', 'uint8 ties', 'uint8 4 channels'])
+def test_uint8_output(name):
+    LUT, LUTSTEP, img = cases[name](np.random.default_rng(0))
+    LUT = np.ascontiguousarray(LUT, dtype=np.float32)
+    expected = interpTetraSelect(LUT, np.array(LUTSTEP), img)
+    result = interpTetra(LUT, LUTSTEP, img)
+    assert result.dtype == np.uint8
+    assert np.max(np.abs(result.astype(np.int16) - expected)) <= 1
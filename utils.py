@@ -17,6 +17,7 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import ctypes
 import threading
+import zlib
 from os.path import isfile, basename
 from itertools import product
 import numpy as np
@@ -28,8 +29,9 @@ from PySide2.QtWidgets import QListWidget, QListWidgetItem, \
 from PySide2.QtCore import Qt, QObject, QRect
 
 from bLUeCore.rollingStats import movingVariance
-from bLUeGui.bLUeImage import QImageBuffer
+from bLUeGui.bLUeImage import QImageBuffer, QImageConstBuffer
 from bLUeGui.baseSignal import baseSignal_No
+from settings import MASK_HISTORY_SIZE
 
 
 def qColorToRGB(color):
@@ -331,6 +333,139 @@ class historyList(list):
         return self.current > 0
 
 
+class maskHistory(object):
+    """
+    Undo/redo history of a layer mask.
+    Each item records a modification of the mask as the XOR of the mask
+    before and after the modification, restricted to the bounding rectangle
+    of the modified pixels and compressed with zlib. Items are applied in both
+    directions. The total size of the items is bounded by a budget :
+    the oldest items are dropped first.
+    Usage : addItem(mask) is called before modifying the mask, and commit(mask)
+    after the modification. The latter is optional : it is done by the next
+    call to addItem() or undo().
+    """
+
+    def __init__(self, budget=MASK_HISTORY_SIZE * 2**20):
+        """
+        @param budget: max size (bytes) of the history
+        @type budget: int
+        """
+        self.budget = budget
+        self.undoItems, self.redoItems = [], []
+        # mask before the current modification : the copy is
+        # shallow (implicit sharing), the modification detaches it
+        self.pending = None
+
+    def addItem(self, mask):
+        """
+        Start recording a modification of mask.
+        @param mask:
+        @type mask: QImage
+        """
+        self.commit(mask)
+        self.pending = QImage(mask)
+        self.redoItems = []
+
+    def commit(self, mask, rect=None):
+        """
+        End recording the current modification of mask, if any.
+        If rect is not None, the modification is known to lie in rect.
+        @param mask: modified mask
+        @type mask: QImage
+        @param rect: modified region
+        @type rect: QRect
+        """
+        before, self.pending = self.pending, None
+        if before is None:
+            return
+        if before.size() != mask.size():
+            # the mask was replaced : it can't be restored
+            self.undoItems = []
+            return
+        if rect is None:
+            rect = QRect(0, 0, mask.width(), mask.height())
+        rect = rect.intersected(QRect(0, 0, mask.width(), mask.height()))
+        if rect.isEmpty():
+            return
+        x0, y0 = rect.left(), rect.top()
+        buf0 = QImageConstBuffer(before)[y0:rect.bottom() + 1, x0:rect.right() + 1]
+        buf1 = QImageConstBuffer(mask)[y0:rect.bottom() + 1, x0:rect.right() + 1]
+        delta = np.bitwise_xor(buf0, buf1)
+        # bounding rectangle of the modified pixels
+        changed = np.any(delta, axis=2)
+        rows, cols = np.flatnonzero(np.any(changed, axis=1)), np.flatnonzero(np.any(changed, axis=0))
+        if len(rows) == 0:
+            return
+        delta = delta[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        self.undoItems.append((x0 + int(cols[0]), y0 + int(rows[0]), delta.shape, zlib.compress(delta.tobytes(), 1)))
+        # apply budget
+        size = self.getSize()
+        while size > self.budget and self.undoItems:
+            size -= len(self.undoItems.pop(0)[3])
+
+    def apply(self, mask, item):
+        """
+        Return a copy of mask with the modification
+        recorded by item applied (or reverted).
+        @param mask:
+        @type mask: QImage
+        @param item:
+        @type item: tuple
+        @return:
+        @rtype: QImage
+        """
+        x, y, shape, data = item
+        mask = mask.copy()
+        buf = QImageBuffer(mask)[y:y + shape[0], x:x + shape[1]]
+        buf ^= np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(shape)
+        return mask
+
+    def undo(self, mask):
+        """
+        Return the mask before the last recorded modification, or None.
+        @param mask: current mask
+        @type mask: QImage
+        @return:
+        @rtype: QImage
+        """
+        self.commit(mask)
+        if not self.undoItems:
+            return None
+        item = self.undoItems.pop()
+        self.redoItems.append(item)
+        return self.apply(mask, item)
+
+    def redo(self, mask):
+        """
+        Return the mask after the last undone modification, or None.
+        @param mask: current mask
+        @type mask: QImage
+        @return:
+        @rtype: QImage
+        """
+        self.commit(mask)
+        if not self.redoItems:
+            return None
+        item = self.redoItems.pop()
+        self.undoItems.append(item)
+        return self.apply(mask, item)
+
+    def canUndo(self):
+        return bool(self.undoItems) or self.pending is not None
+
+    def canRedo(self):
+        return bool(self.redoItems)
+
+    def getSize(self):
+        """
+        Return the size (bytes) of the recorded items.
+        @return:
+        @rtype: int
+        """
+        return sum(len(item[3]) for item in self.undoItems + self.redoItems)
+
+
 class optionsWidgetItem(QListWidgetItem):
     def __init__(self, *args, intName='', **kwargs, ):
         super().__init__(*args, **kwargs)
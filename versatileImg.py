@@ -20,7 +20,7 @@ from os.path import isfile
 from time import time
 import numpy as np
 
-from PySide2.QtCore import Qt, QRectF, QMargins
+from PySide2.QtCore import Qt, QRectF, QMargins, QSize
 
 import cv2
 from copy import copy
@@ -34,23 +34,27 @@ from bLUeGui.bLUeImage import bImage, ndarrayToQImage
 from bLUeCore.tetrahedral import interpTetra
 from bLUeCore.trilinear import interpTriLinear
 from bLUeCore.multi import interpMulti, chosenInterp
+from bLUeCore.uniqueColors import mapUnique
 
+from conversionCache import colorCache
 from debug import tdec
 from graphicsBlendFilter import blendFilterIndex
 
 from graphicsFilter import filterIndex
 from bLUeGui.histogramWarping import warpHistogram
-from bLUeGui.bLUeImage import QImageBuffer
-from bLUeGui.colorCube import rgb2hspVec, hsp2rgbVec, hsv2rgbVec
+from bLUeGui.bLUeImage import QImageBuffer, QImageConstBuffer
+from bLUeGui.colorCube import hsp2rgbVec, hsv2rgbVec
 from bLUeGui.blend import blendLuminosity
-from bLUeGui.colorCIE import sRGB2LabVec, Lab2sRGBVec, rgb2rgbLinearVec, \
-    rgbLinear2rgbVec, sRGB2XYZVec, sRGB_lin2XYZInverse, bbTemperature2RGB
+from bLUeGui.colorCIE import Lab2sRGBVec, linearPipeline, \
+    sRGB_lin2XYZ, sRGB_lin2XYZInverse, bbTemperature2RGB
 from bLUeGui.multiplier import temperatureAndTint2Multipliers
 from bLUeGui.dialog import dlgWarn
 from bLUeCore.kernel import getKernel
+from bLUeCore.bLUeLUT3D import LUT3D, HaldArray
 from lutUtils import LUT3DIdentity
 from rawProcessing import rawPostProcess
-from settings import USE_TETRA
+from renderScheduler import runInGuiThread
+from settings import USE_TETRA, BAKE_CURVES, CURVE_LUT_SIZE
 from utils import boundingRect, UDict
 from bLUeCore.dwtDenoising import dwtDenoiseChan
 
@@ -134,6 +138,21 @@ class vImage(bImage):
         buf[:, :, 3] = buf[:, :, 2]
         return mask
 
+    @staticmethod
+    def color2AlphaMask(mask):
+        """
+        Return the opacity mask built from mask as a Format_Alpha8
+        image (alpha = red channel), mask is kept unchanged.
+        It can replace color2OpacityMask() as source of the
+        mode DestinationIn, using a quarter of the memory.
+        @param mask: mask
+        @type mask: QImage
+        @return: opacity mask, and the array holding its buffer
+        @rtype: 2-uple QImage, ndarray
+        """
+        red = np.ascontiguousarray(QImageConstBuffer(mask)[:, :, 2])
+        return ndarrayToQImage(red[:, :, np.newaxis], format=QImage.Format_Alpha8), red
+
     @staticmethod
     def color2ViewMask(mask):
         """
@@ -165,7 +184,7 @@ class vImage(bImage):
         return True
 
     @classmethod
-    def visualizeMask(cls, img, mask, color=True, clipping=False, inplace=False):
+    def visualizeMask(cls, img, mask, color=True, clipping=False, inplace=False, opacityMask=None, viewMask=None):
         """
         Blend img with mask. By default, img is copied before blending.
         If inplace is True no copy is made.
@@ -174,6 +193,8 @@ class vImage(bImage):
         its red channel and, next, the mask is drawn over the image using the mode destinationIn :
         destination opacity is set to that of source.
         If clipping is True (default False), an opaque checker is drawn under the image.
+        If opacityMask (resp. viewMask) is not None, it is used as the opacity mask
+        (resp. colored representation) built from mask, and mask may be None.
         @param img:
         @type img: QImage
         @param mask:
@@ -184,6 +205,10 @@ class vImage(bImage):
         @type clipping: bool
         @param inplace:
         @type inplace: boolean
+        @param opacityMask: opacity mask (cf. color2OpacityMask(), color2AlphaMask())
+        @type opacityMask: QImage
+        @param viewMask: colored mask (cf. color2ViewMask())
+        @type viewMask: QImage
         @return:
         @rtype: QImage
         """
@@ -195,12 +220,13 @@ class vImage(bImage):
         if color:
             # draw mask over image
             qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
-            qp.drawImage(QRect(0, 0, img.width(), img.height()), cls.color2ViewMask(mask))
+            vmask = cls.color2ViewMask(mask) if viewMask is None else viewMask
+            qp.drawImage(QRect(0, 0, img.width(), img.height()), vmask)
         # opacity mask
         else:
             # mode DestinationIn (set image opacity to mask opacity)
             qp.setCompositionMode(QPainter.CompositionMode_DestinationIn)
-            omask = vImage.color2OpacityMask(mask)
+            omask = vImage.color2OpacityMask(mask) if opacityMask is None else opacityMask
             qp.drawImage(QRect(0, 0, img.width(), img.height()), omask)
         qp.end()
         return img
@@ -334,6 +360,9 @@ class vImage(bImage):
             rawMetadata = {}  # []  # TODO modified 21/11/18
         self.isModified = False
         self.rect = None
+        # region of the current image to recompute, or None for
+        # the whole image (cf. dirtySlices() and QLayer.evaluateStack())
+        self.dirtyRect = None
         self.isCropped = False
         self.cropTop, self.cropBottom, self.cropLeft, self.cropRight = (0,) * 4
         self.isRuled = False
@@ -347,6 +376,12 @@ class vImage(bImage):
         # Caching flag
         self.cachesEnabled = True
 
+        # path chosen by the last 3D LUT interpolation (cf. bLUeCore.uniqueColors.mapUnique)
+        self.interpStats = {}
+
+        # key and 3D LUT of the last curves applied as a 3D LUT (cf. applyBakedLUT())
+        self.bakedLUT = None
+
         # preview image.
         # The layer stack can be seen as
         # the juxtaposition of two stacks:
@@ -495,6 +530,23 @@ class vImage(bImage):
         else:
             return self
 
+    def forwardImage(self, img):
+        """
+        Pass through : forwards img to the current image.
+        The current image shares the buffer of img (Qt implicit
+        sharing), so no copy is made until one of the images is
+        modified (copy on write). The buffer is copied if the images
+        have different sizes or formats.
+        @param img: input image
+        @type img: QImage
+        """
+        currentImage = self.getCurrentImage()
+        if img.size() != currentImage.size() or img.format() != currentImage.format():
+            QImageBuffer(currentImage)[...] = QImageBuffer(img)
+            return
+        # currentImage keeps its python attributes
+        currentImage.swap(QImage(img))
+
     def full2CurrentXY(self, x, y):
         """
         Maps x,y coordinates of pixel in the full image to
@@ -512,43 +564,21 @@ class vImage(bImage):
             y = (y * currentImg.height()) / self.height()
         return int(x), int(y)
 
-    def getHspbBuffer(self):
+    def getColorBuffer(self, space, copy=False):
         """
-        return the image buffer in color mode HSpB.
-        The buffer is recalculated when needed.
-        @return: HSPB buffer
+        return the current image buffer in a color mode.
+        The buffer is shared with other images (cf. conversionCache.py),
+        unless caches are disabled.
+        @param space: 'HSpB', 'Lab' or 'HSV'
+        @type space: str
+        @param copy: return a private (writable) buffer
+        @type copy: boolean
+        @return: color buffer, read-only unless copy is True
         @rtype: ndarray
         """
-        # inputImage = self.inputImgFull().getCurrentImage()
-        if self.hspbBuffer is None or not self.cachesEnabled:
-            currentImage = self.getCurrentImage()
-            self.hspbBuffer = rgb2hspVec(QImageBuffer(currentImage)[:, :, :3][:, :, ::-1])
-        return self.hspbBuffer
-
-    def getLabBuffer(self):
-        """
-        return the image buffer in color mode Lab.
-        The buffer is recalculated when needed.
-        @return: Lab buffer, L range is 0..1, a, b ranges are -128..+128
-        @rtype: numpy ndarray, dtype np.float
-        """
-        if self.LabBuffer is None or not self.cachesEnabled:
-            currentImage = self.getCurrentImage()
-            self.LabBuffer = sRGB2LabVec(QImageBuffer(currentImage)[:, :, :3][:, :, ::-1])
-        return self.LabBuffer
-
-    def getHSVBuffer(self):
-        """
-        return the image buffer in color mode HSV.
-        The buffer is calculated if needed and cached.
-        H,S,V ranges are 0..255 (opencv convention for 8 bits images)
-        @return: HSV buffer
-        @rtype: numpy ndarray, dtype np.float
-        """
-        if self.HSVBuffer is None or not self.cachesEnabled:
-            currentImage = self.getCurrentImage()
-            self.HSVBuffer = cv2.cvtColor(QImageBuffer(currentImage)[:, :, :3], cv2.COLOR_BGR2HSV)
-        return self.HSVBuffer
+        currentImage = self.getCurrentImage()
+        return colorCache.getBuffer(currentImage.cacheKey(), space, QImageConstBuffer(currentImage), copy=copy,
+                                    cached=self.cachesEnabled)
 
     def setModified(self, b):
         """
@@ -640,13 +670,33 @@ class vImage(bImage):
         img.useHald = self.useHald
         return img
 
+    def dirtySlices(self, margin=0):
+        """
+        Return the region of the current image to recompute (cf. dirtyRect),
+        the region expanded by margin (clipped to the image) and the position of the
+        region in the expanded region. Regions are pairs of slices (rows, columns).
+        If dirtyRect or margin is None, the three regions cover the whole image.
+        @param margin: radius of the neighborhood read by the transformation
+        @type margin: int
+        @return: region, expanded region, relative region
+        @rtype: 3-uple of 2-uples of slice objects
+        """
+        current = self.getCurrentImage()
+        w, h = current.width(), current.height()
+        rect = self.dirtyRect
+        if rect is None or margin is None:
+            full = np.s_[0:h, 0:w]
+            return full, full, full
+        x1, y1, x2, y2 = rect.left(), rect.top(), rect.right() + 1, rect.bottom() + 1
+        ex1, ey1 = max(x1 - margin, 0), max(y1 - margin, 0)
+        ex2, ey2 = min(x2 + margin, w), min(y2 + margin, h)
+        return np.s_[y1:y2, x1:x2], np.s_[ey1:ey2, ex1:ex2], np.s_[y1 - ey1:y2 - ey1, x1 - ex1:x2 - ex1]
+
     def applyNone(self):
         """
         Pass through
         """
-        bufIn = QImageBuffer(self.inputImg())
-        bufOut = QImageBuffer(self.getCurrentImage())
-        bufOut[:, :, :] = bufIn
+        self.forwardImage(self.inputImg())
         self.updatePixmap()
 
     def applyCloning(self, seamless=True, showTranslated=False, moving=False):
@@ -675,9 +725,7 @@ class vImage(bImage):
         ########################
         # hald pass through
         if self.parentImage.isHald:
-            buf0 = QImageBuffer(imgIn)
-            buf1 = QImageBuffer(imgOut)
-            buf1[...] = buf0
+            self.forwardImage(imgIn)
             return
         ########################
         # erase previous transformed image : reset imgOut to ImgIn;
@@ -736,10 +784,7 @@ class vImage(bImage):
         # grabcut is done only when clicking the Apply button of segmentForm.
         # No grabcut for hald image
         if self.noSegment or self.parentImage.isHald:
-            inBuf = QImageBuffer(inputImg)
-            outputImg = self.getCurrentImage()
-            outBuf = QImageBuffer(outputImg)
-            outBuf[:, :, :] = inBuf
+            self.forwardImage(inputImg)
             self.updatePixmap()
             return
         ##################################################################
@@ -879,44 +924,29 @@ class vImage(bImage):
         """
         form = self.getGraphicsForm()
         exposureCorrection = form.expCorrection
+        region = self.dirtySlices()[0]
         # neutral point
         if abs(exposureCorrection) < 0.05:
-            buf0 = QImageBuffer(self.getCurrentImage())
-            buf1 = QImageBuffer(self.inputImg())
-            buf0[:, :, :] = buf1
+            self.forwardImage(self.inputImg())
             self.updatePixmap()
             return
-        bufIn = QImageBuffer(self.inputImg())
-        buf = bufIn[:, :, :3][:, :, ::-1]
-        # convert to linear
-        buf = rgb2rgbLinearVec(buf)
-        # apply correction
-        buf[:, :, :] = buf * (2 ** exposureCorrection)
-        np.clip(buf, 0.0, 1.0, out=buf)
-        # convert back to RGB
-        buf = rgbLinear2rgbVec(buf)
-        np.clip(buf, 0.0, 255.0, out=buf)
+        bufIn = QImageBuffer(self.inputImg())[region]
         currentImage = self.getCurrentImage()
-        ndImg1a = QImageBuffer(currentImage)
-        ndImg1a[:, :, :3][:, :, ::-1] = buf
+        ndImg1a = QImageBuffer(currentImage)[region]
+        # apply correction to linear values
+        linearPipeline().scale(2 ** exposureCorrection).apply(bufIn, ndImg1a)
         # forward the alpha channel
         ndImg1a[:, :, 3] = bufIn[:, :, 3]
         self.updatePixmap()
 
     def applyMixer(self, options):
         form = self.getGraphicsForm()
-        bufIn = QImageBuffer(self.inputImg())
-        buf = bufIn[:, :, :3][:, :, ::-1]
-        # convert to linear
-        buf = rgb2rgbLinearVec(buf)
-        # mix channels
+        region = self.dirtySlices()[0]
+        bufIn = QImageBuffer(self.inputImg())[region]
         currentImage = self.getCurrentImage()
-        bufOut = QImageBuffer(currentImage)
-        buf = np.tensordot(buf, form.mixerMatrix, axes=(-1, -1))
-        np.clip(buf, 0, 1.0, out=buf)
-        # convert back to RGB
-        buf = rgbLinear2rgbVec(buf)
-        bufOut[:, :, :3][:, :, ::-1] = buf
+        bufOut = QImageBuffer(currentImage)[region]
+        # mix linear channels
+        linearPipeline().transform(form.mixerMatrix).apply(bufIn, bufOut)
         # forward the alpha channel
         bufOut[:, :, 3] = bufIn[:, :, 3]
         self.updatePixmap()
@@ -949,8 +979,7 @@ class vImage(bImage):
             return
         # neutral point
         if T.isIdentity():
-            buf1 = QImageBuffer(inImg)
-            buf0[:, :, :] = buf1
+            self.forwardImage(inImg)
             self.updatePixmap()
             return
         # get the bounding rect of the transformed image (in the full size image coordinate system)
@@ -974,6 +1003,24 @@ class vImage(bImage):
     def applyImage(self, options):
         self.applyTransForm(options)
 
+    def noiseMargin(self, options):
+        """
+        Return the radius of the neighborhood of a pixel read by
+        the noise reduction method selected in options, or None if
+        the method is global (wavelets).
+        @param options:
+        @type options: UDict
+        @return:
+        @rtype: int
+        """
+        if options['Bilateral']:
+            # diameter 9 or 15
+            return 8
+        if options['NLMeans']:
+            # template window 7, search window 21
+            return 13
+        return None
+
     def applyNoiseReduction(self):
         """
         Wavelets, bilateral filtering, NLMeans
@@ -982,15 +1029,15 @@ class vImage(bImage):
         noisecorr = adjustForm.noiseCorrection
         currentImage = self.getCurrentImage()
         inputImage = self.inputImg()
-        buf0 = QImageBuffer(inputImage)
-        buf1 = QImageBuffer(currentImage)
         ########################
         # hald pass through and neutral point
         if self.parentImage.isHald or noisecorr == 0:
-            buf1[...] = buf0
+            self.forwardImage(inputImage)
             self.updatePixmap()
             return
         ########################
+        buf0 = QImageBuffer(inputImage)
+        buf1 = QImageBuffer(currentImage)
         w, h = self.width(), self.height()
         r = inputImage.width() / w
         if self.rect is not None:
@@ -1006,9 +1053,13 @@ class vImage(bImage):
             # reset output image
             buf1[:, :, :] = buf0
             ROI1 = buf1[slices]
+            region = inner = np.s_[:, :]
         else:
-            ROI0 = buf0[:, :, :3]
-            ROI1 = buf1[:, :, :3]
+            # region to recompute and neighborhood read by the filter
+            # (cf. QLayer.getDirtyMargin())
+            region, expanded, inner = self.dirtySlices(margin=self.noiseMargin(adjustForm.options))
+            ROI0 = buf0[expanded][:, :, :3]
+            ROI1 = buf1[region][:, :, :3]
         buf01 = ROI0[:, :, ::-1]
         noisecorr *= currentImage.width() / self.width()
         if adjustForm.options['Wavelets']:
@@ -1022,7 +1073,7 @@ class vImage(bImage):
             np.clip(B, 0, 255, out=B)
             bufLab = np.dstack((L, A, B))
             # back to RGB
-            ROI1[:, :, ::-1] = cv2.cvtColor(bufLab.astype(np.uint8), cv2.COLOR_Lab2RGB)
+            ROI1[:, :, ::-1] = cv2.cvtColor(bufLab.astype(np.uint8), cv2.COLOR_Lab2RGB)[inner]
         elif adjustForm.options['Bilateral']:
             ROI1[:, :, ::-1] = cv2.bilateralFilter(buf01,
                                          9 if self.parentImage.useThumb else 15,    # 21:5.5s, 15:3.5s, diameter of
@@ -1032,12 +1083,12 @@ class vImage(bImage):
                                                                                     # in color space,  100 middle value
                                          50 if self.parentImage.useThumb else 150,  # std deviation sigma
                                                                                     # in coordinate space,  100 middle value
-                                         )
+                                         )[inner]
         elif adjustForm.options['NLMeans']:
-            ROI1[:, :, ::-1] = cv2.fastNlMeansDenoisingColored(buf01, None, 1+noisecorr, 1+noisecorr, 7, 21)  # hluminance, hcolor,  last params window sizes 7, 21 are recommended values
+            ROI1[:, :, ::-1] = cv2.fastNlMeansDenoisingColored(buf01, None, 1+noisecorr, 1+noisecorr, 7, 21)[inner]  # hluminance, hcolor,  last params window sizes 7, 21 are recommended values
 
         # forward the alpha channel
-        buf1[:, :, 3] = buf0[:, :, 3]
+        buf1[region][:, :, 3] = buf0[region][:, :, 3]
         self.updatePixmap()
 
     def applyRawPostProcessing(self, pool=None):
@@ -1066,20 +1117,20 @@ class vImage(bImage):
         satCorrection = adjustForm.satCorrection
         brightnessCorrection = adjustForm.brightnessCorrection
         inputImage = self.inputImg()
-        tmpBuf = QImageBuffer(inputImage)
         currentImage = self.getCurrentImage()
-        ndImg1a = QImageBuffer(currentImage)
         # neutral point : by pass
         if contrastCorrection == 0 and satCorrection == 0 and brightnessCorrection == 0:
-            ndImg1a[:, :, :] = tmpBuf
+            self.forwardImage(inputImage)
             self.updatePixmap()
             return
+        tmpBuf = QImageConstBuffer(inputImage)
+        ndImg1a = QImageBuffer(currentImage)
         ##########################
         # Lab mode (slower than HSV)
         ##########################
         if version == 'Lab':
             # get l channel (range 0..1)
-            LBuf = inputImage.getLabBuffer().copy()
+            LBuf = inputImage.getLabBuffer(copy=True)
             if brightnessCorrection != 0:
                 alpha = (-adjustForm.brightnessCorrection + 1.0)
                 # tabulate x**alpha
@@ -1104,7 +1155,7 @@ class vImage(bImage):
                                                 spline=None if auto else self.getMmcSpline())
                     # show the spline viewer
                     if self.autoSpline and options['manualCurve']:
-                        self.getGraphicsForm().setContrastSpline(a, b, d, T)
+                        runInGuiThread(self.parentImage, lambda: self.getGraphicsForm().setContrastSpline(a, b, d, T))
                         self.autoSpline = False
                 LBuf[:, :, 0] = res
             # saturation
@@ -1120,7 +1171,7 @@ class vImage(bImage):
         ###########
         else:
             # get HSV buffer (H, S, V are in range 0..255)
-            HSVBuf = inputImage.getHSVBuffer().copy()
+            HSVBuf = inputImage.getHSVBuffer(copy=True)
             if brightnessCorrection != 0:
                 alpha = 1.0 / (0.501 + adjustForm.brightnessCorrection) - 1.0  # approx. map -0.5...0.0...0.5 --> +inf...1.0...0.0
                 # tabulate x**alpha
@@ -1146,7 +1197,7 @@ class vImage(bImage):
                     res = (res*255.0).astype(np.uint8)
                     # show the spline viewer
                     if self.autoSpline and options['manualCurve']:
-                        self.getGraphicsForm().setContrastSpline(a, b, d, T)
+                        runInGuiThread(self.parentImage, lambda: self.getGraphicsForm().setContrastSpline(a, b, d, T))
                         self.autoSpline = False
                 HSVBuf[:, :, 2] = res
             if satCorrection != 0:
@@ -1172,18 +1223,17 @@ class vImage(bImage):
         """
         if options is None:
             options = UDict()
+        region = self.dirtySlices()[0]
         # neutral point: by pass
         if not np.any(stackedLUT - np.arange(256)):  # last dims are equal : broadcast works
-            buf1 = QImageBuffer(self.inputImg())
-            buf2 = QImageBuffer(self.getCurrentImage())
-            buf2[:, :, :] = buf1
+            self.forwardImage(self.inputImg())
             self.updatePixmap()
             return
         inputImage = self.inputImg()
         currentImage = self.getCurrentImage()
         # get image buffers
-        ndImg0a = QImageBuffer(inputImage)
-        ndImg1a = QImageBuffer(currentImage)
+        ndImg0a = QImageBuffer(inputImage)[region]
+        ndImg1a = QImageBuffer(currentImage)[region]
         ndImg0 = ndImg0a[:, :, :3]
         ndImg1 = ndImg1a[:, :, :3]
         # apply LUTS to channels
@@ -1196,27 +1246,22 @@ class vImage(bImage):
         ndImg1a[:, :, 3] = ndImg0a[:, :, 3]
         self.updatePixmap()
 
-    def applyLab1DLUT(self, stackedLUT, options=None):
+    @staticmethod
+    def lab1DLUT2RGB(img, stackedLUT):
         """
-        Applies 1D LUTS (one row for each L,a,b channel)
-        @param stackedLUT: array of color values (in range 0..255). Shape must be (3, 255) : a row for each channel
+        Applies 1D LUTS to the L, a, b channels of img and converts
+        the result back to sRGB (cf. applyLab1DLUT()).
+        @param img:
+        @type img: bImage
+        @param stackedLUT: array of color values (in range 0..255), a row for each channel
         @type stackedLUT: ndarray shape=(3,256) dtype=int or float
-        @param options: not used yet
+        @return: RGB image
+        @rtype: ndarray, dtype=float, range 0..255
         """
-        if options is None:
-            options = UDict()
-        # neutral point
-        if not np.any(stackedLUT - np.arange(256)):  # last dims are equal : broadcast is working
-            buf1 = QImageBuffer(self.inputImg())
-            buf2 = QImageBuffer(self.getCurrentImage())
-            buf2[:, :, :] = buf1
-            self.updatePixmap()
-            return
         # convert LUT to float to speed up  buffer conversions
         stackedLUT = stackedLUT.astype(np.float)
         # get the Lab input buffer
-        Img0 = self.inputImg()
-        ndLabImg0 = Img0.getLabBuffer()  # copy()
+        ndLabImg0 = img.getLabBuffer()
         # conversion functions
 
         def scaleLabBuf(buf):
@@ -1240,11 +1285,136 @@ class vImage(bImage):
         ndsRGBImg1 = Lab2sRGBVec(ndLabImg1)
         # in place clipping
         np.clip(ndsRGBImg1, 0, 255, out=ndsRGBImg1)  # mandatory
+        return ndsRGBImg1
+
+    @staticmethod
+    def hspb1DLUT2RGB(img, stackedLUT):
+        """
+        Applies 1D LUTS to the hue, sat and perceptual brightness channels
+        of img and converts the result back to sRGB (cf. applyHSPB1DLUT()).
+        @param img:
+        @type img: bImage
+        @param stackedLUT: array of color values (in range 0..255), a row for each channel
+        @type stackedLUT: ndarray shape=(3,256) dtype=int or float
+        @return: RGB image
+        @rtype: ndarray, dtype=np.uint8
+        """
+        ndHSPBImg0 = img.getHspbBuffer()   # time 2s with cache disabled for 15 Mpx
+        # apply LUTS to normalized channels (range 0..255)
+        ndLImg0 = (ndHSPBImg0 * [255.0/360.0, 255.0, 255.0]).astype(np.uint8)
+        # rList = np.array([0,1,2]) # H,S,B
+        ndHSBPImg1 = np.zeros(ndLImg0.shape, dtype=np.uint8)
+        s = ndLImg0[:, :, 0].shape
+        for c in range(3):  # 0.36s for 15Mpx
+            ndHSBPImg1[:, :, c] = np.take(stackedLUT[c, :], ndLImg0[:, :, c].reshape((-1,))).reshape(s)
+        # ndHSBPImg1 = stackedLUT[rList, ndLImg0] * [360.0/255.0, 1/255.0, 1/255.0]
+        # back to sRGB
+        ndRGBImg1 = hsp2rgbVec(ndHSBPImg1)
+        # in place clipping
+        np.clip(ndRGBImg1, 0, 255, out=ndRGBImg1)  # mandatory
+        return ndRGBImg1
+
+    @staticmethod
+    def hsv1DLUT2RGB(img, stackedLUT):
+        """
+        Applies 1D LUTS to the hue, sat and brightness channels
+        of img and converts the result back to sRGB (cf. applyHSV1DLUT()).
+        @param img:
+        @type img: bImage
+        @param stackedLUT: array of color values (in range 0..255), a row for each channel
+        @type stackedLUT: ndarray shape=(3,256) dtype=int or float
+        @return: RGB image
+        @rtype: ndarray, dtype=np.uint8
+        """
+        # convert LUT to float to speed up  buffer conversions
+        stackedLUT = stackedLUT.astype(np.float)
+        # get HSV buffer, range H: 0..180, S:0..255 V:0..255
+        HSVImg0 = img.getHSVBuffer()
+        # apply LUTS
+        HSVImg1 = np.zeros(HSVImg0.shape, dtype=np.uint8)
+        s = HSVImg0[:, :, 0].shape
+        for c in range(3):  # 0.43s for 15Mpx
+            HSVImg1[:, :, c] = np.take(stackedLUT[c, :], HSVImg0[:, :, c].reshape((-1,))).reshape(s)
+        # back to sRGB
+        RGBImg1 = hsv2rgbVec(HSVImg1, cvRange=True)
+        # in place clipping
+        np.clip(RGBImg1, 0, 255, out=RGBImg1)  # mandatory
+        return RGBImg1
+
+    @staticmethod
+    def bakeLUT(convert, stackedLUT):
+        """
+        Builds the RGB 3D LUT (BGR order) of the pointwise transformation
+        convert(img, stackedLUT), applying it to the identity hald of
+        size CURVE_LUT_SIZE.
+        @param convert: transformation of a bImage, returning an RGB array
+        @type convert: function
+        @param stackedLUT: array of color values (in range 0..255), a row for each channel
+        @type stackedLUT: ndarray shape=(3,256) dtype=int or float
+        @return:
+        @rtype: LUT3D
+        """
+        identity = LUT3DIdentity if CURVE_LUT_SIZE == LUT3DIdentity.size else LUT3D(None, size=CURVE_LUT_SIZE)
+        s = int(identity.size ** (3.0 / 2.0)) + 1
+        hald = bImage(QSize(s, s), QImage.Format_ARGB32)
+        buf = QImageBuffer(hald)
+        buf[:, :, :3] = identity.toHaldArray(s, s).haldBuffer
+        buf[:, :, 3] = 255
+        buf[:, :, :3][:, :, ::-1] = convert(hald, stackedLUT)
+        return LUT3D.HaldBuffer2LUT3D(HaldArray(buf, identity.size))
+
+    def useBakedLUT(self):
+        """
+        Returns True if curves are applied as an RGB 3D LUT (cf. applyBakedLUT()).
+        The exact conversions are used when the stack is evaluated on a hald.
+        @return:
+        @rtype: boolean
+        """
+        img = self.parentImage
+        return BAKE_CURVES and not (img.useHald or img.isHald)
+
+    def applyBakedLUT(self, convert, stackedLUT, pool=None):
+        """
+        Applies the pointwise transformation convert(img, stackedLUT) as an RGB 3D LUT,
+        which is built when stackedLUT changes (cf. bakeLUT()). Only
+        the region to recompute (cf. dirtySlices()) is interpolated.
+        @param convert: transformation of a bImage, returning an RGB array
+        @type convert: function
+        @param stackedLUT: array of color values (in range 0..255), a row for each channel
+        @type stackedLUT: ndarray shape=(3,256) dtype=int or float
+        @param pool: multiprocessing pool
+        @type pool: multiprocessing.Pool
+        """
+        key = (convert.__name__, stackedLUT.dtype.str, stackedLUT.tobytes())
+        if self.bakedLUT is None or self.bakedLUT[0] != key:
+            self.bakedLUT = (key, self.bakeLUT(convert, stackedLUT))
+        LUT = self.bakedLUT[1]
+        self.apply3DLUT(LUT.getPrepared(), LUT.step, options={'use selection': False, 'keep alpha': True}, pool=pool)
+
+    def applyLab1DLUT(self, stackedLUT, options=None):
+        """
+        Applies 1D LUTS (one row for each L,a,b channel)
+        @param stackedLUT: array of color values (in range 0..255). Shape must be (3, 255) : a row for each channel
+        @type stackedLUT: ndarray shape=(3,256) dtype=int or float
+        @param options: not used yet
+        """
+        if options is None:
+            options = UDict()
+        # neutral point
+        if not np.any(stackedLUT - np.arange(256)):  # last dims are equal : broadcast is working
+            self.forwardImage(self.inputImg())
+            self.updatePixmap()
+            return
+        if self.useBakedLUT():
+            self.applyBakedLUT(vImage.lab1DLUT2RGB, stackedLUT)
+            return
+        Img0 = self.inputImg()
+        ndsRGBImg1 = self.lab1DLUT2RGB(Img0, stackedLUT)
         currentImage = self.getCurrentImage()
         ndImg1 = QImageBuffer(currentImage)
         ndImg1[:, :, :3][:, :, ::-1] = ndsRGBImg1
         # forward the alpha channel
-        ndImg0 = QImageBuffer(Img0)
+        ndImg0 = QImageConstBuffer(Img0)
         ndImg1[:, :, 3] = ndImg0[:, :, 3]
         # update
         self.updatePixmap()
@@ -1256,38 +1426,27 @@ class vImage(bImage):
         @type stackedLUT : ndarray shape=(3,256) dtype=int or float
         @param options: not used yet
         @type options : dictionary
-        @param pool: multiprocessing pool : unused
+        @param pool: multiprocessing pool, used by the 3D LUT interpolation only
         @type pool: muliprocessing.Pool
         """
         if options is None:
             options = UDict()
         # neutral point
         if not np.any(stackedLUT - np.arange(256)):  # last dims are equal : broadcast is working
-            buf1 = QImageBuffer(self.inputImg())
-            buf2 = QImageBuffer(self.getCurrentImage())
-            buf2[:, :, :] = buf1
+            self.forwardImage(self.inputImg())
             self.updatePixmap()
             return
+        if self.useBakedLUT():
+            self.applyBakedLUT(vImage.hspb1DLUT2RGB, stackedLUT, pool=pool)
+            return
         Img0 = self.inputImg()
-        ndHSPBImg0 = Img0.getHspbBuffer()   # time 2s with cache disabled for 15 Mpx
-        # apply LUTS to normalized channels (range 0..255)
-        ndLImg0 = (ndHSPBImg0 * [255.0/360.0, 255.0, 255.0]).astype(np.uint8)
-        # rList = np.array([0,1,2]) # H,S,B
-        ndHSBPImg1 = np.zeros(ndLImg0.shape, dtype=np.uint8)
-        s = ndLImg0[:, :, 0].shape
-        for c in range(3):  # 0.36s for 15Mpx
-            ndHSBPImg1[:, :, c] = np.take(stackedLUT[c, :], ndLImg0[:, :, c].reshape((-1,))).reshape(s)
-        # ndHSBPImg1 = stackedLUT[rList, ndLImg0] * [360.0/255.0, 1/255.0, 1/255.0]
-        # back to sRGB
-        ndRGBImg1 = hsp2rgbVec(ndHSBPImg1)  # time 4s for 15 Mpx
-        # in place clipping
-        np.clip(ndRGBImg1, 0, 255, out=ndRGBImg1)  # mandatory
+        ndRGBImg1 = self.hspb1DLUT2RGB(Img0, stackedLUT)
         # set current image to modified image
         currentImage = self.getCurrentImage()
         ndImg1a = QImageBuffer(currentImage)
         ndImg1a[:, :, :3][:, :, ::-1] = ndRGBImg1
         # forward the alpha channel
-        ndImg0 = QImageBuffer(Img0)
+        ndImg0 = QImageConstBuffer(Img0)
         ndImg1a[:, :, 3] = ndImg0[:, :, 3]
         # update
         self.updatePixmap()
@@ -1299,39 +1458,27 @@ class vImage(bImage):
         @type stackedLUT : ndarray shape=(3,256) dtype=int or float
         @param options: not used yet
         @type options : Udict
-        @param pool: multiprocessing pool : unused
+        @param pool: multiprocessing pool, used by the 3D LUT interpolation only
         @type pool: muliprocessing.Pool
         """
         # neutral point
         if options is None:
             options = UDict()
         if not np.any(stackedLUT - np.arange(256)):  # last dims are equal : broadcast is working
-            buf1 = QImageBuffer(self.inputImg())
-            buf2 = QImageBuffer(self.getCurrentImage())
-            buf2[:, :, :] = buf1
+            self.forwardImage(self.inputImg())
             self.updatePixmap()
             return
-        # convert LUT to float to speed up  buffer conversions
-        stackedLUT = stackedLUT.astype(np.float)
-        # get HSV buffer, range H: 0..180, S:0..255 V:0..255
+        if self.useBakedLUT():
+            self.applyBakedLUT(vImage.hsv1DLUT2RGB, stackedLUT, pool=pool)
+            return
         Img0 = self.inputImg()
-        HSVImg0 = Img0.getHSVBuffer()
-        HSVImg0 = HSVImg0.astype(np.uint8)
-        # apply LUTS
-        HSVImg1 = np.zeros(HSVImg0.shape, dtype=np.uint8)
-        s = HSVImg0[:, :, 0].shape
-        for c in range(3):  # 0.43s for 15Mpx
-            HSVImg1[:, :, c] = np.take(stackedLUT[c, :], HSVImg0[:, :, c].reshape((-1,))).reshape(s)
-        # back to sRGB
-        RGBImg1 = hsv2rgbVec(HSVImg1, cvRange=True)
-        # in place clipping
-        np.clip(RGBImg1, 0, 255, out=RGBImg1)  # mandatory
+        RGBImg1 = self.hsv1DLUT2RGB(Img0, stackedLUT)
         # set current image to modified image
         currentImage = self.getCurrentImage()
         ndImg1a = QImageBuffer(currentImage)
         ndImg1a[:, :, :3][:, :, ::-1] = RGBImg1
         # forward the alpha channel
-        ndImg0 = QImageBuffer(Img0)
+        ndImg0 = QImageConstBuffer(Img0)
         ndImg1a[:, :, 3] = ndImg0[:, :, 3]
         # update
         self.updatePixmap()
@@ -1357,19 +1504,25 @@ class vImage(bImage):
                 dlgWarn("Empty selection\nSelect a region with the marquee tool")
                 return
             # reset layer image
-            bufOut[:,:,:] = QImageBuffer(inputImage)
+            bufOut[:,:,:] = QImageConstBuffer(inputImage)
         else:
             w1, w2, h1, h2 = 0, self.inputImg().width(), 0, self.inputImg().height()
         # get HSV buffer, range H: 0..180, S:0..255 V:0..255
-        HSVImg0 = inputImage.getHSVBuffer()
-        HSVImg0 = HSVImg0.astype(np.float)
-        HSVImg0[:,:,0] *= 2
-        bufHSV_CV32 = HSVImg0[h1:h2 + 1, w1:w2 + 1, :]
+        HSVImg0 = inputImage.getHSVBuffer()[h1:h2 + 1, w1:w2 + 1, :]
+        bufHSV_CV32 = HSVImg0.astype(np.float)
+        bufHSV_CV32[:,:,0] *= 2
 
         divs = LUT.divs
         steps = tuple([360 / divs[0], 255.0 / divs[1], 255.0 / divs[2]])
-        interp = chosenInterp(pool, (w2 - w1) * (h2 - h1))
-        coeffs = interp(LUT.data, steps, bufHSV_CV32, convert=False)
+
+        def f(buf):
+            buf = buf.astype(float)
+            buf[:, :, 0] *= 2
+            interp = chosenInterp(pool, buf.shape[0] * buf.shape[1])
+            return interp(LUT.getPrepared(steps), steps, buf, convert=False)
+
+        # the 8 bits HSV buffer is used to interpolate distinct colors only
+        coeffs = mapUnique(f, HSVImg0, stats=self.interpStats)
         bufHSV_CV32[:, :, 0] = np.mod(bufHSV_CV32[:, :, 0] + coeffs[:, :, 0], 360)
         bufHSV_CV32[:, :, 1:] = bufHSV_CV32[:, :, 1:] * coeffs[:, :, 1:]
         np.clip(bufHSV_CV32, (0, 0, 0), (360, 255, 255), out=bufHSV_CV32)
@@ -1380,26 +1533,32 @@ class vImage(bImage):
         bufOut[h1:h2 + 1, w1:w2 + 1, :3] = bufpostF32_1[:,:,::-1]
         self.updatePixmap()
 
-    def apply3DLUT(self, LUT, LUTSTEP, options=None, pool=None):
+    def apply3DLUT(self, LUT, LUTSTEP, options=None, pool=None, inputImage=None):
         """
         Apply a 3D LUT to the current view of the image (self or self.thumb).
-        If pool is not None and the size of the current view is > 3000000,
+        If pool is not None and the size of the current view is > multi.parallelThreshold,
         parallel interpolation on image slices is used.
         If options['keep alpha'] is False, alpha channel is interpolated too.
+        Otherwise, only the distinct colors of the image are interpolated, unless
+        their count is too high (cf. bLUeCore.uniqueColors.mapUnique). The path used
+        is recorded in self.interpStats.
         The order of LUT axes, LUT channels and image channels must be BGR.
-        @param LUT: LUT3D array (cf. colorCube.py)
-        @type LUT: 3d ndarray, dtype = int
+        @param LUT: LUT3D array (cf. colorCube.py) or prepared LUT (cf. LUT3D.getPrepared())
+        @type LUT: 3d ndarray, dtype = int, or PreparedLUT
         @param LUTSTEP:
         @type LUTSTEP:
         @param options:
         @type options: UDict
         @param pool:
         @type pool:
+        @param inputImage: input image, default self.inputImg()
+        @type inputImage: bImage
         """
         if options is None:
             options = UDict()
         # get buffers
-        inputImage = self.inputImg()
+        if inputImage is None:
+            inputImage = self.inputImg()
         currentImage = self.getCurrentImage()
         # get selection
         w1, w2, h1, h2 = (0.0,) * 4
@@ -1415,9 +1574,10 @@ class vImage(bImage):
             if w1 >= w2 or h1 >= h2:
                 dlgWarn("Empty selection\nSelect a region with the marquee tool")
                 return
-        # use image
+        # use image, or the region to recompute
         else:
-            w1, w2, h1, h2 = 0, self.inputImg().width(), 0, self.inputImg().height()
+            rows, cols = self.dirtySlices()[0]
+            w1, w2, h1, h2 = cols.start, cols.stop - 1, rows.start, rows.stop - 1
         inputBuffer = QImageBuffer(inputImage)[h1:h2 + 1, w1:w2 + 1, :]
         imgBuffer = QImageBuffer(currentImage)[:, :, :]
         interpAlpha = not options['keep alpha']
@@ -1428,10 +1588,14 @@ class vImage(bImage):
         else:
             ndImg0 = inputBuffer[:, :, :3]
             ndImg1 = imgBuffer[:, :, :3]
-        # choose the right interpolation method
-        interp = chosenInterp(pool, (w2 - w1) * (h2 - h1))
-        # apply LUT
-        ndImg1[h1:h2 + 1, w1:w2 + 1, :] = interp(LUT, LUTSTEP, ndImg0)
+        # choose the right interpolation method, depending on the size of the interpolated array
+        f = lambda buf: chosenInterp(pool, buf.shape[0] * buf.shape[1])(LUT, LUTSTEP, buf)
+        # apply LUT. For 3 channels, interpolate distinct colors only
+        # (mapUnique falls back to f for images with too many colors).
+        if interpAlpha:
+            ndImg1[h1:h2 + 1, w1:w2 + 1, :] = f(ndImg0)
+        else:
+            ndImg1[h1:h2 + 1, w1:w2 + 1, :] = mapUnique(f, ndImg0, stats=self.interpStats)
         if not interpAlpha:
             # forward the alpha channel
             imgBuffer[h1:h2 + 1, w1:w2 + 1, 3] = inputBuffer[:, :, 3]
@@ -1445,14 +1609,14 @@ class vImage(bImage):
         adjustForm = self.getGraphicsForm()
         inputImage = self.inputImg()
         currentImage = self.getCurrentImage()
-        buf0 = QImageBuffer(inputImage)
-        buf1 = QImageBuffer(currentImage)
         ########################
         # hald pass through
         if self.parentImage.isHald:
-            buf1[...] = buf0
+            self.forwardImage(inputImage)
             return
         ########################
+        buf0 = QImageBuffer(inputImage)
+        buf1 = QImageBuffer(currentImage)
         w, h = self.width(), self.height()
         r = inputImage.width() / w
         if self.rect is not None:
@@ -1468,24 +1632,27 @@ class vImage(bImage):
             # reset output image
             buf1[:, :, :] = buf0
             ROI1 = buf1[slices]
+            region = inner = np.s_[:, :]
         else:
-            ROI0 = buf0[:, :, :3]
-            ROI1 = buf1[:, :, :3]
+            # region to recompute and neighborhood read by the filter
+            region, expanded, inner = self.dirtySlices(margin=int(adjustForm.radius * r) + 1)
+            ROI0 = buf0[expanded][:, :, :3]
+            ROI1 = buf1[region][:, :, :3]
         # kernel based filtering
         if adjustForm.kernelCategory in [filterIndex.IDENTITY, filterIndex.UNSHARP,
                                          filterIndex.SHARPEN, filterIndex.BLUR1, filterIndex.BLUR2]:
             # correct radius for preview if needed
             radius = int(adjustForm.radius * r)
             kernel = getKernel(adjustForm.kernelCategory, radius, adjustForm.amount)
-            ROI1[:, :, :] = cv2.filter2D(ROI0, -1, kernel)
+            ROI1[:, :, :] = cv2.filter2D(ROI0, -1, kernel)[inner]
         else:
             # bilateral filtering
             radius = int(adjustForm.radius * r)
             sigmaColor = 2 * adjustForm.tone
             sigmaSpace = sigmaColor
-            ROI1[:, :, ::-1] = cv2.bilateralFilter(ROI0[:, :, ::-1], radius, sigmaColor, sigmaSpace)
+            ROI1[:, :, ::-1] = cv2.bilateralFilter(ROI0[:, :, ::-1], radius, sigmaColor, sigmaSpace)[inner]
         # forward the alpha channel
-        buf1[:, :, 3] = buf0[:, :, 3]
+        buf1[region][:, :, 3] = buf0[region][:, :, 3]
         self.updatePixmap()
 
     def applyBlendFilter(self):
@@ -1495,14 +1662,14 @@ class vImage(bImage):
         adjustForm = self.getGraphicsForm()
         inputImage = self.inputImg()
         currentImage = self.getCurrentImage()
-        buf0 = QImageBuffer(inputImage)
-        buf1 = QImageBuffer(currentImage)
         ########################
         # hald pass through
         if self.parentImage.isHald:
-            buf1[...] = buf0
+            self.forwardImage(inputImage)
             return
         ########################
+        buf0 = QImageBuffer(inputImage)
+        buf1 = QImageBuffer(currentImage)
         r = inputImage.width() / self.width()
         ####################
         # We blend a neutral filter with density range 0.5*s...0.5 with the image b,
@@ -1565,8 +1732,7 @@ class vImage(bImage):
         currentImage = self.getCurrentImage()
         # neutral point : forward input image and return
         if abs(temperature - 6500) < 200 and tint == 0:
-            buf0 = QImageBuffer(currentImage)
-            buf0[:, :, :] = buf1
+            self.forwardImage(inputImage)
             self.updatePixmap()
             return
         ################
@@ -1587,7 +1753,8 @@ class vImage(bImage):
             # by blending it with the inputImage, using mode luminosity.
             # Note that using perceptual brightness gives better results, unfortunately slower
             resImg = blendLuminosity(filter, inputImage)
-            bufOutRGB = QImageBuffer(resImg)[:, :, :3][:, :, ::-1]
+            bufOut0 = QImageBuffer(currentImage)
+            bufOut0[:, :, :3] = QImageBuffer(resImg)[:, :, :3]
         #####################
         # Chromatic adaptation
         #####################
@@ -1605,24 +1772,83 @@ class vImage(bImage):
             """
             # get RGB multipliers
             m1, m2, m3, _ = temperatureAndTint2Multipliers(temperature, 2 ** tint, sRGB_lin2XYZInverse)
-            buf = QImageBuffer(inputImage)[:, :, :3]
-            bufXYZ = sRGB2XYZVec(buf[:, :, ::-1])
-            bufsRGBLinear = np.tensordot(bufXYZ, sRGB_lin2XYZInverse, axes=(-1, -1))
-            # apply multipliers
-            bufsRGBLinear *= [m1, m2, m3]
-            # brightness correction
-            M = np.max(bufsRGBLinear)
-            bufsRGBLinear /= M
-            bufOutRGB = rgbLinear2rgbVec(bufsRGBLinear)
-            np.clip(bufOutRGB, 0, 255, out=bufOutRGB)
-            bufOutRGB = bufOutRGB.astype(np.uint8)
+            # sRGB --> XYZ --> sRGB, apply multipliers and
+            # brightness correction, in a single pass
+            pipeline = linearPipeline().transform(sRGB_lin2XYZ).transform(sRGB_lin2XYZInverse)
+            pipeline.scale([m1, m2, m3]).normalize(buf1)
+            bufOut0 = QImageBuffer(currentImage)
+            pipeline.apply(buf1, bufOut0)
         else:
             raise ValueError('applyTemperature : wrong option')
-        # set output image
-        bufOut0 = QImageBuffer(currentImage)
-        bufOut = bufOut0[:, :, :3]
-        bufOut[:, :, ::-1] = bufOutRGB
         # forward the alpha channel
         bufOut0[:, :, 3] = buf1[:, :, 3]
         self.updatePixmap()
 
+
+class compactMask(object):
+    """
+    Compact representation of a layer mask (cf. vImage) : the red
+    channel is kept as a uint8 plane, the validity flag (G == invalidG)
+    and the alpha channel (255 or 128) as bit planes, i.e. 10 bits per pixel
+    instead of 32. The mask can't be modified : the ARGB32 mask is
+    rebuilt by toQImage(). The opacity mask (cf. vImage.color2AlphaMask())
+    is a view of the red plane.
+    """
+    @classmethod
+    def fromQImage(cls, mask):
+        """
+        Returns the compact representation of mask, or None if the
+        channels of mask hold values which can't be represented.
+        @param mask:
+        @type mask: QImage
+        @return:
+        @rtype: compactMask
+        """
+        buf = QImageConstBuffer(mask)
+        invalid = buf[:, :, 1] == vImage.invalidG
+        opaque = buf[:, :, 3] == 255
+        if np.any(buf[:, :, 0]) or np.any(buf[:, :, 1][~invalid]) or np.any(buf[:, :, 3][~opaque] != 128):
+            return None
+        return cls(np.ascontiguousarray(buf[:, :, 2]), np.packbits(invalid), np.packbits(opaque), mask.cacheKey())
+
+    def __init__(self, red, invalid, opaque, key):
+        """
+        @param red: red channel
+        @type red: ndarray, shape (h, w), dtype uint8
+        @param invalid: packed validity flags
+        @type invalid: ndarray, dtype uint8
+        @param opaque: packed alpha flags
+        @type opaque: ndarray, dtype uint8
+        @param key: cache key of the represented mask
+        @type key: int
+        """
+        self.red, self.invalid, self.opaque = red, invalid, opaque
+        self.key = key
+
+    def buffers(self):
+        return [self.red, self.invalid, self.opaque]
+
+    def toQImage(self):
+        """
+        Returns the represented mask.
+        @return:
+        @rtype: QImage
+        """
+        h, w = self.red.shape
+        count = h * w
+        mask = QImage(w, h, QImage.Format_ARGB32)
+        buf = QImageBuffer(mask)
+        buf[:, :, 0] = 0
+        buf[:, :, 1] = np.where(np.unpackbits(self.invalid, count=count).reshape(h, w), vImage.invalidG, 0)
+        buf[:, :, 2] = self.red
+        buf[:, :, 3] = np.where(np.unpackbits(self.opaque, count=count).reshape(h, w), 255, 128)
+        return mask
+
+    def alphaMask(self):
+        """
+        Returns the opacity mask (cf. vImage.color2AlphaMask()), sharing
+        its buffer with self.
+        @return: opacity mask, and the array holding its buffer
+        @rtype: 2-uple QImage, ndarray
+        """
+        return ndarrayToQImage(self.red[:, :, np.newaxis], format=QImage.Format_Alpha8), self.red